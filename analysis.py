@@ -0,0 +1,151 @@
+from nltk.tokenize import sent_tokenize, word_tokenize
+from nltk.stem import WordNetLemmatizer
+
+# WordNet part of speech of verbs, which every indexed term is lemmatized as
+VERB = 'v'
+
+def split_sentences(text):
+    return sent_tokenize(text)
+
+def fold_case(text):
+    # Remove trailing special characters + Case-fold
+    return [text.strip().lower()]
+
+def split_words(text):
+    # The text is already a sentence, so word_tokenize does not need to split it into sentences again
+    return word_tokenize(text, preserve_line=True)
+
+def split_sentences_and_words(text):
+    return word_tokenize(text)
+
+# Stages that a tokenizer chain can be made of, by name. Each stage splits a piece of text into
+# smaller pieces, and the pieces left after the last stage are the tokens.
+TOKENIZERS = {'sentences': split_sentences, 'lower': fold_case, 'words': split_words,
+    'nltk-words': split_sentences_and_words}
+
+# Tokenizer chain of documents. Sentences are split on the original text, as the capitalization
+# helps find sentence boundaries, which matter as word_tokenize splits off the period ending each
+# sentence.
+INDEX_CHAIN = ('sentences', 'lower', 'words')
+
+# Tokenizer chain used before the analyzer, which gives the same tokens as INDEX_CHAIN but splits each
+# sentence into sentences once more in word_tokenize
+LEGACY_INDEX_CHAIN = ('sentences', 'lower', 'nltk-words')
+
+# Tokenizer chain of queries, which are case-folded after tagging, as the tagger and the boolean
+# operator AND are case sensitive
+QUERY_CHAIN = ('nltk-words',)
+
+class Analyzer:
+    """
+    Text analysis pipeline shared by indexing (index.py) and queries (query.py): a chain of
+    tokenizer stages (see TOKENIZERS), then WordNet lemmatization.
+
+    Lemmas are cached by (token, part of speech), since the vocabulary is tiny compared to the
+    number of tokens, so each distinct token is only lemmatized once per analyzer.
+
+    Variables:
+        chain  (tuple): Names of the tokenizer stages, in order
+        lemmas  (dict): Cache of lemmas by part of speech then token, or None to not cache lemmas
+        hits     (int): Number of lemmas found in the cache
+        misses   (int): Number of lemmas computed by the lemmatizer
+    """
+    def __init__(self, chain=INDEX_CHAIN, cache_lemmas=True):
+        """
+        Args:
+            chain       (tuple): Names of the tokenizer stages, in order
+            cache_lemmas (bool): True to cache lemmas
+        """
+        for stage in chain:
+            if stage not in TOKENIZERS:
+                raise Exception(f"No such tokenizer stage: {stage}, expected one of {', '.join(TOKENIZERS)}")
+
+        self.chain = tuple(chain)
+        self.stages = [TOKENIZERS[stage] for stage in chain]
+        self.lemmatizer = WordNetLemmatizer()
+        self.lemmas = {} if cache_lemmas else None
+        self.hits = 0
+        self.misses = 0
+
+    def tokenize(self, text):
+        """
+        Splits text into tokens with the tokenizer chain
+        Args:
+            text  (str): Text to tokenize
+        Returns:
+            (list): Tokens, in order
+        """
+        pieces = [text]
+        for stage in self.stages:
+            pieces = [smaller_piece for piece in pieces for smaller_piece in stage(piece)]
+        return pieces
+
+    def lemmatize(self, token, pos=VERB):
+        """
+        Lemmatizes a token
+        Args:
+            token (str): Token to lemmatize
+            pos   (str): WordNet part of speech of the token
+        Returns:
+            (str): Lemma of the token
+        """
+        if self.lemmas == None:
+            return self.lemmatizer.lemmatize(token, pos=pos)
+
+        pos_lemmas = self.lemmas.get(pos)
+        if pos_lemmas != None and token in pos_lemmas:
+            self.hits += 1
+            return pos_lemmas[token]
+        return self.add_lemma(token, pos)
+
+    def add_lemma(self, token, pos):
+        """
+        Lemmatizes a token that is not in the lemma cache, and adds it to the cache
+        Args:
+            token (str): Token to lemmatize
+            pos   (str): WordNet part of speech of the token
+        Returns:
+            (str): Lemma of the token
+        """
+        self.misses += 1
+        lemma = self.lemmatizer.lemmatize(token, pos=pos)
+        self.lemmas.setdefault(pos, {})[token] = lemma
+        return lemma
+
+    def analyze(self, text, pos=VERB):
+        """
+        Splits text into tokens and lemmatizes them all as the same part of speech
+        Args:
+            text (str): Text to analyze
+            pos  (str): WordNet part of speech of the tokens
+        Returns:
+            (list): Terms, in order
+        """
+        tokens = self.tokenize(text)
+        if self.lemmas == None:
+            return [self.lemmatizer.lemmatize(token, pos=pos) for token in tokens]
+
+        # Same as lemmatize, but with the lookups of the cache inlined, as this runs for every token
+        # of every document
+        misses = self.misses
+        pos_lemmas = self.lemmas.setdefault(pos, {})
+        terms = [pos_lemmas[token] if token in pos_lemmas else self.add_lemma(token, pos) for token in tokens]
+        self.hits += len(tokens) - (self.misses - misses)
+        return terms
+
+# Analyzers of each tokenizer chain, shared by everything analyzed in the process
+analyzers = {}
+
+def get_analyzer(chain=INDEX_CHAIN):
+    """
+    Returns the analyzer of a tokenizer chain that is shared by the process, so that its lemma
+    cache is filled once
+    Args:
+        chain (tuple): Names of the tokenizer stages, in order
+    Returns:
+        (Analyzer): Shared analyzer
+    """
+    chain = tuple(chain)
+    if chain not in analyzers:
+        analyzers[chain] = Analyzer(chain)
+    return analyzers[chain]
@@ -0,0 +1,199 @@
+import os
+import time
+import multiprocessing
+from collections import Counter
+
+from search import open_index, index_files, read_query, refine_query, write_result
+from phrases import rank
+from cache import QueryCache, MISSING
+
+# Scoring engine and k of the batch, inherited by the worker processes that refine and score its queries
+batch_model = None
+batch_k = None
+
+def read_queries(query_file):
+    """
+    Reads the queries of a query file. A multi-query file holds several queries in the format of a
+    query file, separated by blank lines.
+    Args:
+        query_file (str): File path of input query file
+    Returns:
+        (list): Query - document_ids of the relevant documents pairs, see read_query
+    """
+    queries = []
+    lines = []
+    with open(query_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                lines.append(line)
+            elif lines:
+                queries.append(read_query(lines))
+                lines = []
+    if lines:
+        queries.append(read_query(lines))
+    return queries
+
+def output_files(query_file, count, out_dir, base_dir=None):
+    """
+    Names the output files of the queries of a query file: a query file with one query is written
+    to a file of the same path relative to base_dir in out_dir, and the queries of a multi-query
+    file are numbered
+    Args:
+        query_file (str): File path of input query file
+        count      (int): Number of queries in the query file
+        out_dir    (str): Directory of the output files
+        base_dir   (str): Directory that the query files of the batch are in, see common_directory,
+                          or None to keep the name of the query file only
+    Returns:
+        (list): File path of the output file of each query
+    """
+    name = os.path.basename(query_file) if base_dir == None else os.path.relpath(os.path.abspath(query_file), base_dir)
+    if count == 1:
+        return [os.path.join(out_dir, name)]
+
+    stem, ext = os.path.splitext(name)
+    return [os.path.join(out_dir, f"{stem}_{i}{ext}") for i in range(1, count + 1)]
+
+def common_directory(query_files):
+    """
+    Finds the deepest directory that holds every query file of a batch, so that query files of the
+    same name in different directories get different output files
+    Args:
+        query_files (list): File paths of input query files
+    Returns:
+        (str): Absolute path of the directory
+    """
+    return os.path.commonpath([os.path.dirname(os.path.abspath(query_file)) for query_file in query_files])
+
+def refine(query_and_relevant_docs):
+    """
+    Refines a query of the batch, see search.refine_query
+    Args:
+        query_and_relevant_docs (tuple): Query - document_ids of the relevant documents pair
+    Returns:
+        (QueryDetails): Refined free text query, or None if the query is invalid
+    """
+    query, lst_of_relevant_docs = query_and_relevant_docs
+    return refine_query(query, lst_of_relevant_docs, batch_model.synonyms)
+
+def score(refined_query):
+    """
+    Scores a refined query of the batch with the scoring engine of the batch
+    Args:
+        refined_query (QueryDetails): Refined free text query, or None if the query is invalid
+    Returns:
+        (list): Descending list of internal documentId-score pairs by score
+    """
+    if refined_query == None:
+        return []
+    return rank(batch_model, refined_query, batch_k)
+
+def map_queries(function, queries, workers):
+    """
+    Applies a function to every query, in parallel if there are several workers
+    Args:
+        function (function): Function of a single query
+        queries      (list): Queries
+        workers       (int): Number of worker processes
+    Returns:
+        (list): Result of each query, in order
+    """
+    if workers <= 1:
+        return list(map(function, queries))
+
+    # Forked workers share the scoring engine, along with the postings decoded ahead of scoring,
+    # without pickling them
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        return pool.map(function, queries)
+
+def run_batch(dict_file, postings_file, query_files, out_dir, engine='python', k=None, postings_budget=None, workers=1,
+    cache_budget=None, query_cache_file=None, query_mode='phrase'):
+    """
+    Using the given dictionary file and postings file, perform searching on every query of the given
+    query files and output the results of each query to its own file in out_dir, see output_files.
+    The index is opened once for the whole batch, and the postings of each term are fetched and
+    decoded once, however many queries it appears in. Repeated queries are refined and scored once,
+    through a query cache, which can also be persisted between runs.
+    Args:
+        dict_file     (str): File path of input dictionary file
+        postings_file (str): File path of input posting file
+        query_files  (list): File paths of input query files or multi-query files
+        out_dir       (str): Directory of the output files
+        engine        (str): Name of the scoring engine, see search.ENGINES
+        k             (int): Number of documents to return, or None for all matching documents
+        postings_budget (int): Maximum number of postings scored by the saat engine, or None for no limit
+        workers       (int): Number of worker processes used for refining and scoring queries
+        cache_budget  (int): Maximum decoded size in bytes of the posting cache, or None for no limit
+        query_cache_file (str): File path of the query cache persisted between runs, or None to keep it in memory only
+        query_mode    (str): How queries with phrases are ranked, see phrases.QUERY_MODES
+    """
+    global batch_model, batch_k
+    print('running search on the batch of queries...')
+    start = time.perf_counter()
+
+    batch_model = open_index(dict_file, postings_file, engine, postings_budget, cache_budget, query_mode)
+    batch_k = k
+    doc_ids = batch_model.document_weights.doc_ids
+
+    queries = []
+    results_files = []
+    base_dir = common_directory(query_files)
+    for query_file in query_files:
+        file_queries = read_queries(query_file)
+        queries += file_queries
+        results_files += output_files(query_file, len(file_queries), out_dir, base_dir)
+    # A query file given twice, or a numbered output file of a multi-query file that another query
+    # file is named like, would overwrite results
+    duplicates = sorted(results_file for results_file, count in Counter(results_files).items() if count > 1)
+    if duplicates:
+        raise Exception("Several queries would be written to " + ", ".join(duplicates))
+
+    # Repeated queries are refined and scored once, and queries in the query cache not at all
+    query_cache = QueryCache(index_files(dict_file, postings_file), query_cache_file)
+    keys = [query_cache.refined_key(query, lst_of_relevant_docs) for query, lst_of_relevant_docs in queries]
+    results = {}
+    refined_queries = {}
+    to_refine = []
+    for key in dict.fromkeys(keys):
+        result = query_cache.get_results(batch_model, *key, k)
+        if result is not MISSING:
+            results[key] = result
+            continue
+        refined_query = query_cache.get_refined(*key)
+        if refined_query is MISSING:
+            to_refine.append(key)
+        else:
+            refined_queries[key] = refined_query
+
+    for key, refined_query in zip(to_refine, map_queries(refine, to_refine, workers)):
+        refined_queries[key] = refined_query
+        query_cache.put_refined(*key, refined_query)
+    refined = time.perf_counter()
+
+    # Expanded queries share many terms, so their postings are decoded once before scoring
+    terms = set()
+    for refined_query in refined_queries.values():
+        if refined_query != None:
+            terms.update(refined_query.terms)
+            terms.update(refined_query.expansions)
+    batch_model.prefetch(terms)
+    prefetched = time.perf_counter()
+
+    to_score = list(refined_queries)
+    for key, result in zip(to_score, map_queries(score, [refined_queries[key] for key in to_score], workers)):
+        results[key] = result
+        query_cache.put_results(batch_model, *key, k, result)
+    scored = time.perf_counter()
+    query_cache.save()
+
+    for results_file, key in zip(results_files, keys):
+        os.makedirs(os.path.dirname(results_file), exist_ok=True)
+        with open(results_file, 'w') as r_file:
+            write_result(r_file, results[key], doc_ids)
+
+    print(f"{len(queries)} queries, {len(to_score)} scored, {len(terms)} distinct terms")
+    print(f"refined in {refined - start:.3f} s, prefetched in {prefetched - refined:.3f} s, scored in {scored - prefetched:.3f} s")
+    # With several workers, the lookups made while scoring are counted by the workers
+    print(batch_model.posting_cache)
+    print(query_cache)
+    print(f"total {time.perf_counter() - start:.3f} s, {len(queries) / (time.perf_counter() - start):.2f} queries/s")
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import getopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nltk.tokenize import sent_tokenize, word_tokenize
+from nltk.stem import WordNetLemmatizer
+from index import init_csvreader, read_entries, TITLE, CONTENT
+from analysis import Analyzer, INDEX_CHAIN, LEGACY_INDEX_CHAIN
+
+"""
+Usage:
+python3 benchmarks/analysis.py -i <dataset_file> [-r <repeats>]
+
+eg
+python3 benchmarks/analysis.py -i tests/data_100.csv
+this will analyze the title and content of every document of the dataset with each text analysis
+pipeline, from the one that index.py used before the Analyzer to the cached Analyzer that it uses
+now, and report their throughput in tokens per second, and whether they give the same terms
+"""
+
+def legacy_analyze(data):
+    """
+    Analyzes a zone the way index.py did before the Analyzer: a new lemmatizer for every zone, then
+    every token is split into sentences twice and lemmatized on its own.
+    Args:
+        data (str): Text of the zone
+    Returns:
+        (list): Terms, in order
+    """
+    lemmatizer = WordNetLemmatizer()
+    terms = []
+    for uncleaned_sentence in sent_tokenize(data):
+        sentence = uncleaned_sentence.strip().lower()
+        for unlemmatized_word in word_tokenize(sentence):
+            terms.append(lemmatizer.lemmatize(unlemmatized_word, pos = "v"))
+    return terms
+
+def benchmark(name, analyze, zones, repeats):
+    """
+    Times the analysis of every zone and prints the throughput.
+    Args:
+        name      (str): Name of the pipeline
+        analyze   (fun): Analyzes the text of a zone into terms
+        zones    (list): Text of every zone
+        repeats   (int): Number of times to analyze every zone
+    Returns:
+        (list): Terms of every zone
+    """
+    terms = [analyze(zone) for zone in zones]
+    tokens = sum(map(len, terms))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for zone in zones:
+            analyze(zone)
+    elapsed = (time.perf_counter() - start) / repeats
+    print(f"{name:>24}: {tokens:>10,} tokens, {elapsed:8.3f} s, {tokens / elapsed:>12,.0f} tokens/s", end='')
+    return terms
+
+def main():
+    init_csvreader()
+    zones = []
+    for entry in read_entries(input_dataset):
+        zones += [entry[TITLE], entry[CONTENT]]
+    print(f"{len(zones)} zones")
+
+    baseline = benchmark("legacy", legacy_analyze, zones, repeats)
+    print()
+
+    # The cached analyzer is timed with its lemma cache filled by the first pass, as it would be
+    # after the first chunks of a build
+    pipelines = [("legacy chain, no cache", Analyzer(LEGACY_INDEX_CHAIN, cache_lemmas=False)),
+        ("index chain, no cache", Analyzer(INDEX_CHAIN, cache_lemmas=False)),
+        ("index chain, lemma cache", Analyzer(INDEX_CHAIN))]
+    for name, analyzer in pipelines:
+        terms = benchmark(name, analyzer.analyze, zones, repeats)
+        print(", same terms" if terms == baseline else ", DIFFERENT terms")
+
+    cached = pipelines[-1][1]
+    print(f"lemma cache: {sum(map(len, cached.lemmas.values()))} entries, {cached.hits / (cached.hits + cached.misses):.2%} hit rate")
+
+input_dataset = None
+repeats = 3
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'i:r:')
+except getopt.GetoptError:
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-i':
+        input_dataset = a
+    elif o == '-r':
+        repeats = int(a)
+
+if __name__ == "__main__":
+    if input_dataset == None:
+        print("usage: " + sys.argv[0] + " -i dataset-file [-r repeats]")
+        sys.exit(2)
+    main()
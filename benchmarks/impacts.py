@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import getopt
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from index import build_index
+from query import QueryDetails, QueryRefiner
+from models import VectorSpaceModel, ImpactVectorSpaceModel
+from storage import DictionaryReader, PostingsReader
+from lexicon import Lexicon
+from documents import DocumentTable
+
+"""
+Usage:
+python3 benchmarks/impacts.py -i <dataset_file> [-b <bits>] query_file...
+
+eg
+python3 benchmarks/impacts.py -i tests/data_100.csv -b 8,6,4 queries/*.txt
+this will index the dataset without impacts, with unquantized impacts and with impacts quantized to
+each number of bits, then rank every query with each index, and report the size of the postings and
+how far the ranking drifts from the one computed from term frequencies: the overlap of the top 10
+and top 100 documents, and the mean average precision over the relevant documents listed in the
+query files
+"""
+
+def load_query(query_file):
+    """
+    Reads and refines a query the same way as search.py.
+    Args:
+        query_file (str): File path of input query file
+    Returns:
+        query (QueryDetails): Refined query, or None if the query is invalid
+        relevant      (set): document_ids of the relevant documents listed in the query file
+    """
+    with open(query_file, 'r') as f:
+        lines = f.read().split('\n')
+    relevant = set(line.strip() for line in lines[1:] if line.strip())
+    query_details = QueryDetails(lines[0], [])
+    if query_details.type == "invalid":
+        return (None, relevant)
+    query_details.to_free_text()
+
+    refiner = QueryRefiner(query_details)
+    refiner.query_expansion(6)
+    return (refiner.get_current_refined(), relevant)
+
+def average_precision(ranking, relevant):
+    """
+    Computes the average precision of a ranking.
+    Args:
+        ranking  (list): Ranked document_ids
+        relevant  (set): document_ids of the relevant documents
+    Returns:
+        (float): Average precision
+    """
+    if not relevant:
+        return 0
+    hits = 0
+    total = 0
+    for rank, doc_id in enumerate(ranking, 1):
+        if doc_id in relevant:
+            hits += 1
+            total += hits / rank
+    return total / len(relevant)
+
+def rank_all(model_class, dict_file, postings_file, queries):
+    """
+    Ranks every query with an index.
+    Args:
+        model_class   (class): Scoring engine
+        dict_file       (str): File path of input dictionary file
+        postings_file   (str): File path of input posting file
+        queries        (list): Refined queries
+    Returns:
+        rankings (list): Ranked document_ids of each query
+        elapsed (float): Time to rank all queries, in seconds
+        size      (int): Size of the postings file
+    """
+    dictionary_reader = DictionaryReader(dict_file)
+    document_weights = DocumentTable.from_dictionary(dictionary_reader)
+    model = model_class(Lexicon.from_dictionary(dictionary_reader), document_weights, PostingsReader(postings_file))
+
+    start = time.perf_counter()
+    results = [model.zone_score(query) for query in queries]
+    elapsed = time.perf_counter() - start
+
+    rankings = [[document_weights.doc_ids[doc_num] for doc_num, _ in result] for result in results]
+    return (rankings, elapsed, os.path.getsize(postings_file))
+
+def overlap(ranking, reference, k):
+    """
+    Returns the fraction of the top k documents of the reference ranking that are in the top k of a ranking.
+    """
+    top = set(reference[:k])
+    return len(top & set(ranking[:k])) / len(top) if top else 1
+
+def main():
+    loaded = [load_query(query_file) for query_file in query_files]
+    queries = [query for query, _ in loaded if query != None]
+    relevant = [relevant for query, relevant in loaded if query != None]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def index(impact_bits):
+            dict_file = os.path.join(tmp_dir, f"dictionary_{impact_bits}.txt")
+            postings_file = os.path.join(tmp_dir, f"postings_{impact_bits}.txt")
+            build_index(input_dataset, dict_file, postings_file, impact_bits=impact_bits)
+            return (dict_file, postings_file)
+
+        reference, elapsed, size = rank_all(VectorSpaceModel, *index(None), queries)
+        rows = [("tf", size, elapsed, reference)]
+        for impact_bits in [0] + bits:
+            rankings, elapsed, size = rank_all(ImpactVectorSpaceModel, *index(impact_bits), queries)
+            rows.append(("float" if impact_bits == 0 else f"{impact_bits}-bit", size, elapsed, rankings))
+
+    print(f"{len(queries)} queries")
+    print(f"{'impacts':>8} {'postings':>12} {'time':>10} {'top 10':>7} {'top 100':>7} {'MAP':>6}")
+    for name, size, elapsed, rankings in rows:
+        top_10 = sum(overlap(r, ref, 10) for r, ref in zip(rankings, reference)) / len(queries)
+        top_100 = sum(overlap(r, ref, 100) for r, ref in zip(rankings, reference)) / len(queries)
+        mean_ap = sum(average_precision(r, rel) for r, rel in zip(rankings, relevant)) / len(queries)
+        print(f"{name:>8} {size:>12,} {elapsed * 1000:8.1f}ms {top_10:7.3f} {top_100:7.3f} {mean_ap:6.3f}")
+
+input_dataset = None
+bits = [8, 6, 4]
+
+try:
+    opts, query_files = getopt.getopt(sys.argv[1:], 'i:b:')
+except getopt.GetoptError:
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-i':
+        input_dataset = a
+    elif o == '-b':
+        bits = [int(b) for b in a.split(',')]
+
+if __name__ == "__main__":
+    if input_dataset == None or not query_files:
+        print("usage: " + sys.argv[0] + " -i dataset-file [-b bits] query-file...")
+        sys.exit(2)
+    main()
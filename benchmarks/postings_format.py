@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import pickle
+import getopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from index import init_csvreader, create_dictionary
+from compression import encode_posting_list, decode_doc_stream, decode_pos_stream, doc_num_of, zone_of, TITLE_ZONE
+
+"""
+Usage:
+python3 benchmarks/postings_format.py -i <dataset_file> [-r <repeats>]
+
+eg
+python3 benchmarks/postings_format.py -i tests/data_100.csv
+this will index the dataset in memory, then compare the size and decoding time of every posting
+list under the pickled format and the variable-byte format. The pickled format is the original one,
+whose postings are keyed by string documentIds of the document_id and zone (eg "246391.c"), rather
+than by the integer documentIds that the index now uses. For the variable-byte format, the
+documentId stream alone (all that ranking reads) is reported separately from the full posting list
+"""
+
+def benchmark(name, blobs, decode, repeats):
+    """
+    Times decoding of all posting lists and prints the result.
+    Args:
+        name      (str): Name of the format
+        blobs    (list): Encoded posting lists, each either bytes or a tuple of streams
+        decode    (fun): Decoder of the format
+        repeats   (int): Number of times to decode every posting list
+    """
+    size = sum(len(blob) if isinstance(blob, bytes) else sum(map(len, blob)) for blob in blobs)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for blob in blobs:
+            decode(blob)
+    elapsed = (time.perf_counter() - start) / repeats
+    print(f"{name:>12}: {size:>12,} bytes, {elapsed * 1000:10.2f} ms to decode all posting lists")
+
+def decode_posting_list(streams):
+    """
+    Decodes both streams of a posting list.
+    Args:
+        streams (tuple): Encoded documentId stream and positions stream
+    Returns:
+        (list): List of documentId - term frequency pairs and list of positions
+    """
+    doc_stream, pos_stream = streams
+    return list(zip(decode_doc_stream(doc_stream), decode_pos_stream(pos_stream)))
+
+def legacy_posting(posting, doc_ids):
+    """
+    Converts a posting to the original pickled format, keyed by string documentIds.
+    Args:
+        posting (tuple): Frequency and posting list of a term, keyed by integer documentIds
+        doc_ids  (list): Side table of document_ids by internal documentId of the document
+    Returns:
+        (tuple): Frequency and posting list of the term, keyed by document_id and zone
+    """
+    freq, posting_list = posting
+    return (freq, [(doc_ids[doc_num_of(key)] + ('.t' if zone_of(key) == TITLE_ZONE else '.c'), positions)
+        for key, positions in posting_list])
+
+def main():
+    init_csvreader()
+    term_dict, _, doc_ids = create_dictionary(input_dataset)
+
+    pickled = [pickle.dumps(legacy_posting(posting, doc_ids)) for posting in term_dict.values()]
+    streams = [encode_posting_list(posting_list) for _, posting_list in term_dict.values()]
+
+    print(f"{len(term_dict)} posting lists")
+    benchmark("pickle", pickled, pickle.loads, repeats)
+    benchmark("vbyte", streams, decode_posting_list, repeats)
+    benchmark("vbyte (docs)", [doc_stream for doc_stream, _ in streams], decode_doc_stream, repeats)
+
+input_dataset = None
+repeats = 3
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'i:r:')
+except getopt.GetoptError:
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-i':
+        input_dataset = a
+    elif o == '-r':
+        repeats = int(a)
+
+if __name__ == "__main__":
+    if input_dataset == None:
+        print("usage: " + sys.argv[0] + " -i dataset-file [-r repeats]")
+        sys.exit(2)
+    main()
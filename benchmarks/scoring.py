@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import getopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from query import QueryDetails, QueryRefiner
+from models import VectorSpaceModel, NumpyVectorSpaceModel
+from pruning import MaxScoreVectorSpaceModel, BlockMaxWandVectorSpaceModel
+from storage import DictionaryReader, PostingsReader
+from lexicon import Lexicon
+from documents import DocumentTable
+
+"""
+Usage:
+python3 benchmarks/scoring.py -d <dictionary_file> -p <postings_file> [-r <repeats>] [-k <k>] query_file...
+
+eg
+python3 benchmarks/scoring.py -d dictionary.txt -p postings.txt queries/q1.txt queries/q2.txt
+this will refine each query the same way as search.py, then time zone_score of every scoring
+engine on it, and check that the engines return the same scores
+"""
+
+def load_query(query_file):
+    """
+    Reads and refines a query the same way as search.py.
+    Args:
+        query_file (str): File path of input query file
+    Returns:
+        (QueryDetails): Refined query, or None if the query is invalid
+    """
+    with open(query_file, 'r') as f:
+        query_details = QueryDetails(f.readline(), [])
+    if query_details.type == "invalid":
+        return None
+    query_details.to_free_text()
+
+    refiner = QueryRefiner(query_details)
+    refiner.query_expansion(6)
+    return refiner.get_current_refined()
+
+def time_engine(model, queries, k, repeats):
+    """
+    Times zone_score of a model over all queries.
+    Args:
+        model (VectorSpaceModel): Scoring engine
+        queries           (list): Refined queries
+        k                  (int): Top number of results to return, or None for all
+        repeats            (int): Number of times to score every query
+    Returns:
+        elapsed (float): Average time to score all queries, in seconds
+        results  (list): Scores of the results of each query
+    """
+    results = [[score for _, score in model.zone_score(query, k)] for query in queries]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for query in queries:
+            model.zone_score(query, k)
+    return ((time.perf_counter() - start) / repeats, results)
+
+def main():
+    dictionary_reader = DictionaryReader(dictionary_file)
+    dictionary = Lexicon.from_dictionary(dictionary_reader)
+    document_weights = DocumentTable.from_dictionary(dictionary_reader)
+    postings = PostingsReader(postings_file)
+
+    queries = [query for query in map(load_query, query_files) if query != None]
+    print(f"{len(queries)} queries, {len(document_weights)} documents, k = {k}")
+
+    baseline = None
+    engines = [('python', VectorSpaceModel), ('numpy', NumpyVectorSpaceModel)]
+    if k != None:
+        # Dynamic pruning only happens when k is given
+        engines += [('maxscore', MaxScoreVectorSpaceModel), ('bmw', BlockMaxWandVectorSpaceModel)]
+    for name, engine in engines:
+        elapsed, results = time_engine(engine(dictionary, document_weights, postings), queries, k, repeats)
+        if baseline == None:
+            baseline = (elapsed, results)
+        same = "same scores" if results == baseline[1] else "DIFFERENT scores"
+        print(f"{name:>8}: {elapsed * 1000:10.2f} ms, {baseline[0] / elapsed:5.2f}x, {same}")
+
+dictionary_file = postings_file = k = None
+repeats = 5
+
+try:
+    opts, query_files = getopt.getopt(sys.argv[1:], 'd:p:r:k:')
+except getopt.GetoptError:
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-d':
+        dictionary_file = a
+    elif o == '-p':
+        postings_file = a
+    elif o == '-r':
+        repeats = int(a)
+    elif o == '-k':
+        k = int(a)
+
+if __name__ == "__main__":
+    if dictionary_file == None or postings_file == None or not query_files:
+        print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-r repeats] [-k k] query-file...")
+        sys.exit(2)
+    main()
@@ -4,6 +4,21 @@ from nltk.corpus import wordnet as wn
 from collections import Counter
 import nltk
 
+# Weight of an expansion term (synonym or pseudo relevance feedback term) in the query, relative to
+# an occurrence of a term of the query
+EXPANSION_WEIGHT = 0.5
+
+def analyze(text):
+    """
+    Tokenizes, case-folds and stems text like the terms of a query.
+    Args:
+        text (str): Text to analyze
+    Returns:
+        (list): Terms, in order
+    """
+    stemmer = PorterStemmer()
+    return [stemmer.stem(token.lower()) for token in word_tokenize(text)]
+
 class QueryDetails:
     """
     Does pre-processing, determines type of query, and put the respective information
@@ -19,11 +34,14 @@ class QueryDetails:
         terms           (list[str])   : All of the query terms, where phrasal queries will be in a nested list
         counts          (Counter[str]): The frequency of each terms
         raw_tokens      (list[str])   : List of the raw tokens before stemming and case-folding
+        tags            (list[str])   : Treebank tag of each raw token
+        expansions      (dict)        : Expansion terms of the query to their weights, see QueryRefiner
     """
     def __init__(self, query, relevant_docs):
         self.type = "free-text"
         self.terms = []
         self.extraterms = {} # used for rocchio
+        self.expansions = {}
         self.num_normalising_docs = 1
         self.alpha = 1
 
@@ -51,7 +69,9 @@ class QueryDetails:
         stemmer = PorterStemmer()
         expander = WordnetExpander()
         new_tokens = []
+        self.tags = []
         for term, tag in nltk.pos_tag(tokens):
+            self.tags.append(tag)
             tag = expander.get_wordnet_pos(tag)
             term = stemmer.stem(term.lower())
             # term = lemmatizer.lemmatize(term.lower(), pos=tag if tag else wn.VERB) # because lemmatizer cannot parse empty string as pos
@@ -92,6 +112,9 @@ class QueryDetails:
 
         beta = (1 - self.alpha)
 
+        for term, weight in self.expansions.items():
+            d[term] = d.get(term, 0) + weight
+
         # the logic for Rocchio algorithm (if it exists)
         for term, freq in self.extraterms.items():
             val = beta * (freq / self.num_normalising_docs)
@@ -120,6 +143,7 @@ class QueryDetails:
                 flattened_terms.extend(term)
 
         self.terms = flattened_terms
+        self.tags = [tag for term, tag in zip(self.raw_tokens, self.tags) if (not valid_raw_token(term))]
         self.raw_tokens = [term for term in self.raw_tokens if (not valid_raw_token(term))]
         self.type = "free-text"
         
@@ -130,12 +154,23 @@ class QueryRefiner:
     def __init__(self, query_details):
         self.query_details = query_details
     
-    def pseudo_relevance_feedback(self, prf_terms):
-        # gets the top k documents' most important terms and simply append it
-        new_terms = self.query_details.raw_tokens + prf_terms
-        new_query = " ".join(new_terms)
+    def add_expansions(self, terms):
+        """
+        Adds terms to the expansions of the query, with EXPANSION_WEIGHT for each time they occur.
+        Terms of the query are not expansions of it.
+        Args:
+            terms (list[str]): Expansion terms, analyzed like the terms of the query
+        """
+        query = self.query_details
+        query_terms = set(query.terms)
+        for term in terms:
+            if term not in query_terms:
+                query.expansions[term] = query.expansions.get(term, 0) + EXPANSION_WEIGHT
 
-        self.query_details = QueryDetails(new_query, self.query_details.relevant_docs)
+    def pseudo_relevance_feedback(self, prf_terms):
+        # gets the top k documents' most important terms and adds them as expansions of the query,
+        # without tokenizing and tagging the whole query again
+        self.add_expansions([term for prf_term in prf_terms for term in analyze(prf_term)])
     
     def pseudo_rocchio(self, prf_terms, N):
         # not exactly rocchio, but similar. All the bulk of the calculation is inside count() method of QueryDetails
@@ -146,15 +181,12 @@ class QueryRefiner:
         self.alpha = 0.8
 
     def query_expansion(self, new_synonyms_per_term=0):
+        # synonyms are added as expansions of the query, reusing the tags of its raw tokens
         expander = WordnetExpander()
-        terms = self.query_details.raw_tokens
-        additional_terms = expander.get_synonyms_of(terms, new_synonyms_per_term)
-        
-        print(f"terms in query expansion: {terms}")
-        print(f"additional terms: {additional_terms}")
-        new_terms = terms + additional_terms
-        new_query = " ".join(new_terms)
-        self.query_details = QueryDetails(new_query, self.query_details.relevant_docs)
+        query = self.query_details
+        for term, tag in zip(query.raw_tokens, query.tags):
+            synonyms = expander.get_synonyms_of_token(term, tag, new_synonyms_per_term)
+            self.add_expansions(list(dict.fromkeys(new_term for syn in synonyms for new_term in analyze(syn))))
     
     def get_current_refined(self):
         return self.query_details
@@ -198,15 +230,23 @@ class WordnetExpander:
         tagged_terms = nltk.pos_tag(terms)
         all_new_terms = []
         for term, tag in tagged_terms:
-            # try custom synonyms first
-            new_terms = self.get_custom_synonym(term, k)
-            if not new_terms: # turns out custom synonym doesn't give us anything
-                synsets = self.get_synsets(term, tag)
-                new_terms = self.get_k_from_synsets(synsets, term, k)
-            print(f"{term}: {new_terms}")
-            all_new_terms.extend(new_terms)
+            all_new_terms.extend(self.get_synonyms_of_token(term, tag, k))
 
         return all_new_terms
+
+    def get_synonyms_of_token(self, term, tag, k):
+        """
+        Args:
+        term (str): The original term that appears in the queries
+        tag  (str): Tag of the term obtained from nltk.pos_tag
+        k    (int): The number of synonyms to be taken
+        """
+        # try custom synonyms first
+        new_terms = self.get_custom_synonym(term, k)
+        if not new_terms: # turns out custom synonym doesn't give us anything
+            synsets = self.get_synsets(term, tag)
+            new_terms = self.get_k_from_synsets(synsets, term, k)
+        return new_terms
     
     def get_custom_synonym(self, term, k):
         new_terms = []
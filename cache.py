@@ -0,0 +1,317 @@
+import os
+import sys
+import pickle
+from collections import OrderedDict
+import numpy as np
+
+# Approximate size in bytes of an int or float object, and of the header of an ndarray
+NUMBER_BYTES = sys.getsizeof(1 << 20)
+ARRAY_BYTES = sys.getsizeof(np.zeros(0))
+
+def is_number_tuple(value):
+    """
+    Checks if a value is a flat tuple of numbers, such as a posting or a skip table entry
+    Args:
+        value: Value to check
+    Returns:
+        (bool): True if value is a tuple of ints and floats
+    """
+    return isinstance(value, tuple) and all(isinstance(item, (int, float)) for item in value)
+
+def decoded_size(value):
+    """
+    Approximates the size in bytes of decoded posting data, counting the objects it is made of.
+    Views of the postings file count for their header only, as their bytes are mapped.
+    Args:
+        value: Posting list, arrays, skip table, streams or any nesting of them in lists and tuples
+    Returns:
+        (int): Approximate size in bytes
+    """
+    if isinstance(value, np.ndarray):
+        return ARRAY_BYTES + value.nbytes
+    if isinstance(value, (list, tuple)):
+        size = sys.getsizeof(value)
+        if not value:
+            return size
+        if isinstance(value[0], (int, float)):
+            return size + NUMBER_BYTES * len(value)
+        if is_number_tuple(value[0]):
+            # Postings are all (documentId, term frequency) pairs, so the first one gives the size of
+            # every one of them
+            return size + len(value) * (sys.getsizeof(value[0]) + NUMBER_BYTES * len(value[0]))
+        return size + sum(map(decoded_size, value))
+    return sys.getsizeof(value)
+
+class PostingCache:
+    """
+    Least recently used cache of decoded posting data, keyed by getter, postings file and term (see
+    models.cached_postings), which evicts entries by their decoded size in bytes rather than by
+    their number. The cache is shared by every query scored by a model, so terms that recur across
+    queries, such as common expansion synonyms, are only decoded once while they stay in the cache.
+
+    Variables:
+        budget    (int): Maximum total decoded size of the entries in bytes, or None for no limit
+        size      (int): Total decoded size of the entries in bytes
+        hits      (int): Number of lookups found in the cache
+        misses    (int): Number of lookups decoded from the postings file
+        evictions (int): Number of entries evicted to stay within the budget
+    """
+    def __init__(self, budget=None):
+        """
+        Args:
+            budget (int): Maximum total decoded size of the entries in bytes, or None for no limit
+        """
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fetch(self, key, decode):
+        """
+        Returns the cached value of key, or decodes and caches it if it is not in the cache
+        Args:
+            key       (tuple): Getter name, postings file, term and any further arguments of the getter
+            decode (function): Decodes the value from the postings file
+        Returns:
+            Decoded posting data, which must not be modified
+        """
+        entry = self.entries.get(key)
+        if entry != None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        value = decode()
+        size = decoded_size(value)
+        if self.budget != None and size > self.budget:
+            # Caching the value would evict everything else
+            return value
+
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.budget != None and self.size > self.budget:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+        return value
+
+    def clear(self):
+        """
+        Empties the cache, keeping its counters
+        """
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """
+        Returns the counters of the cache
+        Returns:
+            (dict): Hits, misses, evictions, number of entries, size and budget in bytes
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'entries': len(self.entries), 'size': self.size, 'budget': self.budget}
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        budget = "unlimited" if self.budget == None else f"{self.budget} bytes"
+        return f"posting cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), {self.evictions} evictions, " + \
+            f"{len(self.entries)} entries, {self.size} bytes of {budget}"
+
+    def __len__(self):
+        return len(self.entries)
+
+# Returned by QueryCache lookups that miss, as None is a valid refined query (an invalid query)
+MISSING = object()
+
+# Default maximum number of entries of each level of a QueryCache
+QUERY_CACHE_ENTRIES = 4096
+
+def index_signature(index_files):
+    """
+    Identifies the current version of the index files by their size and modification time
+    Args:
+        index_files (list): File paths of the dictionary file, postings file and segment manifest
+    Returns:
+        (tuple): File path - size - modification time in nanoseconds of each file, which are None
+                 for files that do not exist, such as the manifest of an index that has no segments
+    """
+    signature = []
+    for index_file in index_files:
+        if not os.path.exists(index_file):
+            signature.append((os.path.abspath(index_file), None, None))
+            continue
+        stat = os.stat(index_file)
+        signature.append((os.path.abspath(index_file), stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+class QueryCache:
+    """
+    Two level cache of queries, keyed by the raw query string (along with its relevant documents):
+    - refined queries, which saves tokenizing, tagging, lemmatizing and expanding the query
+    - ranked results of each scoring engine and k, which saves scoring the query
+    Each level keeps its most recently used entries. The ranked results are of the index files
+    that they were scored on, so they are dropped whenever the size or modification time of the
+    index files changes, such as when a segment is added or compacted (see segments.py). Refined
+    queries are expanded with the synonym table of the index (see synonyms.py), so they are dropped
+    as well.
+
+    The cache can be persisted to a cache file between runs, see load and save.
+
+    Variables:
+        index_files (list): File paths of the dictionary file, postings file and segment manifest
+        cache_file   (str): File path of the cache file, or None to keep the cache in memory only
+        capacity     (int): Maximum number of entries of each level
+        hits        (dict): Number of lookups found in each level
+        misses      (dict): Number of lookups missing from each level
+        invalidations (int): Number of times the entries were dropped for changed index files
+    """
+    def __init__(self, index_files, cache_file=None, capacity=QUERY_CACHE_ENTRIES):
+        """
+        Creates the cache, with the entries of the cache file if it exists
+        Args:
+            index_files (list): File paths of the dictionary file, postings file and segment manifest
+            cache_file   (str): File path of the cache file, or None to keep the cache in memory only
+            capacity     (int): Maximum number of entries of each level
+        """
+        self.index_files = index_files
+        self.cache_file = cache_file
+        self.capacity = capacity
+        self.signature = index_signature(index_files)
+        self.levels = {'refined': OrderedDict(), 'results': OrderedDict()}
+        self.hits = {'refined': 0, 'results': 0}
+        self.misses = {'refined': 0, 'results': 0}
+        self.invalidations = 0
+
+        if cache_file != None and os.path.exists(cache_file):
+            self.load()
+
+    def check_index(self):
+        """
+        Drops the entries if the index files have changed since they were refined and scored
+        """
+        signature = index_signature(self.index_files)
+        if signature != self.signature:
+            for entries in self.levels.values():
+                entries.clear()
+            self.signature = signature
+            self.invalidations += 1
+
+    def get(self, level, key):
+        """
+        Looks up an entry of a level
+        Args:
+            level (str): 'refined' or 'results'
+            key (tuple): Key of the entry
+        Returns:
+            Value of the entry, or MISSING
+        """
+        entries = self.levels[level]
+        if key not in entries:
+            self.misses[level] += 1
+            return MISSING
+
+        entries.move_to_end(key)
+        self.hits[level] += 1
+        return entries[key]
+
+    def put(self, level, key, value):
+        """
+        Adds an entry to a level, evicting its least recently used entry if it is full
+        Args:
+            level (str): 'refined' or 'results'
+            key (tuple): Key of the entry
+            value      : Value of the entry, which must not be modified
+        """
+        entries = self.levels[level]
+        entries[key] = value
+        entries.move_to_end(key)
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+
+    def refined_key(self, query, lst_of_relevant_docs):
+        """
+        Returns the key of the refined query of a raw query
+        """
+        return (query, tuple(lst_of_relevant_docs))
+
+    def results_key(self, model, query, lst_of_relevant_docs, k):
+        """
+        Returns the key of the ranked results of a raw query
+        """
+        # Engines that prune or stop early can return different results for the same query. The engine
+        # of a segmented index is that of its segments.
+        engine = getattr(model, 'engine', type(model))
+        return (query, tuple(lst_of_relevant_docs), engine.__name__, k, getattr(model, 'postings_budget', None),
+            model.query_mode)
+
+    def get_refined(self, query, lst_of_relevant_docs):
+        """
+        Looks up the refined query of a raw query
+        Args:
+            query                 (str): Raw query
+            lst_of_relevant_docs (list): document_ids of the relevant documents
+        Returns:
+            (QueryDetails): Refined query, None if the query is invalid, or MISSING
+        """
+        return self.get('refined', self.refined_key(query, lst_of_relevant_docs))
+
+    def put_refined(self, query, lst_of_relevant_docs, refined_query):
+        """
+        Adds the refined query of a raw query, see get_refined
+        """
+        self.put('refined', self.refined_key(query, lst_of_relevant_docs), refined_query)
+
+    def get_results(self, model, query, lst_of_relevant_docs, k):
+        """
+        Looks up the ranked results of a raw query, if they were scored on the current index files
+        Args:
+            model (VectorSpaceModel): Scoring engine
+            query              (str): Raw query
+            lst_of_relevant_docs (list): document_ids of the relevant documents
+            k                  (int): Number of documents returned, or None for all matching documents
+        Returns:
+            (list): Descending list of internal documentId-score pairs by score, or MISSING
+        """
+        self.check_index()
+        return self.get('results', self.results_key(model, query, lst_of_relevant_docs, k))
+
+    def put_results(self, model, query, lst_of_relevant_docs, k, results):
+        """
+        Adds the ranked results of a raw query, see get_results
+        """
+        self.put('results', self.results_key(model, query, lst_of_relevant_docs, k), results)
+
+    def load(self):
+        """
+        Reads the entries of the cache file, unless they were refined and scored on other index files.
+        """
+        with open(self.cache_file, 'rb') as f:
+            saved = pickle.load(f)
+        if saved['signature'] == self.signature:
+            for level in self.levels:
+                for key, value in saved[level]:
+                    self.put(level, key, value)
+
+    def save(self):
+        """
+        Writes the entries of the cache to the cache file, replacing it at once so that a run that is
+        interrupted does not leave a partial cache file
+        """
+        if self.cache_file == None:
+            return
+
+        self.check_index()
+        saved = {'signature': self.signature,
+            'refined': list(self.levels['refined'].items()), 'results': list(self.levels['results'].items())}
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(saved, f)
+        os.replace(tmp_file, self.cache_file)
+
+    def __str__(self):
+        return "query cache: " + ", ".join(f"{level} {self.hits[level]} hits {self.misses[level]} misses {len(entries)} entries"
+            for level, entries in self.levels.items()) + f", {self.invalidations} invalidations"
@@ -0,0 +1,447 @@
+"""
+Variable-byte encoding of posting lists.
+
+A posting list is encoded as two streams of variable-byte numbers, so that ranking can read the
+documents and term frequencies without touching the (much larger) positions. For each posting (in
+ascending internal documentId order), the documentId stream holds the gap from the previous
+documentId and the term frequency, and the positions stream holds the number of positions and
+then the gaps between the term's positions in that document.
+
+Numbers are encoded with the variable-byte scheme from Introduction to Information Retrieval:
+7 bits of payload per byte, with the high bit set on the last byte of each number.
+
+The postings of a documentId stream are also grouped into blocks, described by a skip table of
+fixed-size entries: the last documentId of the block, the end of the block in the documentId stream,
+and the maximum impact of the block in each zone. Since the first gap of a block is relative to the
+last documentId of the previous block, any block can be decoded on its own, and blocks that cannot
+hold a top document can be skipped without being decoded. Posting lists that fit in a single block
+(i.e., most of them) have an empty skip table.
+
+Indexes built with precomputed impacts also store an impact stream for each posting list: the impact
+(document term weight times court importance multiplier) of each posting in documentId order, either
+as float64, or quantized into bits-bit integers stored in one byte each. Quantization is done per
+term, in steps of the term's maximum impact divided by 2 ** bits - 1.
+
+Quantized impacts can also be written as an impact-ordered stream, which holds the same postings
+grouped into segments of equal impact, in descending order of impact. Each segment is made up of
+its impact, its number of postings, its size in bytes, then the gaps between its documentIds in
+ascending order, so that segments can be decoded one at a time, highest impact first.
+
+Tiered indexes also store a group of streams for each posting list: for each tier of documents,
+the documentId stream of the champion list of the tier (its postings with the highest term
+frequencies), the documentId stream of all postings of the tier, and the largest term frequency of
+the tier. The group starts with the number of streams and the size of each stream.
+"""
+import struct
+import numpy as np
+from itertools import accumulate
+
+# Zone bit of an internal documentId
+TITLE_ZONE = 0
+CONTENT_ZONE = 1
+
+# Minimum number of postings per block of a documentId stream. Blocks only end between documents, so
+# that both zones of a document are always in the same block
+SKIP_BLOCK_SIZE = 64
+
+# Skip table entry: last documentId, end offset in the documentId stream, maximum title impact and
+# maximum content impact of a block
+SKIP_ENTRY = struct.Struct('<IIdd')
+
+# Largest documentId that fits in a skip table entry
+MAX_DOC_ID = (1 << 32) - 1
+
+# Largest number of bits of a quantized impact
+MAX_IMPACT_BITS = 8
+
+def vb_encode_number(n):
+    """
+    Encodes a non-negative number in variable-byte.
+    Args:
+        n (int): Number to encode
+    Returns:
+        (bytearray): Encoded number
+    """
+    encoded = bytearray()
+    while True:
+        encoded.insert(0, n % 128)
+        if n < 128:
+            break
+        n //= 128
+    encoded[-1] += 128
+    return encoded
+
+def vb_encode(numbers):
+    """
+    Encodes a list of non-negative numbers in variable-byte.
+    Args:
+        numbers (list): Numbers to encode
+    Returns:
+        (bytes): Encoded numbers
+    """
+    encoded = bytearray()
+    for n in numbers:
+        encoded += vb_encode_number(n)
+    return bytes(encoded)
+
+def vb_size(n):
+    """
+    Returns the number of bytes of a non-negative number in variable-byte.
+    Args:
+        n (int): Number to encode
+    Returns:
+        (int): Size of the encoded number
+    """
+    return max(1, -(-n.bit_length() // 7))
+
+def vb_decode(buf):
+    """
+    Decodes a sequence of variable-byte numbers.
+    Args:
+        buf (bytes): Encoded numbers, any object supporting the buffer protocol
+    Returns:
+        numbers (list): Decoded numbers
+    """
+    numbers = []
+    n = 0
+    for byte in buf:
+        if byte < 128:
+            n = 128 * n + byte
+        else:
+            numbers.append(128 * n + byte - 128)
+            n = 0
+    return numbers
+
+def vb_decode_array(buf):
+    """
+    Decodes a sequence of variable-byte numbers with vectorized NumPy operations.
+    Args:
+        buf (bytes): Encoded numbers, any object supporting the buffer protocol
+    Returns:
+        (ndarray[int64]): Decoded numbers
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(data >= 128)
+    if len(ends) == len(data):
+        # Every number fits in a single byte
+        return (data & 127).astype(np.int64)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    data = data[:ends[-1] + 1]
+    # Each byte is shifted by 7 bits for every byte after it in the same number
+    number_of_byte = np.cumsum(data >= 128) - (data >= 128)
+    shifts = 7 * (ends[number_of_byte] - np.arange(len(data)))
+    payloads = (data & 127).astype(np.int64) << shifts
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    return np.add.reduceat(payloads, starts)
+
+def vb_decode_number(buf, pos):
+    """
+    Decodes a single variable-byte number.
+    Args:
+        buf (bytes): Encoded numbers, any object supporting the buffer protocol
+        pos   (int): Offset of the number in buf
+    Returns:
+        n   (int): Decoded number
+        pos (int): Offset of the byte after the number
+    """
+    n = 0
+    while buf[pos] < 128:
+        n = 128 * n + buf[pos]
+        pos += 1
+    return (128 * n + buf[pos] - 128, pos + 1)
+
+def doc_key(doc_num, zone):
+    """
+    Returns the internal documentId of a zone of a document. The zone is stored in the lowest bit,
+    so both zones of a document are adjacent.
+    Args:
+        doc_num (int): Internal documentId of the document
+        zone    (int): TITLE_ZONE or CONTENT_ZONE
+    Returns:
+        (int): Internal documentId of the zone
+    """
+    return (doc_num << 1) | zone
+
+def doc_num_of(key):
+    """
+    Returns the internal documentId of the document that a zone belongs to.
+    Args:
+        key (int): Internal documentId of the zone
+    Returns:
+        (int): Internal documentId of the document
+    """
+    return key >> 1
+
+def zone_of(key):
+    """
+    Returns the zone of an internal documentId.
+    Args:
+        key (int): Internal documentId of the zone
+    Returns:
+        (int): TITLE_ZONE or CONTENT_ZONE
+    """
+    return key & 1
+
+def encode_posting_list(posting_list):
+    """
+    Encodes a posting list into its documentId stream and its positions stream.
+    Args:
+        posting_list (list): List of documentId - list of positions pairs
+    Returns:
+        doc_stream (bytes): Encoded documentId gaps and term frequencies
+        pos_stream (bytes): Encoded positions
+    """
+    doc_numbers = []
+    pos_numbers = []
+    prev_key = 0
+    # Repeated document_ids may give out-of-order postings, which are kept apart with a gap of 0
+    for key, positions in sorted(posting_list):
+        doc_numbers.append(key - prev_key)
+        doc_numbers.append(len(positions))
+        prev_key = key
+
+        pos_numbers.append(len(positions))
+        prev_pos = 0
+        for pos in positions:
+            pos_numbers.append(pos - prev_pos)
+            prev_pos = pos
+    return (vb_encode(doc_numbers), vb_encode(pos_numbers))
+
+def encode_doc_stream(posting_list):
+    """
+    Encodes a documentId stream, in the same format as encode_posting_list.
+    Args:
+        posting_list (list): List of documentId - term frequency pairs
+    Returns:
+        (bytes): Encoded documentId gaps and term frequencies
+    """
+    numbers = []
+    prev_key = 0
+    for key, tf in sorted(posting_list):
+        numbers.append(key - prev_key)
+        numbers.append(tf)
+        prev_key = key
+    return vb_encode(numbers)
+
+def decode_doc_stream(buf):
+    """
+    Decodes a documentId stream encoded by encode_posting_list.
+    Args:
+        buf (bytes): Encoded documentId stream
+    Returns:
+        posting_list (list): List of documentId - term frequency pairs
+    """
+    numbers = vb_decode(buf)
+    # Documents are gaps from the previous document
+    return list(zip(accumulate(numbers[0::2]), numbers[1::2]))
+
+def decode_doc_block(buf, base):
+    """
+    Decodes a block of a documentId stream encoded by encode_posting_list.
+    Args:
+        buf (bytes): Encoded block
+        base  (int): Last documentId of the previous block, or 0 for the first block
+    Returns:
+        posting_list (list): List of documentId - term frequency pairs
+    """
+    numbers = vb_decode(buf)
+    # The first gap is from the last documentId of the previous block
+    doc_ids = accumulate(numbers[0::2], initial=base)
+    next(doc_ids)
+    return list(zip(doc_ids, numbers[1::2]))
+
+def decode_doc_stream_arrays(buf):
+    """
+    Decodes a documentId stream encoded by encode_posting_list into NumPy arrays.
+    Args:
+        buf (bytes): Encoded documentId stream
+    Returns:
+        doc_ids     (ndarray[int64]): DocumentIds of the postings
+        term_freqs  (ndarray[int64]): Term frequencies of the postings
+    """
+    numbers = vb_decode_array(buf)
+    return (np.cumsum(numbers[0::2]), numbers[1::2])
+
+def decode_pos_stream(buf):
+    """
+    Decodes a positions stream encoded by encode_posting_list.
+    Args:
+        buf (bytes): Encoded positions stream
+    Returns:
+        positions (list): List of positions of each posting, in documentId order
+    """
+    numbers = vb_decode(buf)
+    positions = []
+    i = 0
+    while i < len(numbers):
+        tf = numbers[i]
+        i += 1
+
+        # Positions are gaps from the previous position
+        positions.append(list(accumulate(numbers[i:i + tf])))
+        i += tf
+    return positions
+
+def iter_posting_list(doc_buf, pos_buf):
+    """
+    Decodes a posting list encoded by encode_posting_list one posting at a time, so that only the
+    current posting is held in memory.
+    Args:
+        doc_buf (bytes): Encoded documentId stream
+        pos_buf (bytes): Encoded positions stream
+    Returns:
+        (generator): DocumentId - list of positions pairs, in documentId order
+    """
+    key = doc_pos = pos_pos = 0
+    while doc_pos < len(doc_buf):
+        gap, doc_pos = vb_decode_number(doc_buf, doc_pos)
+        _, doc_pos = vb_decode_number(doc_buf, doc_pos)
+        key += gap
+
+        tf, pos_pos = vb_decode_number(pos_buf, pos_pos)
+        positions = []
+        position = 0
+        for _ in range(tf):
+            # Positions are gaps from the previous position
+            gap, pos_pos = vb_decode_number(pos_buf, pos_pos)
+            position += gap
+            positions.append(position)
+        yield (key, positions)
+
+def encode_skip_table(posting_list, impacts, block_size=SKIP_BLOCK_SIZE):
+    """
+    Encodes the skip table of a documentId stream encoded by encode_posting_list.
+    Args:
+        posting_list (list): List of documentId - term frequency pairs, sorted by documentId
+        impacts      (list): Impact of each posting
+        block_size    (int): Minimum number of postings per block
+    Returns:
+        (bytes): Encoded skip table, empty if the posting list fits in a single block
+    """
+    entries = []
+    max_impacts = [0.0, 0.0]
+    count = end = prev_key = 0
+    for i, (key, tf) in enumerate(posting_list):
+        end += vb_size(key - prev_key) + vb_size(tf)
+        prev_key = key
+        zone = zone_of(key)
+        max_impacts[zone] = max(max_impacts[zone], impacts[i])
+        count += 1
+
+        last_of_document = i + 1 == len(posting_list) or doc_num_of(posting_list[i + 1][0]) != doc_num_of(key)
+        if (count >= block_size and last_of_document) or i + 1 == len(posting_list):
+            entries.append(SKIP_ENTRY.pack(key, end, max_impacts[TITLE_ZONE], max_impacts[CONTENT_ZONE]))
+            max_impacts = [0.0, 0.0]
+            count = 0
+    if len(entries) == 1:
+        return b''
+    return b''.join(entries)
+
+def decode_skip_table(buf):
+    """
+    Decodes a skip table encoded by encode_skip_table.
+    Args:
+        buf (bytes): Encoded skip table
+    Returns:
+        (list): Last documentId - end offset - maximum title impact - maximum content impact of each block
+    """
+    return list(SKIP_ENTRY.iter_unpack(buf))
+
+def encode_impacts(impacts, bits):
+    """
+    Encodes the impact stream of a posting list.
+    Args:
+        impacts (list): Impact of each posting, in documentId order
+        bits     (int): Number of bits of a quantized impact, or 0 to store the impacts unquantized
+    Returns:
+        stream (bytes): Encoded impacts
+        scale  (float): Impact of a quantization step, or 0 if the impacts are unquantized
+    """
+    impacts = np.array(impacts, dtype=np.float64)
+    if bits == 0:
+        return (impacts.tobytes(), 0.0)
+
+    assert 0 < bits <= MAX_IMPACT_BITS
+    top = impacts.max() if len(impacts) else 0
+    scale = float(top) / ((1 << bits) - 1) if top > 0 else 1.0
+    return (np.rint(impacts / scale).astype(np.uint8).tobytes(), scale)
+
+def decode_impacts(buf, scale):
+    """
+    Decodes an impact stream encoded by encode_impacts, without copying it.
+    Args:
+        buf   (bytes): Encoded impacts
+        scale (float): Impact of a quantization step, or 0 if the impacts are unquantized
+    Returns:
+        (ndarray): Impacts as float64, or quantized impacts as uint8
+    """
+    return np.frombuffer(buf, dtype=np.float64 if scale == 0 else np.uint8)
+
+def encode_impact_ordered(doc_ids, impacts):
+    """
+    Encodes the impact-ordered stream of a posting list.
+    Args:
+        doc_ids  (list): DocumentId of each posting, in ascending order
+        impacts  (list): Quantized impact of each posting
+    Returns:
+        (bytes): Encoded impact-ordered stream
+    """
+    segments = {}
+    for doc_id, impact in zip(doc_ids, impacts):
+        segments.setdefault(impact, []).append(doc_id)
+
+    encoded = bytearray()
+    for impact in sorted(segments, reverse=True):
+        segment = segments[impact]
+        gaps = vb_encode([doc_id - prev_doc_id for prev_doc_id, doc_id in zip([0] + segment, segment)])
+        encoded += vb_encode([impact, len(segment), len(gaps)])
+        encoded += gaps
+    return bytes(encoded)
+
+def decode_impact_segments(buf):
+    """
+    Decodes an impact-ordered stream encoded by encode_impact_ordered, one segment at a time.
+    Args:
+        buf (bytes): Encoded impact-ordered stream
+    Returns:
+        (generator): Quantized impact - list of documentIds pairs, in descending order of impact
+    """
+    pos = 0
+    while pos < len(buf):
+        impact, pos = vb_decode_number(buf, pos)
+        count, pos = vb_decode_number(buf, pos)
+        size, pos = vb_decode_number(buf, pos)
+        yield (impact, list(accumulate(vb_decode(buf[pos:pos + size]))))
+        pos += size
+
+def encode_stream_group(streams):
+    """
+    Encodes a group of streams, such as the tiers of a posting list.
+    Args:
+        streams (list): Encoded streams
+    Returns:
+        (bytes): Encoded group
+    """
+    return vb_encode([len(streams)] + [len(stream) for stream in streams]) + b''.join(streams)
+
+def decode_stream_group(buf):
+    """
+    Splits a group of streams encoded by encode_stream_group, without copying them.
+    Args:
+        buf (bytes): Encoded group
+    Returns:
+        (list): Encoded streams
+    """
+    count, pos = vb_decode_number(buf, 0)
+    sizes = []
+    for _ in range(count):
+        size, pos = vb_decode_number(buf, pos)
+        sizes.append(size)
+
+    streams = []
+    for size in sizes:
+        streams.append(buf[pos:pos + size])
+        pos += size
+    return streams
@@ -0,0 +1,93 @@
+import numpy as np
+
+"""
+Columnar table of per-document data, indexed by internal documentId (i.e., by zone). Each column is
+stored as its own section of the dictionary file and mapped as a NumPy array, so it is never copied
+into Python objects, and forked search processes share the same pages.
+"""
+
+# Score multiplier of each court importance
+COURT_IMPORTANCE = {'H': 10, 'M': 8.5, 'L': 1}
+
+# Court importance of each tier of a tiered index, from the highest tier
+TIERS = ('H', 'M', 'L')
+
+def encode_documents(doc_weight, doc_ids):
+    """
+    Encodes the document table sections of a dictionary file.
+    Args:
+        doc_weight (list): (document length, court importance) of documents, indexed by internal documentId
+        doc_ids    (list): Side table of document_ids by internal documentId of the document
+    Returns:
+        (dict): Names to bytes of each section
+    """
+    lengths = np.array([length for length, _ in doc_weight], dtype=np.float64)
+    importance = np.array([ord(importance) for _, importance in doc_weight], dtype=np.uint8)
+    priors = np.array([COURT_IMPORTANCE.get(importance, 0) for _, importance in doc_weight], dtype=np.float64)
+
+    encoded_ids = [doc_id.encode('utf8') for doc_id in doc_ids]
+    id_offsets = np.zeros(len(encoded_ids) + 1, dtype=np.int64)
+    np.cumsum([len(doc_id) for doc_id in encoded_ids], out=id_offsets[1:])
+
+    return {
+        'doc_lengths': lengths.tobytes(),
+        'doc_priors': priors.tobytes(),
+        'doc_importance': importance.tobytes(),
+        'doc_id_offsets': id_offsets.tobytes(),
+        'doc_id_data': b''.join(encoded_ids),
+    }
+
+class DocumentIds:
+    """
+    Read-only side table of document_ids, indexed by internal documentId of the document. Each
+    document_id is only decoded when it is looked up.
+    """
+    def __init__(self, offsets, data):
+        """
+        Initializes DocumentIds object.
+        Args:
+            offsets (ndarray): Offset of each document_id in data, followed by the size of data
+            data (memoryview): Concatenated document_ids
+        """
+        self.offsets = offsets
+        self.data = data
+
+    def __getitem__(self, doc_num):
+        return str(self.data[self.offsets[doc_num]:self.offsets[doc_num + 1]], 'utf8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+class DocumentTable:
+    """
+    Per-document columns of an index.
+
+    Variables:
+        lengths    (ndarray[float64]): Length of each document (zone)
+        priors     (ndarray[float64]): Court importance multiplier of each document (zone)
+        importance (ndarray[uint8])  : Court importance (H, M, L) of each document (zone), as ASCII codes
+        doc_ids    (DocumentIds)     : Side table of document_ids by internal documentId of the document
+    """
+    def __init__(self, lengths, priors, importance, doc_ids):
+        self.lengths = lengths
+        self.priors = priors
+        self.importance = importance
+        self.doc_ids = doc_ids
+
+    @classmethod
+    def from_dictionary(cls, dictionary):
+        """
+        Maps the document table sections of a dictionary file, without copying them.
+        Args:
+            dictionary (DictionaryReader): Input dictionary file
+        Returns:
+            (DocumentTable): Document table of the dictionary file
+        """
+        return cls(np.frombuffer(dictionary.section('doc_lengths'), dtype=np.float64),
+            np.frombuffer(dictionary.section('doc_priors'), dtype=np.float64),
+            np.frombuffer(dictionary.section('doc_importance'), dtype=np.uint8),
+            DocumentIds(np.frombuffer(dictionary.section('doc_id_offsets'), dtype=np.int64),
+                dictionary.section('doc_id_data')))
+
+    def __len__(self):
+        return len(self.lengths)
@@ -7,10 +7,25 @@ import collections
 import math
 import time
 import re
+import os
+import heapq
+import itertools
+import tempfile
+import multiprocessing
 
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.stem import WordNetLemmatizer
+from functools import partial
 from datetime import timedelta
+from compression import encode_posting_list, encode_skip_table, encode_impacts, encode_impact_ordered, encode_doc_stream, \
+    iter_posting_list, encode_stream_group, vb_encode, doc_key, zone_of, TITLE_ZONE, CONTENT_ZONE, MAX_IMPACT_BITS
+from lexicon import encode_lexicon, biword, is_biword, BLOCK_SIZE
+from documents import encode_documents, COURT_IMPORTANCE, TIERS
+from weighting import TermFrequency
+from storage import write_dictionary, parse_size, PostingsReader, DictionaryReader
+from segments import Segment, read_manifest, write_manifest, manifest_file, tombstone, live_documents, segment_postings, \
+    segment_terms
+from analysis import get_analyzer, INDEX_CHAIN, TOKENIZERS
+from synonyms import build_synonym_table, encode_synonyms
+from query import SYNONYMS_PER_TERM
 
 # CSV Column Index
 ID = 0
@@ -27,6 +42,21 @@ M_courts = set(["SG High Court", "Singapore International Commercial Court", "HK
                 "HK Court of First Instance", "UK Crown Court", "UK Court of Appeal", "UK High Court",
                 "Federal Court of Australia", "NSW Court of Appeal", "NSW Court of Criminal Appeal", "NSW Supreme Court"])
 
+# Number of CSV rows handed to a worker at a time in parallel mode
+ENTRIES_PER_CHUNK = 8
+
+# Fields of a lexicon entry and how they are packed
+ENTRY_FIELDS = ('df', 'offset', 'doc_size', 'pos_size', 'skip_size', 'impact_size', 'ordered_size', 'tier_size',
+    'impact_scale', 'max_title', 'max_content')
+ENTRY_FORMAT = '<IQIIIIIIddd'
+
+# Approximate in-memory sizes (bytes) of the term dictionary's Python objects, used to keep the
+# budgeted build under its memory budget: a new term entry, a (doc_id, positions) posting, and a
+# position within a posting
+TERM_BYTES = 200
+POSTING_BYTES = 150
+POSITION_BYTES = 36
+
 def init_csvreader():
     """
     Initializes CSV Reader size. Allows for more rows to be read.
@@ -40,58 +70,51 @@ def init_csvreader():
         except OverflowError:
             maxInt = int(maxInt/10)
 
-def tabulate_dictionary(term_dict, doc_weight, entry, zone):
+def tabulate_dictionary(term_dict, doc_weight, doc_num, entry, zone, analyzer):
     """
     Tabulates the term frequency and term position of an entry's column.
     Args:
         term_dict  (dict): Dictionary of terms to postings
         doc_weight (dict): Dictionary of documents to weights
+        doc_num    (int) : Internal documentId of the entry
         entry      (list): Entry data of current CSV row
         zone       (int) : Entry column index to be tabulated
+        analyzer (Analyzer): Analyzer that turns the text of the column into terms
     """
     data = entry[zone]
 
-    # Changes doc_id based on zone chosen
-    # .t == title zone
-    # .c == content zone
+    # Changes doc_id based on zone chosen, the zone is stored in the lowest bit
     if zone == TITLE:
-        doc_id = entry[ID] + '.t'
+        doc_id = doc_key(doc_num, TITLE_ZONE)
     elif zone == CONTENT:
-        doc_id = entry[ID] + '.c'
+        doc_id = doc_key(doc_num, CONTENT_ZONE)
     else:
         raise Exception('No such zone')
 
     # Zero-index positions of terms
     word_pos = 0
-    lemmatizer = WordNetLemmatizer()
     doc_dic = collections.defaultdict(int)
-    for uncleaned_sentence in sent_tokenize(data):
-        # Remove trailing special characters + Case-fold
-        sentence = uncleaned_sentence.strip().lower()
-
-        for unlemmatized_word in word_tokenize(sentence):
-            # Verb lemmatization
-            term = lemmatizer.lemmatize(unlemmatized_word, pos = "v")
-
-            doc_dic[term] += 1
-            if term in term_dict.keys():
-                # Increment term
-                freq, posting = term_dict[term]
-                last_id, last_freq = posting[-1]
-
-                if last_id == doc_id:
-                    last_freq.append(word_pos)
-                    posting[-1] = (last_id, last_freq)
-                else:
-                    posting.append((doc_id, [word_pos]))
-                    freq += 1
-
-                term_dict[term] = (freq, posting)
+    # Tokenization, case-folding and verb lemmatization
+    for term in analyzer.analyze(data):
+        doc_dic[term] += 1
+        if term in term_dict.keys():
+            # Increment term
+            freq, posting = term_dict[term]
+            last_id, last_freq = posting[-1]
+
+            if last_id == doc_id:
+                last_freq.append(word_pos)
+                posting[-1] = (last_id, last_freq)
             else:
-                # Create tuple of freq and posting of term
-                term_dict[term] = (1, [(doc_id, [word_pos])])
-                
-            word_pos += 1
+                posting.append((doc_id, [word_pos]))
+                freq += 1
+
+            term_dict[term] = (freq, posting)
+        else:
+            # Create tuple of freq and posting of term
+            term_dict[term] = (1, [(doc_id, [word_pos])])
+
+        word_pos += 1
 
     court = entry[COURT]
     if court in H_courts:
@@ -109,16 +132,13 @@ def tabulate_dictionary(term_dict, doc_weight, entry, zone):
 
     doc_weight[doc_id] = (doc_length, importance)
 
-def create_dictionary(in_dir):
+def read_entries(in_dir):
     """
-    Reads all entries in CSV and creates dictionary of terms in each document/zone, posting list of
-    documentId zones and positioning where term is located, and dictionary of term-length in each
-    document/zone.
+    Reads all non-Chinese entries of the CSV, in file order.
     Args:
-        in_dir      (str): File path of input CSV
+        in_dir (str): File path of input CSV
     Returns:
-        term_dict  (dict): Dictionary of terms to postings
-        doc_weight (dict): Dictionary of documents to weights
+        (generator): Entries (rows) of the dataset
     """
     def isChinese(entry):
         """
@@ -132,9 +152,6 @@ def create_dictionary(in_dir):
         # CJK Unified Ideographs
         checker = re.compile(r'[\u4e00-\u9fff]+')
         return checker.match(entry[TITLE]) != None
-    
-    term_dict = {}
-    doc_weight = {}
 
     with open(in_dir, 'r', encoding="utf8") as f:
         # Read rows into a dictionary format
@@ -147,64 +164,765 @@ def create_dictionary(in_dir):
         for entry in reader:
             if isChinese(entry):
                continue
-            tabulate_dictionary(term_dict, doc_weight, entry, TITLE)
-            tabulate_dictionary(term_dict, doc_weight, entry, CONTENT)
+            yield entry
+
+def chunk_entries(entries, size):
+    """
+    Groups entries into consecutive chunks, preserving their order.
+    Args:
+        entries (iterable): Entries (rows) of the dataset
+        size         (int): Maximum number of entries per chunk
+    Returns:
+        (generator): Lists of at most size entries
+    """
+    chunk = []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def number_entries(entries, doc_ids):
+    """
+    Assigns dense internal documentIds to entries, in the order the document_ids are first seen.
+    Entries with a repeated document_id share the internal documentId of the first one.
+    Args:
+        entries (iterable): Entries (rows) of the dataset
+        doc_ids     (list): Side table of document_ids, filled in by internal documentId
+    Returns:
+        (generator): Internal documentId - entry pairs
+    """
+    doc_nums = {}
+    for entry in entries:
+        if entry[ID] not in doc_nums:
+            doc_nums[entry[ID]] = len(doc_ids)
+            doc_ids.append(entry[ID])
+        yield (doc_nums[entry[ID]], entry)
 
+def tabulate_entries(entries, chain=INDEX_CHAIN):
+    """
+    Tabulates a chunk of entries into partial dictionaries. Used as the worker task in parallel mode.
+    Args:
+        entries    (list): Internal documentId - entry pairs
+        chain     (tuple): Names of the tokenizer stages of the analyzer, see analysis.TOKENIZERS
+    Returns:
+        term_dict  (dict): Partial dictionary of terms to postings
+        doc_weight (dict): Partial dictionary of documents to weights
+    """
+    # The analyzer of the process is kept across chunks, along with its lemma cache
+    analyzer = get_analyzer(chain)
+    term_dict = {}
+    doc_weight = {}
+    for doc_num, entry in entries:
+        tabulate_dictionary(term_dict, doc_weight, doc_num, entry, TITLE, analyzer)
+        tabulate_dictionary(term_dict, doc_weight, doc_num, entry, CONTENT, analyzer)
     return (term_dict, doc_weight)
 
+def concat_postings(posting, next_posting):
+    """
+    Concatenates two (freq, posting) pairs of a term, where next_posting covers entries that come
+    after every entry in posting.
+    Args:
+        posting      (tuple): Frequency and posting list of the earlier entries
+        next_posting (tuple): Frequency and posting list of the later entries
+    Returns:
+        (tuple): Frequency and posting list covering both
+    """
+    freq, posting_list = posting
+    next_freq, next_posting_list = next_posting
+    last_id, last_positions = posting_list[-1]
+    first_id, first_positions = next_posting_list[0]
+
+    # Same document split across chunks (repeated document_id in consecutive rows)
+    if last_id == first_id:
+        posting_list[-1] = (last_id, last_positions + first_positions)
+        next_posting_list = next_posting_list[1:]
+        next_freq -= 1
+
+    posting_list.extend(next_posting_list)
+    return (freq + next_freq, posting_list)
+
+def merge_dictionary(term_dict, doc_weight, partial_term_dict, partial_doc_weight):
+    """
+    Merges partial dictionaries into the main dictionaries. The partial dictionaries must cover
+    entries that come after every entry already in the main dictionaries, so that postings stay
+    in CSV order.
+    Args:
+        term_dict          (dict): Dictionary of terms to postings
+        doc_weight         (dict): Dictionary of documents to weights
+        partial_term_dict  (dict): Partial dictionary of terms to postings
+        partial_doc_weight (dict): Partial dictionary of documents to weights
+    """
+    for term, posting in partial_term_dict.items():
+        if term not in term_dict:
+            term_dict[term] = posting
+        else:
+            term_dict[term] = concat_postings(term_dict[term], posting)
+
+    doc_weight.update(partial_doc_weight)
+
+def estimate_size(term_dict):
+    """
+    Estimates the memory taken up by a term dictionary.
+    Args:
+        term_dict (dict): Dictionary of terms to postings
+    Returns:
+        (int): Approximate size in bytes
+    """
+    size = 0
+    for _, posting_list in term_dict.values():
+        size += TERM_BYTES + POSTING_BYTES * len(posting_list)
+        for _, positions in posting_list:
+            size += POSITION_BYTES * len(positions)
+    return size
+
+def tabulate_partials(in_dir, doc_ids, workers=1, chain=INDEX_CHAIN):
+    """
+    Tabulates all entries in CSV chunk by chunk.
+    Args:
+        in_dir   (str): File path of input CSV
+        doc_ids (list): Side table of document_ids, filled in by internal documentId
+        workers  (int): Number of worker processes used for tabulation
+        chain  (tuple): Names of the tokenizer stages of the analyzer, see analysis.TOKENIZERS
+    Returns:
+        (generator): Partial term dictionary and document weights of each chunk, in CSV order
+    """
+    chunks = chunk_entries(number_entries(read_entries(in_dir), doc_ids), ENTRIES_PER_CHUNK)
+    tabulate_chunk = partial(tabulate_entries, chain=chain)
+    if workers <= 1:
+        yield from map(tabulate_chunk, chunks)
+        return
+
+    # Chunks are tabulated in parallel, but yielded in CSV order so that the postings are
+    # identical to the serial build
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(tabulate_chunk, chunks)
+
+def create_dictionary(in_dir, workers=1, chain=INDEX_CHAIN):
+    """
+    Reads all entries in CSV and creates dictionary of terms in each document/zone, posting list of
+    documentId zones and positioning where term is located, and dictionary of term-length in each
+    document/zone.
+    Args:
+        in_dir      (str): File path of input CSV
+        workers     (int): Number of worker processes used for tabulation
+        chain     (tuple): Names of the tokenizer stages of the analyzer, see analysis.TOKENIZERS
+    Returns:
+        term_dict  (dict): Dictionary of terms to postings
+        doc_weight (dict): Dictionary of documents to weights
+        doc_ids    (list): Side table of document_ids by internal documentId
+    """
+    term_dict = {}
+    doc_weight = {}
+    doc_ids = []
+
+    for partial_term_dict, partial_doc_weight in tabulate_partials(in_dir, doc_ids, workers, chain):
+        merge_dictionary(term_dict, doc_weight, partial_term_dict, partial_doc_weight)
+
+    return (term_dict, doc_weight, doc_ids)
+
+def write_run(term_dict, run_file):
+    """
+    Writes a partial term dictionary to disk as a run sorted by term (SPIMI).
+    Args:
+        term_dict (dict): Dictionary of terms to postings
+        run_file   (str): File path of output run
+    """
+    with open(run_file, 'wb') as f:
+        for term in sorted(term_dict):
+            pickle.dump((term, term_dict[term]), f, pickle.HIGHEST_PROTOCOL)
+
+def read_run(run_file):
+    """
+    Reads back a run written by write_run, one term at a time.
+    Args:
+        run_file (str): File path of input run
+    Returns:
+        (generator): Term - (freq, posting) pairs in sorted term order
+    """
+    with open(run_file, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def merge_runs(run_files):
+    """
+    Performs a k-way merge of runs. Runs are concatenated per term in the order given, which must
+    be CSV order.
+    Args:
+        run_files (list): File paths of runs written by write_run
+    Returns:
+        (generator): Term - (freq, posting) pairs in sorted term order
+    """
+    # heapq.merge yields equal terms in the order of the runs they come from
+    merged = heapq.merge(*[read_run(run_file) for run_file in run_files], key=lambda x: x[0])
+
+    current_term = current_posting = None
+    for term, posting in merged:
+        if term == current_term:
+            current_posting = concat_postings(current_posting, posting)
+            continue
+        if current_term != None:
+            yield (current_term, current_posting)
+        current_term, current_posting = term, posting
+
+    if current_term != None:
+        yield (current_term, current_posting)
+
+def create_runs(in_dir, run_dir, memory_budget, workers=1, chain=INDEX_CHAIN):
+    """
+    Reads all entries in CSV like create_dictionary, but flushes the term dictionary to a sorted run
+    on disk whenever it grows beyond the memory budget.
+    Args:
+        in_dir        (str): File path of input CSV
+        run_dir       (str): Directory to write the runs to
+        memory_budget (int): Approximate maximum size of the in-memory term dictionary in bytes
+        workers       (int): Number of worker processes used for tabulation
+        chain       (tuple): Names of the tokenizer stages of the analyzer, see analysis.TOKENIZERS
+    Returns:
+        run_files  (list): File paths of the runs, in CSV order
+        doc_weight (dict): Dictionary of documents to weights
+        doc_ids    (list): Side table of document_ids by internal documentId
+    """
+    run_files = []
+    term_dict = {}
+    doc_weight = {}
+    doc_ids = []
+    size = 0
+
+    def flush():
+        run_file = os.path.join(run_dir, 'run' + str(len(run_files)))
+        write_run(term_dict, run_file)
+        run_files.append(run_file)
+        term_dict.clear()
+
+    for partial_term_dict, partial_doc_weight in tabulate_partials(in_dir, doc_ids, workers, chain):
+        merge_dictionary(term_dict, doc_weight, partial_term_dict, partial_doc_weight)
+        size += estimate_size(partial_term_dict)
+        if size > memory_budget:
+            flush()
+            size = 0
+
+    if term_dict:
+        flush()
+
+    return (run_files, doc_weight, doc_ids)
+
+def posting_impacts(posting_list, priors):
+    """
+    Computes the impact of each posting of a term, i.e., its document term weight multiplied by the
+    court importance multiplier. The maximum impacts are upper bounds on the score that the term
+    can contribute to a document, used for dynamic pruning.
+    Args:
+        posting_list (list): List of documentId - list of positions pairs
+        priors       (list): Court importance multiplier of documents, indexed by internal documentId
+    Returns:
+        (list): Impact of each posting
+    """
+    return [TermFrequency.logarithm(len(positions)) * priors[doc_id] for doc_id, positions in posting_list]
+
+def tier_streams(posting_list, doc_weight, champions):
+    """
+    Splits a posting list into tiers by court importance, each along with its champion list.
+    Args:
+        posting_list (list): List of documentId - list of positions pairs
+        doc_weight   (list): Weights of documents, indexed by internal documentId
+        champions     (int): Number of postings in the champion list of each tier
+    Returns:
+        (list): Encoded champion list, encoded postings and encoded largest term frequency of each
+                tier, from the highest tier
+    """
+    streams = []
+    for tier in TIERS:
+        postings = [(doc_id, len(positions)) for doc_id, positions in posting_list if doc_weight[doc_id][1] == tier]
+        # All documents of a tier have the same court importance, so the postings with the highest
+        # term frequencies have the highest impacts
+        champion_list = sorted(postings, key=lambda posting: posting[1], reverse=True)[:champions]
+        streams.append(encode_doc_stream(champion_list))
+        streams.append(encode_doc_stream(postings))
+        streams.append(vb_encode([max([tf for _, tf in postings], default=0)]))
+    return streams
+
+def write_posting_list(posting_f, posting, doc_weight, priors, impact_bits=None, impact_ordered=False, champions=None):
+    """
+    Writes a term's posting list at the end of the postings file, see write_postings
+    Args:
+        posting_f     (file): Output postings file
+        posting      (tuple): (freq, posting) of the term
+        doc_weight    (list): Weights of documents, indexed by internal documentId
+        priors        (list): Court importance multipliers of documents, indexed by internal documentId
+        impact_bits, impact_ordered, champions: See write_postings
+    Returns:
+        (tuple): Lexicon entry of the term, see write_postings
+    """
+    posting_list = sorted(posting[1])
+    impacts = posting_impacts(posting_list, priors)
+    doc_stream, pos_stream = encode_posting_list(posting_list)
+    skip_table = encode_skip_table([(doc_id, len(positions)) for doc_id, positions in posting_list], impacts)
+
+    written_pos = posting_f.tell()
+    # The positions stream directly follows the documentId stream, then the skip table
+    doc_size = posting_f.write(doc_stream)
+    pos_size = posting_f.write(pos_stream)
+    skip_size = posting_f.write(skip_table)
+    impact_size = ordered_size = tier_size = impact_scale = 0
+    if impact_bits != None:
+        impact_stream, impact_scale = encode_impacts(impacts, impact_bits)
+        impact_size = posting_f.write(impact_stream)
+    if impact_ordered:
+        ordered_stream = encode_impact_ordered([doc_id for doc_id, _ in posting_list], impact_stream)
+        ordered_size = posting_f.write(ordered_stream)
+    if champions != None:
+        tier_size = posting_f.write(encode_stream_group(tier_streams(posting_list, doc_weight, champions)))
+
+    max_impacts = [0.0, 0.0]
+    for (doc_id, _), impact in zip(posting_list, impacts):
+        max_impacts[zone_of(doc_id)] = max(max_impacts[zone_of(doc_id)], impact)
+    return (posting[0], written_pos, doc_size, pos_size, skip_size, impact_size,
+        ordered_size, tier_size, impact_scale, max_impacts[TITLE_ZONE], max_impacts[CONTENT_ZONE])
+
+def write_postings(out_postings, postings, doc_weight, impact_bits=None, impact_ordered=False, champions=None):
+    """
+    Writes each term's posting list to the postings file, followed by the skip table of its
+    documentId stream, and optionally its impacts, its impact-ordered postings and its tiers.
+    Args:
+        out_postings   (str): File path of output posting
+        postings  (iterable): Term - (freq, posting) pairs
+        doc_weight    (list): Weights of documents, indexed by internal documentId
+        impact_bits    (int): Number of bits of the stored impacts, 0 to store them unquantized, or
+                              None to not store them
+        impact_ordered (bool): Whether to also store the postings in descending order of quantized impact
+        champions      (int): Number of postings in the champion list of each tier, or None to not
+                              store tiers
+    Returns:
+        dictionary_file (dict): Dictionary of terms to (freq, position, documentId stream size,
+                                positions stream size, skip table size, impact stream size,
+                                impact-ordered stream size, tiers size, impact quantization step,
+                                maximum impact per zone) of their posting
+    """
+    priors = [COURT_IMPORTANCE.get(importance, 0) for _, importance in doc_weight]
+
+    dictionary_file = {}
+    with open(out_postings, 'wb') as posting_f:
+        for term, posting in postings:
+            dictionary_file[term] = write_posting_list(posting_f, posting, doc_weight, priors, impact_bits, impact_ordered,
+                champions)
+    return dictionary_file
+
+def term_positions(postings, term, entry):
+    """
+    Reads the positional posting list of a term back from the postings file, one posting at a time
+    Args:
+        postings (PostingsReader): Input postings file
+        term                (str): Target term
+        entry             (tuple): Lexicon entry of the term, see write_postings
+    Returns:
+        (generator): documentId - term - positions triples, in documentId order
+    """
+    _, offset, doc_size, pos_size = entry[:4]
+    prev_key = None
+    for key, key_positions in iter_posting_list(postings.view(offset, doc_size), postings.view(offset + doc_size, pos_size)):
+        # Phrases are matched on the first posting of a repeated documentId, see PhraseEvaluator
+        if key != prev_key:
+            yield (key, term, key_positions)
+        prev_key = key
+
+def biword_postings(out_postings, dictionary_file, threshold):
+    """
+    Finds the occurrences of every pair of adjacent terms that are both in at least threshold zones,
+    from the positional posting lists of these terms, one zone at a time
+    Args:
+        out_postings     (str): File path of the postings file
+        dictionary_file (dict): Dictionary of terms to lexicon entries, see write_postings
+        threshold        (int): Minimum document frequency of both terms of a pair
+    Returns:
+        (generator): Dictionary of the biwords of each zone to (freq, posting), where the positions
+                     of a biword are those of its first term, in documentId order
+    """
+    frequent = sorted(term for term, entry in dictionary_file.items() if entry[0] >= threshold and not is_biword(term))
+    with PostingsReader(out_postings) as postings:
+        # The posting lists of the frequent terms are merged zone by zone
+        merged = heapq.merge(*[term_positions(postings, term, dictionary_file[term]) for term in frequent])
+        for key, zone_postings in itertools.groupby(merged, key=lambda posting: posting[0]):
+            # The positions of the rows of a repeated document_id are concatenated (see concat_postings),
+            # and each row starts over from 0, so several terms can share a position
+            terms_at = collections.defaultdict(list)
+            for _, term, positions in zone_postings:
+                for position in positions:
+                    terms_at[position].append(term)
+
+            pairs = collections.defaultdict(list)
+            for position in sorted(terms_at):
+                for first in terms_at[position]:
+                    for second in terms_at.get(position + 1, ()):
+                        pairs[biword(first, second)].append(position)
+            yield {pair: (1, [(key, positions)]) for pair, positions in pairs.items()}
+
+def add_biwords(biwords, zone_biwords):
+    """
+    Adds the biwords of a zone to a biword dictionary, see biword_postings
+    Args:
+        biwords      (dict): Dictionary of biwords to (freq, posting) of the earlier zones
+        zone_biwords (dict): Dictionary of biwords to (freq, posting) of the zone
+    """
+    for pair, posting in zone_biwords.items():
+        biwords[pair] = concat_postings(biwords[pair], posting) if pair in biwords else posting
+
+def create_biword_runs(out_postings, dictionary_file, threshold, run_dir, memory_budget):
+    """
+    Collects the biwords of biword_postings like create_runs, flushing them to a sorted run on disk
+    whenever they grow beyond the memory budget.
+    Args:
+        out_postings     (str): File path of the postings file
+        dictionary_file (dict): Dictionary of terms to lexicon entries, see write_postings
+        threshold        (int): Minimum document frequency of both terms of a biword
+        run_dir          (str): Directory to write the runs to
+        memory_budget    (int): Approximate maximum size of the in-memory biword dictionary in bytes
+    Returns:
+        (list): File paths of the runs, in documentId order
+    """
+    run_files = []
+    biwords = {}
+    size = 0
+
+    def flush():
+        run_file = os.path.join(run_dir, 'biwords' + str(len(run_files)))
+        write_run(biwords, run_file)
+        run_files.append(run_file)
+        biwords.clear()
+
+    for zone_biwords in biword_postings(out_postings, dictionary_file, threshold):
+        add_biwords(biwords, zone_biwords)
+        size += estimate_size(zone_biwords)
+        if size > memory_budget:
+            flush()
+            size = 0
+
+    if biwords:
+        flush()
+
+    return run_files
+
+def write_biwords(out_postings, dictionary_file, doc_weight, threshold, memory_budget=None, impact_bits=None,
+    impact_ordered=False, champions=None):
+    """
+    Appends the posting lists of the biwords of frequent terms to the postings file, see
+    biword_postings, and adds them to the dictionary as terms
+    Args:
+        out_postings     (str): File path of the postings file
+        dictionary_file (dict): Dictionary of terms to lexicon entries, see write_postings
+        doc_weight      (list): Weights of documents, indexed by internal documentId
+        threshold        (int): Minimum document frequency of both terms of a biword
+        memory_budget    (int): Approximate maximum size of the in-memory biword dictionary in bytes,
+                                or None to keep every biword in memory
+        impact_bits, impact_ordered, champions: See write_postings
+    """
+    priors = [COURT_IMPORTANCE.get(importance, 0) for _, importance in doc_weight]
+
+    def append_postings(biwords):
+        count = 0
+        with open(out_postings, 'ab') as posting_f:
+            for pair, posting in biwords:
+                dictionary_file[pair] = write_posting_list(posting_f, posting, doc_weight, priors, impact_bits,
+                    impact_ordered, champions)
+                count += 1
+        print(f"indexed {count} biwords")
+
+    if memory_budget == None:
+        biwords = {}
+        for zone_biwords in biword_postings(out_postings, dictionary_file, threshold):
+            add_biwords(biwords, zone_biwords)
+        append_postings(sorted(biwords.items()))
+    else:
+        # Biword runs are merged like the runs of the terms, see build_index
+        run_dir = os.path.dirname(os.path.abspath(out_postings))
+        with tempfile.TemporaryDirectory(dir=run_dir) as tmp_dir:
+            run_files = create_biword_runs(out_postings, dictionary_file, threshold, tmp_dir, memory_budget)
+            print('merging', len(run_files), 'biword runs...')
+            append_postings(merge_runs(run_files))
+
+def write_dictionary_file(out_dict, dictionary_file, doc_weight, doc_ids, impact_bits=None, impact_ordered=False,
+    champions=None, biword_threshold=None, synonym_table=False, synonym_vocabulary=()):
+    """
+    Writes the dictionary file: a sorted, front-coded lexicon that can be searched without being
+    loaded, followed by the columns of the document table. The options of the index are recorded in
+    its header, see index_options.
+    Args:
+        out_dict         (str): File path of output dictionary
+        dictionary_file (dict): Dictionary of terms to lexicon entries
+        doc_weight      (list): Weights of documents, indexed by internal documentId
+        doc_ids         (list): Side table of document_ids by internal documentId
+        impact_bits, impact_ordered, champions: See write_postings
+        biword_threshold (int): Minimum document frequency of the terms of the biwords, or None if
+                                the dictionary has no biwords
+        synonym_table   (bool): Whether to precompute the query expansions of the terms, see synonyms.py
+        synonym_vocabulary (set): Terms of the other segments of the index, which the terms are also
+                                  expanded into, see add_segment
+    """
+    header = {
+        'num_terms': len(dictionary_file),
+        'entry_fields': ENTRY_FIELDS,
+        'entry_format': ENTRY_FORMAT,
+        'block_size': BLOCK_SIZE,
+        'impact_bits': impact_bits,
+        'impact_ordered': impact_ordered,
+        'champions': champions,
+        'biword_threshold': biword_threshold,
+        'synonyms_per_term': SYNONYMS_PER_TERM if synonym_table else None,
+    }
+    sections = {'lexicon': encode_lexicon(sorted(dictionary_file.items()), ENTRY_FORMAT, BLOCK_SIZE)}
+    sections.update(encode_documents(doc_weight, doc_ids))
+    if synonym_table:
+        print('expanding terms...')
+        vocabulary = set(term for term in dictionary_file if not is_biword(term)) | set(synonym_vocabulary)
+        synonyms = build_synonym_table(vocabulary)
+        header['synonym_terms'] = len(synonyms)
+        sections.update(encode_synonyms(synonyms))
+    write_dictionary(out_dict, header, sections)
+
+def index_options(dict_file):
+    """
+    Reads the options that an index was built with from the header of its dictionary file
+    Args:
+        dict_file (str): File path of the dictionary file
+    Returns:
+        (dict): impact_bits, impact_ordered, champions, biword_threshold and synonym_table, see build_index
+    """
+    with DictionaryReader(dict_file) as dictionary:
+        header = dictionary.header
+    return {
+        'impact_bits': header.get('impact_bits'),
+        'impact_ordered': header.get('impact_ordered', False),
+        'champions': header.get('champions'),
+        'biword_threshold': header['biword_threshold'],
+        'synonym_table': header['synonyms_per_term'] != None,
+    }
+
 def usage():
-    print("usage: " + sys.argv[0] + " -i dataset-file -d dictionary-file -p postings-file")
+    print("usage: " + sys.argv[0] + " -i dataset-file -d dictionary-file -p postings-file [-w workers] [-m memory-budget] [-s impact-bits [-o]] [-t champions] [-b biword-threshold] [-y] [-a tokenizer-chain] [-u]")
+    print("       " + sys.argv[0] + " -x document-ids-file -d dictionary-file -p postings-file")
+    print("       " + sys.argv[0] + " -c -d dictionary-file -p postings-file [-m memory-budget]")
 
-def build_index(in_dir, out_dict, out_postings):
+def build_index(in_dir, out_dict, out_postings, workers=1, memory_budget=None, impact_bits=None, impact_ordered=False,
+    champions=None, chain=INDEX_CHAIN, biword_threshold=None, synonym_table=False, synonym_vocabulary=()):
     """
     Builds index from documents stored in the input directory, then output the dictionary file and postings file
     Args:
-        in_dir       (str): File path of input directory
-        out_dict     (str): File path of output dictionary
-        out_postings (str): File path of output posting
+        in_dir        (str): File path of input directory
+        out_dict      (str): File path of output dictionary
+        out_postings  (str): File path of output posting
+        workers       (int): Number of worker processes used for tabulation
+        memory_budget (int): Approximate maximum size of the in-memory term dictionary in bytes,
+                             or None to keep the whole term dictionary in memory
+        impact_bits   (int): Number of bits of the precomputed impacts of each posting, 0 to store
+                             them unquantized, or None to not store them
+        impact_ordered (bool): Whether to also store impact-ordered postings, which requires
+                               quantized impacts
+        champions      (int): Number of postings in the champion list of each tier of the postings,
+                              or None to not store tiers
+        chain        (tuple): Names of the tokenizer stages of the analyzer, see analysis.TOKENIZERS
+        biword_threshold (int): Minimum document frequency of both terms of the indexed biwords (pairs
+                                of adjacent terms), or None to not index biwords
+        synonym_table   (bool): Whether to precompute the query expansions of the terms, see synonyms.py
+        synonym_vocabulary (set): Terms of the other segments of the index, which the terms are also
+                                  expanded into, see add_segment
     """
     print('indexing...')
 
     init_csvreader()
-    
-    dictionary_file = {}
-    term_dict, doc_weight = create_dictionary(in_dir)
 
-    with open(out_postings, 'wb') as posting_f:
+    def dense(doc_weight):
+        # Both zones of every document are tabulated, so the internal documentIds are dense
+        return [doc_weight[doc_id] for doc_id in range(len(doc_weight))]
+
+    if memory_budget == None:
+        term_dict, doc_weight, doc_ids = create_dictionary(in_dir, workers, chain)
+        doc_weight = dense(doc_weight)
         # Write each term's posting list
-        for term, posting in term_dict.items():
-            written_pos = posting_f.tell()
-            written_size = posting_f.write(pickle.dumps(posting))
-            dictionary_file[term] = (posting[0], written_pos, written_size)
-
-    with open(out_dict, 'wb') as f:
-        # Write term dictonary and document weights
-        pickle.dump((dictionary_file, doc_weight), f, pickle.HIGHEST_PROTOCOL)
-
-input_dataset = output_file_dictionary = output_file_postings = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-i': # input dataset
-        input_dataset = a
-    elif o == '-d': # dictionary file
-        output_file_dictionary = a
-    elif o == '-p': # postings file
-        output_file_postings = a
+        dictionary_file = write_postings(out_postings, sorted(term_dict.items()), doc_weight, impact_bits, impact_ordered,
+            champions)
     else:
-        assert False, "unhandled option"
+        # Runs are kept next to the postings file, as they are about as large
+        run_dir = os.path.dirname(os.path.abspath(out_postings))
+        with tempfile.TemporaryDirectory(dir=run_dir) as tmp_dir:
+            run_files, doc_weight, doc_ids = create_runs(in_dir, tmp_dir, memory_budget, workers, chain)
+            doc_weight = dense(doc_weight)
+            print('merging', len(run_files), 'runs...')
+            dictionary_file = write_postings(out_postings, merge_runs(run_files), doc_weight, impact_bits, impact_ordered, champions)
+
+    if biword_threshold != None:
+        write_biwords(out_postings, dictionary_file, doc_weight, biword_threshold, memory_budget, impact_bits, impact_ordered,
+            champions)
+
+    # Write term dictonary, document weights and the document_id side table
+    write_dictionary_file(out_dict, dictionary_file, doc_weight, doc_ids, impact_bits, impact_ordered, champions,
+        biword_threshold, synonym_table, synonym_vocabulary)
+
+def add_segment(in_dir, out_dict, out_postings, workers=1, memory_budget=None, impact_bits=None, impact_ordered=False,
+    champions=None, chain=INDEX_CHAIN, biword_threshold=None, synonym_table=False):
+    """
+    Indexes the documents stored in the input directory as a new segment of an existing index (see
+    segments.py), and tombstones the earlier versions of the documents that they update
+    Args:
+        in_dir        (str): File path of input directory, with the new and updated documents
+        out_dict      (str): File path of the dictionary of the index
+        out_postings  (str): File path of the posting of the index
+        workers, memory_budget, impact_bits, impact_ordered, champions, chain, biword_threshold,
+        synonym_table: See build_index, which should match those of the index
+    """
+    manifest = read_manifest(out_dict, out_postings)
+    segment = manifest['next_segment']
+    segment_dict = f"{out_dict}.{segment}"
+    segment_postings_file = f"{out_postings}.{segment}"
+    # The synonym table of the segment also expands into the terms of the earlier segments, so that it
+    # expands the terms like the table of a single index of every segment, see SegmentedSynonymTable
+    synonym_vocabulary = set()
+    if synonym_table:
+        for earlier_segment in manifest['segments']:
+            synonym_vocabulary |= segment_terms(earlier_segment)
+    build_index(in_dir, segment_dict, segment_postings_file, workers, memory_budget, impact_bits, impact_ordered, champions, chain,
+        biword_threshold, synonym_table, synonym_vocabulary)
+
+    document_ids = set(entry[ID] for entry in read_entries(in_dir))
+    updated = tombstone(manifest, document_ids)
+    manifest['segments'].append({'dict': segment_dict, 'postings': segment_postings_file, 'deleted': []})
+    manifest['next_segment'] = segment + 1
+    write_manifest(out_dict, manifest)
+    print(f"added segment {segment} of {len(document_ids)} documents, {updated} updated")
+
+def delete_documents(ids_file, out_dict, out_postings):
+    """
+    Tombstones the documents of an index with the given document_ids, in every segment
+    Args:
+        ids_file      (str): File path of the document_ids to delete, one per line
+        out_dict      (str): File path of the dictionary of the index
+        out_postings  (str): File path of the posting of the index
+    """
+    with open(ids_file, 'r') as f:
+        document_ids = set(line.strip() for line in f if line.strip())
 
-if input_dataset == None or output_file_postings == None or output_file_dictionary == None:
-    usage()
-    sys.exit(2)
+    manifest = read_manifest(out_dict, out_postings)
+    deleted = tombstone(manifest, document_ids)
+    write_manifest(out_dict, manifest)
+    print(f"deleted {deleted} documents")
 
-# Track time taken for indexing
-start = time.time()
-build_index(input_dataset, output_file_dictionary, output_file_postings)
-end = time.time()
-print('Time Taken:', str(timedelta(seconds=math.ceil(end - start))))
+def compact_index(out_dict, out_postings, memory_budget=None):
+    """
+    Merges the live documents of every segment of an index back into a single index, numbered in
+    segment order, which replaces the index and its segments. The merged index has the options of
+    the first segment, see index_options
+    Args:
+        out_dict      (str): File path of the dictionary of the index
+        out_postings  (str): File path of the posting of the index
+        memory_budget (int): Approximate maximum size of the in-memory biword dictionary in bytes, or
+                             None to keep every biword in memory
+    """
+    print('compacting...')
+    manifest = read_manifest(out_dict, out_postings)
+    options = index_options(manifest['segments'][0]['dict'])
+    impact_bits, impact_ordered, champions = options['impact_bits'], options['impact_ordered'], options['champions']
+    biword_threshold, synonym_table = options['biword_threshold'], options['synonym_table']
+    segments = [Segment(segment) for segment in manifest['segments']]
+    doc_nums, doc_weight, doc_ids = live_documents(segments)
+
+    # The index is only replaced once it is fully written, so that it can be searched meanwhile
+    tmp_dict = out_dict + '.tmp'
+    tmp_postings = out_postings + '.tmp'
+    dictionary_file = write_postings(tmp_postings, segment_postings(segments, doc_nums), doc_weight, impact_bits,
+        impact_ordered, champions)
+    # Biwords depend on the document frequencies of their terms, so they are found again
+    if biword_threshold != None:
+        write_biwords(tmp_postings, dictionary_file, doc_weight, biword_threshold, memory_budget, impact_bits, impact_ordered,
+            champions)
+    write_dictionary_file(tmp_dict, dictionary_file, doc_weight, doc_ids, impact_bits, impact_ordered, champions,
+        biword_threshold, synonym_table)
+    os.replace(tmp_postings, out_postings)
+    os.replace(tmp_dict, out_dict)
+
+    for segment in manifest['segments'][1:]:
+        os.remove(segment['dict'])
+        os.remove(segment['postings'])
+    if os.path.exists(manifest_file(out_dict)):
+        os.remove(manifest_file(out_dict))
+    print(f"compacted {len(segments)} segments into {len(doc_ids)} documents")
+
+if __name__ == "__main__":
+    input_dataset = output_file_dictionary = output_file_postings = None
+    deleted_ids_file = None
+    add = compact = False
+    workers = 1
+    memory_budget = None
+    impact_bits = None
+    impact_ordered = False
+    champions = None
+    biword_threshold = None
+    synonym_table = False
+    chain = INDEX_CHAIN
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:w:m:s:ot:b:ya:ux:c')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i': # input dataset
+            input_dataset = a
+        elif o == '-d': # dictionary file
+            output_file_dictionary = a
+        elif o == '-p': # postings file
+            output_file_postings = a
+        elif o == '-w': # number of worker processes
+            workers = int(a)
+        elif o == '-m': # memory budget of the term dictionary, e.g. 512M
+            memory_budget = parse_size(a)
+        elif o == '-s': # bits of the precomputed impacts, 0 for unquantized
+            impact_bits = int(a)
+        elif o == '-o': # impact-ordered postings
+            impact_ordered = True
+        elif o == '-t': # tiers by court importance, with champion lists of the given length
+            champions = int(a)
+        elif o == '-b': # biwords of the terms in at least the given number of zones
+            biword_threshold = int(a)
+        elif o == '-y': # synonym table of the terms, for query expansion
+            synonym_table = True
+        elif o == '-a': # tokenizer chain of the analyzer, e.g. sentences,lower,words
+            chain = tuple(a.split(','))
+        elif o == '-u': # add the dataset as a new segment of the index
+            add = True
+        elif o == '-x': # delete the documents of the index with the document_ids of the file
+            deleted_ids_file = a
+        elif o == '-c': # compact the segments of the index
+            compact = True
+        else:
+            assert False, "unhandled option"
+
+    # Deleting and compacting do not read a dataset, and only one of them can be done at a time. Compacting
+    # keeps the options of the index
+    if (input_dataset == None) != (deleted_ids_file != None or compact) or (add + compact + (deleted_ids_file != None)) > 1 or \
+        (compact and (impact_bits != None or impact_ordered or champions != None or biword_threshold != None or synonym_table)) or \
+        output_file_postings == None or output_file_dictionary == None or \
+        (impact_bits != None and not 0 <= impact_bits <= MAX_IMPACT_BITS) or (impact_ordered and not impact_bits) or \
+        (biword_threshold != None and biword_threshold < 1) or \
+        any(stage not in TOKENIZERS for stage in chain):
+        usage()
+        sys.exit(2)
+
+    # Track time taken for indexing
+    start = time.time()
+    if add:
+        add_segment(input_dataset, output_file_dictionary, output_file_postings, workers, memory_budget, impact_bits,
+            impact_ordered, champions, chain, biword_threshold, synonym_table)
+    elif deleted_ids_file != None:
+        delete_documents(deleted_ids_file, output_file_dictionary, output_file_postings)
+    elif compact:
+        compact_index(output_file_dictionary, output_file_postings, memory_budget)
+    else:
+        build_index(input_dataset, output_file_dictionary, output_file_postings, workers, memory_budget, impact_bits,
+            impact_ordered, champions, chain, biword_threshold, synonym_table)
+    end = time.time()
+    print('Time Taken:', str(timedelta(seconds=math.ceil(end - start))))
@@ -0,0 +1,227 @@
+import struct
+from collections import namedtuple
+from functools import lru_cache
+from compression import vb_encode_number, vb_decode_number
+
+"""
+On-disk lexicon mapping each term to a fixed-size entry (e.g., document frequency and the location
+of its posting list), which can be searched directly in a memory-mapped dictionary file.
+
+Terms are sorted and grouped into blocks of block_size terms, with front coding inside each block:
+the first term of a block is stored in full, and every other term only stores the length of the
+prefix it shares with the previous term and the remaining suffix. Each term is followed by its
+entry, packed with a fixed struct format. The lexicon starts with a table of the offsets of each
+block, so a term is found by binary searching the first terms of the blocks, then scanning a single
+block.
+"""
+
+# Number of terms per front-coded block
+BLOCK_SIZE = 16
+
+BLOCK_OFFSET = struct.Struct('<Q')
+
+# Number of lexicon lookups remembered by each Lexicon
+LOOKUP_CACHE_SIZE = 4096
+
+# Separates the two terms of a biword (see index.py -b), which terms never contain, so biwords never
+# match the terms of a query
+BIWORD_SEPARATOR = ' '
+
+def biword(first, second):
+    """
+    Returns the lexicon term of a pair of adjacent terms
+    Args:
+        first  (str): First term of the pair
+        second (str): Second term of the pair
+    Returns:
+        (str): Biword of the pair
+    """
+    return first + BIWORD_SEPARATOR + second
+
+def is_biword(term):
+    """
+    Checks if a lexicon term is a biword rather than a term
+    """
+    return BIWORD_SEPARATOR in term
+
+def common_prefix_length(a, b):
+    """
+    Returns the length of the common prefix of two byte strings.
+    Args:
+        a (bytes): First byte string
+        b (bytes): Second byte string
+    Returns:
+        (int): Length of the common prefix
+    """
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+def encode_lexicon(entries, entry_format, block_size=BLOCK_SIZE):
+    """
+    Encodes the lexicon section of a dictionary file.
+    Args:
+        entries     (iterable): Term - entry tuple pairs, sorted by term
+        entry_format     (str): struct format of an entry
+        block_size       (int): Number of terms per front-coded block
+    Returns:
+        (bytes): Encoded lexicon
+    """
+    entry_struct = struct.Struct(entry_format)
+    blocks = bytearray()
+    block_offsets = []
+    prev_term = b''
+
+    for i, (term, entry) in enumerate(entries):
+        term = term.encode('utf8')
+        if i % block_size == 0:
+            block_offsets.append(len(blocks))
+            blocks += vb_encode_number(len(term))
+            blocks += term
+        else:
+            prefix_length = common_prefix_length(prev_term, term)
+            blocks += vb_encode_number(prefix_length)
+            blocks += vb_encode_number(len(term) - prefix_length)
+            blocks += term[prefix_length:]
+        blocks += entry_struct.pack(*entry)
+        prev_term = term
+
+    table = b''.join(BLOCK_OFFSET.pack(offset) for offset in block_offsets)
+    return vb_encode_number(len(block_offsets)) + table + blocks
+
+class Lexicon:
+    """
+    Read-only lexicon backed by the lexicon section of a dictionary file. It can be used like a
+    dictionary of terms to entries, without loading the vocabulary into Python objects.
+    """
+    def __init__(self, buf, num_terms, entry_format, entry_fields, block_size=BLOCK_SIZE):
+        """
+        Initializes Lexicon object.
+        Args:
+            buf          (memoryview): Encoded lexicon section
+            num_terms           (int): Number of terms in the lexicon
+            entry_format        (str): struct format of an entry
+            entry_fields  (list[str]): Names of the fields of an entry
+            block_size          (int): Number of terms per front-coded block
+        """
+        self.buf = buf
+        self.num_terms = num_terms
+        self.entry_struct = struct.Struct(entry_format)
+        self.entry_type = namedtuple('LexiconEntry', entry_fields)
+        self.block_size = block_size
+
+        self.num_blocks, self.table_start = vb_decode_number(buf, 0)
+        self.blocks_start = self.table_start + self.num_blocks * BLOCK_OFFSET.size
+        self.get = lru_cache(maxsize=LOOKUP_CACHE_SIZE)(self.lookup)
+
+    @classmethod
+    def from_dictionary(cls, dictionary):
+        """
+        Opens the lexicon section of a dictionary file.
+        Args:
+            dictionary (DictionaryReader): Input dictionary file
+        Returns:
+            (Lexicon): Lexicon of the dictionary file
+        """
+        header = dictionary.header
+        return cls(dictionary.section('lexicon'), header['num_terms'], header['entry_format'],
+            header['entry_fields'], header['block_size'])
+
+    def block_offset(self, block):
+        """
+        Returns the offset of a block within the lexicon section.
+        Args:
+            block (int): Index of the block
+        Returns:
+            (int): Offset of the block
+        """
+        offset, = BLOCK_OFFSET.unpack_from(self.buf, self.table_start + block * BLOCK_OFFSET.size)
+        return self.blocks_start + offset
+
+    def first_term(self, block):
+        """
+        Returns the first term of a block.
+        Args:
+            block (int): Index of the block
+        Returns:
+            (bytes): First term of the block
+        """
+        length, pos = vb_decode_number(self.buf, self.block_offset(block))
+        return bytes(self.buf[pos:pos + length])
+
+    def scan_block(self, block):
+        """
+        Decodes all terms and entries of a block.
+        Args:
+            block (int): Index of the block
+        Returns:
+            (generator): Term (bytes) - entry pairs of the block, in sorted order
+        """
+        pos = self.block_offset(block)
+        count = min(self.block_size, self.num_terms - block * self.block_size)
+        term = b''
+        for i in range(count):
+            if i == 0:
+                length, pos = vb_decode_number(self.buf, pos)
+                term = bytes(self.buf[pos:pos + length])
+                pos += length
+            else:
+                prefix_length, pos = vb_decode_number(self.buf, pos)
+                length, pos = vb_decode_number(self.buf, pos)
+                term = term[:prefix_length] + bytes(self.buf[pos:pos + length])
+                pos += length
+            entry = self.entry_type._make(self.entry_struct.unpack_from(self.buf, pos))
+            pos += self.entry_struct.size
+            yield (term, entry)
+
+    def lookup(self, term):
+        """
+        Looks up the entry of a term.
+        Args:
+            term (str): Target term
+        Returns:
+            (LexiconEntry): Entry of the term, or None if the term is not in the lexicon
+        """
+        term = term.encode('utf8')
+
+        # Find the last block whose first term is not after the term
+        lo, hi = 0, self.num_blocks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.first_term(mid) <= term:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+
+        for block_term, entry in self.scan_block(lo - 1):
+            if block_term == term:
+                return entry
+            if block_term > term:
+                break
+        return None
+
+    def items(self):
+        """
+        Iterates over the whole lexicon.
+        Returns:
+            (generator): Term - entry pairs, in sorted order
+        """
+        for block in range(self.num_blocks):
+            for term, entry in self.scan_block(block):
+                yield (term.decode('utf8'), entry)
+
+    def __contains__(self, term):
+        return self.get(term) != None
+
+    def __getitem__(self, term):
+        entry = self.get(term)
+        if entry == None:
+            raise KeyError(term)
+        return entry
+
+    def __len__(self):
+        return self.num_terms
@@ -1,140 +1,489 @@
-import pickle
-from weighting import TermFrequency, DocumentFrequency, TfIdfWeight
-from collections import defaultdict, Counter
-from algorithm import TopK
-
-class VectorSpaceModel:
-    def __init__(self, dictionary, document_weights, postings):
-        """
-        Initializes VectorSpaceModel object.
-        Loads dictionary file and posting file.
-        Stores dictionary of terms and dictionary of weights.
-        Args:
-            dict_file    (str): File path of input dictionary file
-            posting_file (str): File path of input posting file
-        """
-        self.dictionary = dictionary
-        self.document_weights = document_weights
-        self.posting_file = postings
-
-        self.query_tf_idf = TfIdfWeight(TermFrequency.LOGARITHM, DocumentFrequency.IDF)
-        self.doc_tf_idf = TfIdfWeight(TermFrequency.LOGARITHM, DocumentFrequency.NO)
-    
-    def get_doc_freq(self, term):
-        """
-        Retrieves frequency of term
-        Args:
-            term     (str): Target term
-        Returns:
-            doc_freq (int): Number of documents that contain the term
-        """
-        if term not in self.dictionary:
-            return 0
-        
-        doc_freq, _, _ = self.dictionary[term]
-        return doc_freq    
-
-    def get_posting_list(self, term):
-        """
-        Retrieves posting list of term from posting file
-        Args:
-            term          (str): Target term
-        Returns:
-            posting_list (list): List of documentId - list of positions pairs
-        """
-        if term not in self.dictionary:
-            return []
-
-        _, pos, size = self.dictionary[term]
-
-        self.posting_file.seek(pos)
-        posting_list = pickle.loads(self.posting_file.read(size))
-        
-        return posting_list
-
-    def get_document_weight(self, doc_id):
-        """
-        Returns the document weight of document with the given id.
-        Args:
-            doc_id (str): Target document id
-        Returns:
-            (float): Weight of the target document
-        """
-        # we should only be calling this function on weights that we know exist
-        assert doc_id in self.document_weights
-
-        return self.document_weights[doc_id][0]
-
-    def get_document_importance(self, doc_id, get_vals=False):
-        """
-        Returns the weight of the document based on their court importance. (H, M, L)
-        Args:
-            doc_id       (str): Target document id
-            get_vals (boolean): True if return value should an float/score, false if the return value should be a str indicating the importance
-        Returns:
-            (float): Multiplier of court importance
-        """
-        # we should only be calling this function on weights that we know exist
-        assert doc_id in self.document_weights
-
-        if not get_vals:
-            return self.document_weights[doc_id][1]
-
-        if self.document_weights[doc_id][1] == 'H':
-            return 10
-        elif self.document_weights[doc_id][1] == 'M':
-            return 8.5
-        elif self.document_weights[doc_id][1] == 'L':
-            return 1
-        else:
-            return 0
-
-    def cosine_score(self, query, k = None): 
-        """
-        Computes the cosine score and returns the top k (score, doc_id) pairs
-        Args:
-            query_detail (dict): Dictionary of query terms and frequency
-            k             (int): Top number of results to return
-        Returns:
-            (list): Descending list of score-documentId pairs by score
-        """
-        N = len(self.document_weights)
-        scores = defaultdict(float)
-        
-        # Calculate cosine score
-        query_freq = Counter(query.terms)
-        query_vectors = defaultdict(float)
-        
-        for query_term, query_term_freq in query_freq.items():
-            if query_term not in self.dictionary:
-                continue
-            wtq = self.query_tf_idf.weight(query_term_freq, N, self.get_doc_freq(query_term))
-            query_vectors[query_term] = wtq
-
-        # Calculate final score w/ doc weight. Lines 3-6 in lect algo
-        for query_term, query_term_freq in query_freq.items():
-            if query_term not in self.dictionary:
-                continue
-                
-            wtq = query_vectors[query_term]
-            posting_list = self.get_posting_list(query_term)
-            for doc_id, pos in posting_list[1]:
-                tf = len(pos)
-                wtd = self.doc_tf_idf.weight(tf)
-                score = wtq * wtd
-                scores[doc_id] += score
-        
-        # Normalisation step. Line 8-9 of the lect algo
-        # for doc_id, score in scores.items():
-        #     scores[doc_id] = score / self.get_document_weight(doc_id)
-
-        if k == None:
-            # does the same thing as .result() in top_k
-            return reversed(sorted([(score * self.get_document_importance(doc_id, get_vals=True), doc_id) for doc_id, score in scores.items()]))
-
-        # find top k results
-        top_k = TopK(k)
-        for doc_id, score in scores.items():
-            top_k.add((score * self.get_document_importance(doc_id, get_vals=True), doc_id))
-        
-        return top_k.result()
+import numpy as np
+from functools import wraps
+from compression import decode_doc_stream, decode_doc_stream_arrays, decode_pos_stream, decode_doc_block, decode_skip_table, decode_impacts, MAX_DOC_ID, doc_num_of, zone_of, CONTENT_ZONE
+from weighting import TermFrequency, DocumentFrequency, TfIdfWeight
+from collections import defaultdict, Counter
+from algorithm import TopK
+from cache import PostingCache
+
+# Weight of the title zone when combining the scores of both zones of a document; the content zone
+# gets the rest
+TITLE_WEIGHT = 0.2
+
+# Number of integer score units that the largest possible term score of a query is split into, when
+# scoring quantized impacts
+QUERY_LEVELS = (1 << 16) - 1
+
+def cached_postings(getter):
+    """
+    Decorates a getter of the posting data of a term, so that the data is fetched and decoded once
+    and then shared through the posting cache of the model, if it has one (see
+    VectorSpaceModel.posting_cache). The decoded data is shared, so callers must not modify it.
+    Args:
+        getter (function): Method taking a term and any further hashable arguments
+    Returns:
+        (function): Cached method
+    """
+    @wraps(getter)
+    def cached_getter(self, term, *args):
+        if self.posting_cache == None:
+            return getter(self, term, *args)
+
+        return self.posting_cache.fetch((getter.__name__, self.posting_file, term) + args, lambda: getter(self, term, *args))
+
+    return cached_getter
+
+class VectorSpaceModel:
+    # Getters of the posting data that scoring reads, fetched ahead of scoring by prefetch
+    posting_getters = ('get_posting_list',)
+
+    def __init__(self, dictionary, document_weights, postings):
+        """
+        Initializes VectorSpaceModel object.
+        Loads dictionary file and posting file.
+        Stores dictionary of terms and table of document weights.
+        Args:
+            dictionary                (Lexicon): Lexicon of terms to entries locating their posting
+            document_weights    (DocumentTable): Weights of documents, indexed by internal document id
+            postings           (PostingsReader): Input posting file
+        """
+        self.dictionary = dictionary
+        self.document_weights = document_weights
+        self.posting_file = postings
+        # PostingCache of decoded posting data shared between queries, or None to decode it again
+        # for every query
+        self.posting_cache = None
+        # CollectionStatistics of every segment of a segmented index (see segments.py), or None to
+        # weigh queries by the statistics of this index alone
+        self.statistics = None
+        # How search.py ranks queries with phrases, see phrases.QUERY_MODES
+        self.query_mode = 'phrase'
+        # SynonymTable that search.py expands queries with (see synonyms.py), or None to expand them
+        # with WordNet
+        self.synonyms = None
+
+        self.query_tf_idf = TfIdfWeight(TermFrequency.LOGARITHM, DocumentFrequency.IDF)
+        self.doc_tf_idf = TfIdfWeight(TermFrequency.LOGARITHM, DocumentFrequency.NO)
+    
+    def get_doc_freq(self, term):
+        """
+        Retrieves frequency of term
+        Args:
+            term     (str): Target term
+        Returns:
+            doc_freq (int): Number of documents that contain the term
+        """
+        entry = self.dictionary.get(term)
+        if entry == None:
+            return 0
+        
+        return entry.df    
+
+    @cached_postings
+    def get_posting_list(self, term):
+        """
+        Retrieves posting list of term from posting file, without positions
+        Args:
+            term          (str): Target term
+        Returns:
+            posting_list (list): List of documentId - term frequency pairs
+        """
+        entry = self.dictionary.get(term)
+        if entry == None:
+            return []
+
+        posting_list = decode_doc_stream(self.posting_file.view(entry.offset, entry.doc_size))
+        
+        return posting_list
+
+    @cached_postings
+    def get_positional_posting_list(self, term):
+        """
+        Retrieves posting list of term from posting file, along with the positions of the term
+        Args:
+            term          (str): Target term
+        Returns:
+            posting_list (list): List of documentId - list of positions pairs
+        """
+        entry = self.dictionary.get(term)
+        if entry == None:
+            return []
+
+        doc_ids = [doc_id for doc_id, _ in self.get_posting_list(term)]
+        positions = decode_pos_stream(self.posting_file.view(entry.offset + entry.doc_size, entry.pos_size))
+
+        return list(zip(doc_ids, positions))
+
+    @cached_postings
+    def get_skip_table(self, term):
+        """
+        Retrieves the skip table of the posting list of term from posting file
+        Args:
+            term          (str): Target term
+        Returns:
+            skip_table   (list): Last documentId - end offset - maximum title impact - maximum content
+                                 impact of each block of the posting list
+        """
+        entry = self.dictionary.get(term)
+        if entry == None:
+            return []
+
+        if entry.skip_size == 0:
+            # The posting list is a single block, bounded by the maximum impacts of the term
+            return [(MAX_DOC_ID, entry.doc_size, entry.max_title, entry.max_content)]
+
+        return decode_skip_table(self.posting_file.view(entry.offset + entry.doc_size + entry.pos_size, entry.skip_size))
+
+    def get_posting_block(self, term, skip_table, block):
+        """
+        Retrieves a single block of the posting list of term from posting file, without positions
+        Args:
+            term          (str): Target term
+            skip_table   (list): Skip table of the posting list, see get_skip_table
+            block         (int): Index of the block
+        Returns:
+            posting_list (list): List of documentId - term frequency pairs of the block
+        """
+        def decode():
+            entry = self.dictionary[term]
+            base, start = skip_table[block - 1][:2] if block > 0 else (0, 0)
+
+            return decode_doc_block(self.posting_file.view(entry.offset + start, skip_table[block][1] - start), base)
+
+        if self.posting_cache == None:
+            return decode()
+
+        # The skip table is determined by the term, so the term and block locate the block
+        return self.posting_cache.fetch(('get_posting_block', self.posting_file, term, block), decode)
+
+    def prefetch(self, terms):
+        """
+        Fetches and decodes the posting data that scoring reads for each term into the posting cache,
+        eg before scoring queries in worker processes that share it
+        Args:
+            terms (iterable): Target terms
+        """
+        if self.posting_cache == None:
+            self.posting_cache = PostingCache()
+        for term in terms:
+            if term in self.dictionary:
+                for getter in self.posting_getters:
+                    getattr(self, getter)(term)
+
+    def get_document_weight(self, doc_id):
+        """
+        Returns the document weight of document with the given id.
+        Args:
+            doc_id (int): Target internal document id
+        Returns:
+            (float): Weight of the target document
+        """
+        # we should only be calling this function on weights that we know exist
+        assert 0 <= doc_id < len(self.document_weights)
+
+        return float(self.document_weights.lengths[doc_id])
+
+    def get_document_importance(self, doc_id, get_vals=False):
+        """
+        Returns the weight of the document based on their court importance. (H, M, L)
+        Args:
+            doc_id       (int): Target internal document id
+            get_vals (boolean): True if return value should an float/score, false if the return value should be a str indicating the importance
+        Returns:
+            (float): Multiplier of court importance
+        """
+        # we should only be calling this function on weights that we know exist
+        assert 0 <= doc_id < len(self.document_weights)
+
+        if not get_vals:
+            return chr(self.document_weights.importance[doc_id])
+
+        # Multipliers are computed at indexing time, see documents.COURT_IMPORTANCE
+        return float(self.document_weights.priors[doc_id])
+
+    def query_weights(self, query):
+        """
+        Computes the weight of each query term that is in the dictionary
+        Args:
+            query (QueryDetails): Target query
+        Returns:
+            query_vectors (dict): Dictionary of query terms to weights, in order of first occurrence,
+                                  followed by the expansion terms of the query
+        """
+        N = len(self.document_weights)
+        query_freq = Counter(query.terms)
+        query_vectors = {}
+
+        for query_term in list(query_freq) + [term for term in query.expansions if term not in query_freq]:
+            if query_term not in self.dictionary:
+                continue
+            if self.statistics == None:
+                doc_freq = self.get_doc_freq(query_term)
+            else:
+                N = self.statistics.size
+                doc_freq = self.statistics.doc_freq(query_term)
+                if doc_freq == 0:
+                    # Every posting of the term is of tombstoned documents
+                    continue
+            if query_term in query_freq:
+                wtq = self.query_tf_idf.weight(query_freq[query_term], N, doc_freq)
+            else:
+                # Expansion terms are weighted as a single occurrence, scaled by their expansion weight
+                wtq = query.expansions[query_term] * self.query_tf_idf.weight(1, N, doc_freq)
+            query_vectors[query_term] = wtq
+
+        return query_vectors
+
+    def apply_priors(self, scores):
+        """
+        Multiplies the scores of documents by the multipliers of their court importance
+        Args:
+            scores (dict): Dictionary of documentIds to scores
+        Returns:
+            (iterable): Score-documentId pairs
+        """
+        # Apply the court importance multipliers to all scores at once
+        doc_ids = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+        final_scores = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+        final_scores *= self.document_weights.priors[doc_ids]
+        return zip(final_scores.tolist(), doc_ids.tolist())
+
+    def cosine_score(self, query, k = None): 
+        """
+        Computes the cosine score and returns the top k (score, doc_id) pairs
+        Args:
+            query_detail (dict): Dictionary of query terms and frequency
+            k             (int): Top number of results to return
+        Returns:
+            (list): Descending list of score-documentId pairs by score
+        """
+        scores = defaultdict(float)
+        
+        # Calculate cosine score
+        query_vectors = self.query_weights(query)
+
+        # Calculate final score w/ doc weight. Lines 3-6 in lect algo
+        for query_term, wtq in query_vectors.items():
+            posting_list = self.get_posting_list(query_term)
+            for doc_id, tf in posting_list:
+                wtd = self.doc_tf_idf.weight(tf)
+                score = wtq * wtd
+                scores[doc_id] += score
+        
+        # Normalisation step. Line 8-9 of the lect algo
+        # for doc_id, score in scores.items():
+        #     scores[doc_id] = score / self.get_document_weight(doc_id)
+
+        score_id_pairs = self.apply_priors(scores)
+
+        if k == None:
+            # does the same thing as .result() in top_k
+            return reversed(sorted(score_id_pairs))
+
+        # find top k results
+        top_k = TopK(k)
+        for score_id_pair in score_id_pairs:
+            top_k.add(score_id_pair)
+        
+        return top_k.result()
+
+    def zone_score(self, query, k = None, title_a = TITLE_WEIGHT):
+        """
+        Computes the cosine score of each zone, then combines the zones of each document into a
+        weighted sum, and returns the top k (doc_num, score) pairs
+        Args:
+            query_detail (dict): Dictionary of query terms and frequency
+            k             (int): Top number of results to return
+            title_a     (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (list): Descending list of documentId-score pairs by score
+        """
+        return self.combine_zones(self.cosine_score(query), title_a)[:k]
+
+    def combine_zones(self, score_id_pairs, title_a = TITLE_WEIGHT):
+        """
+        Combines the scores of the zones of each document into a weighted sum
+        Args:
+            score_id_pairs (iterable): Score-documentId pairs of zones
+            title_a           (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (list): Descending list of documentId-score pairs by score
+        """
+        results = [(id, score) for score, id in score_id_pairs]
+
+        # Score based on zone
+        content_a = 1 - title_a
+        new_results = {}
+        for id, score in results:
+            zone = zone_of(id)
+            doc_num = doc_num_of(id)
+            if doc_num not in new_results:
+                if zone == CONTENT_ZONE: # Content
+                    new_results[doc_num] = content_a * score
+                else: # Title
+                    new_results[doc_num] = title_a * score
+            else:
+                if zone == CONTENT_ZONE: # Content
+                    new_results[doc_num] += content_a * score
+                else: # Title
+                    new_results[doc_num] += title_a * score
+
+        results = list(new_results.items())
+        results.sort(key=lambda x: x[1], reverse=True)
+
+        return results
+
+class NumpyVectorSpaceModel(VectorSpaceModel):
+    """
+    VectorSpaceModel with a vectorized scoring engine. Posting lists are decoded into NumPy arrays,
+    and scores are accumulated into a dense array indexed by internal document id. It gives the
+    same scores and ranking as VectorSpaceModel.
+    """
+    posting_getters = ('get_posting_arrays',)
+
+    @cached_postings
+    def get_posting_arrays(self, term):
+        """
+        Retrieves posting list of term from posting file as arrays, without positions
+        Args:
+            term                     (str): Target term
+        Returns:
+            doc_ids       (ndarray[int64]): Document ids of the postings
+            term_freqs    (ndarray[int64]): Term frequencies of the postings
+        """
+        entry = self.dictionary.get(term)
+        if entry == None:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+        return decode_doc_stream_arrays(self.posting_file.view(entry.offset, entry.doc_size))
+
+    def document_term_weights(self, term_freqs):
+        """
+        Computes the weight of each posting from its term frequency.
+        Args:
+            term_freqs (ndarray[int64]): Term frequencies of the postings
+        Returns:
+            (ndarray[float64]): Document term weights of the postings
+        """
+        # Only a handful of distinct term frequencies occur, so weights are computed once for each
+        # of them with the same function as VectorSpaceModel, which keeps the scores bit-identical
+        distinct_freqs, freq_index = np.unique(term_freqs, return_inverse=True)
+        weights = np.array([self.doc_tf_idf.weight(tf) for tf in distinct_freqs.tolist()], dtype=np.float64)
+        return weights[freq_index]
+
+    def cosine_score(self, query, k = None):
+        """
+        Computes the cosine score and returns the top k (score, doc_id) pairs
+        Args:
+            query_detail (dict): Dictionary of query terms and frequency
+            k             (int): Top number of results to return
+        Returns:
+            (list): Descending list of score-documentId pairs by score
+        """
+        N = len(self.document_weights)
+        # float64 rather than float32, as rounding differences would reorder near-ties
+        scores = np.zeros(N, dtype=np.float64)
+        scored = np.zeros(N, dtype=bool)
+
+        for query_term, wtq in self.query_weights(query).items():
+            doc_ids, term_freqs = self.get_posting_arrays(query_term)
+            if len(doc_ids) == 0:
+                continue
+            term_scores = wtq * self.document_term_weights(term_freqs)
+
+            # Repeated document_ids give repeated postings, which fancy indexing would only add once
+            if np.all(doc_ids[1:] > doc_ids[:-1]):
+                scores[doc_ids] += term_scores
+            else:
+                np.add.at(scores, doc_ids, term_scores)
+            scored[doc_ids] = True
+
+        doc_ids = np.flatnonzero(scored)
+        final_scores = scores[doc_ids] * self.document_weights.priors[doc_ids]
+
+        if k != None and k < len(doc_ids):
+            # Keep the top k scores, along with anything tied with the k-th
+            kth_score = final_scores[np.argpartition(-final_scores, k - 1)[k - 1]]
+            candidates = final_scores >= kth_score
+            doc_ids = doc_ids[candidates]
+            final_scores = final_scores[candidates]
+
+        # Descending by score, then by document id, like VectorSpaceModel
+        order = np.lexsort((doc_ids, final_scores))[::-1][:k]
+        return list(zip(final_scores[order].tolist(), doc_ids[order].tolist()))
+
+class ImpactVectorSpaceModel(VectorSpaceModel):
+    """
+    VectorSpaceModel for indexes built with precomputed impacts (index.py -s). The document term
+    weight and court importance multiplier of each posting are read from its impact instead of
+    being computed from its term frequency.
+
+    With quantized impacts, each query term gets a table of the (integer) score of every quantized
+    impact, in units of the query's largest possible term score divided by QUERY_LEVELS, so that
+    scoring a posting is a lookup and an integer add.
+    """
+    posting_getters = ('get_posting_list', 'get_impacts')
+
+    @cached_postings
+    def get_impacts(self, term):
+        """
+        Retrieves the impact of each posting of term from posting file
+        Args:
+            term          (str): Target term
+        Returns:
+            impacts   (ndarray): Impacts as float64, or quantized impacts as uint8, in documentId order
+        """
+        entry = self.dictionary.get(term)
+        if entry == None:
+            return decode_impacts(b'', 0)
+        if entry.impact_size == 0:
+            raise Exception("Index has no precomputed impacts, build it with index.py -s")
+
+        offset = entry.offset + entry.doc_size + entry.pos_size + entry.skip_size
+        return decode_impacts(self.posting_file.view(offset, entry.impact_size), entry.impact_scale)
+
+    def cosine_score(self, query, k = None):
+        """
+        Computes the cosine score and returns the top k (score, doc_id) pairs
+        Args:
+            query_detail (dict): Dictionary of query terms and frequency
+            k             (int): Top number of results to return
+        Returns:
+            (list): Descending list of score-documentId pairs by score
+        """
+        query_vectors = self.query_weights(query)
+        entries = {query_term: self.dictionary[query_term] for query_term in query_vectors}
+
+        # Quantized impacts are scored in integer units, unquantized ones directly
+        unit = max([wtq * max(entries[query_term].max_title, entries[query_term].max_content)
+            for query_term, wtq in query_vectors.items()] + [0]) / QUERY_LEVELS
+        quantized = any(entry.impact_scale != 0 for entry in entries.values())
+        if not quantized or unit == 0:
+            unit = 1
+
+        scores = defaultdict(int)
+        for query_term, wtq in query_vectors.items():
+            entry = entries[query_term]
+            doc_ids = [doc_id for doc_id, _ in self.get_posting_list(query_term)]
+            impacts = self.get_impacts(query_term).tolist()
+
+            if entry.impact_scale == 0:
+                for doc_id, impact in zip(doc_ids, impacts):
+                    scores[doc_id] += wtq * impact
+            else:
+                table = [round(wtq * entry.impact_scale * impact / unit) for impact in range(max(impacts) + 1)]
+                for doc_id, impact in zip(doc_ids, impacts):
+                    scores[doc_id] += table[impact]
+
+        score_id_pairs = [(score * unit, doc_id) for doc_id, score in scores.items()]
+
+        if k == None:
+            # does the same thing as .result() in top_k
+            return reversed(sorted(score_id_pairs))
+
+        # find top k results
+        top_k = TopK(k)
+        for score_id_pair in score_id_pairs:
+            top_k.add(score_id_pair)
+
+        return top_k.result()
@@ -0,0 +1,437 @@
+from collections import Counter, defaultdict
+from models import TITLE_WEIGHT
+from compression import doc_key, doc_num_of, zone_of, TITLE_ZONE, CONTENT_ZONE
+from lexicon import biword
+from segments import SegmentedVectorSpaceModel
+
+# Ways that search.py ranks the documents of a boolean or phrasal query:
+# - free-text: the query is scored as free text, like every other query
+# - phrase: documents that contain every phrase (and every term joined to them by AND) are ranked
+#   first, by PhraseEvaluator, followed by the rest of the free text ranking
+# - strict: only the documents that contain every phrase and every term joined by AND are returned,
+#   ranked by their free text scores
+QUERY_MODES = ('free-text', 'phrase', 'strict')
+
+END = float('inf')
+
+def gallop(values, target, low):
+    """
+    Finds the first value that is not less than target, from low onwards, with an exponential search
+    followed by a binary search, so that skipping n values takes O(log n) comparisons
+    Args:
+        values (list): Sorted values, such as positions, or postings compared to (documentId,)
+        target       : Target value
+        low     (int): Index to search from
+    Returns:
+        (int): Index of the first value from low onwards that is not less than target, or len(values)
+    """
+    end = len(values)
+    if low >= end or not values[low] < target:
+        return low
+
+    # values[low] < target <= values[high], with the step doubling until high gets past target
+    step = 1
+    high = low + 1
+    while high < end and values[high] < target:
+        low = high
+        step <<= 1
+        high = low + step
+    if high > end:
+        high = end
+
+    while high - low > 1:
+        middle = (low + high) >> 1
+        if values[middle] < target:
+            low = middle
+        else:
+            high = middle
+    return high
+
+def phrase_positions(positions, starts, offset):
+    """
+    Keeps the start positions of a phrase whose term at offset is at the expected position
+    Args:
+        positions (list): Sorted positions of the term in a zone
+        starts    (list): Sorted candidate start positions of the phrase
+        offset     (int): Offset of the term in the phrase
+    Returns:
+        (list): Candidate start positions that are still candidates
+    """
+    matches = []
+    low = 0
+    for start in starts:
+        low = gallop(positions, start + offset, low)
+        if low == len(positions):
+            break
+        if positions[low] == start + offset:
+            matches.append(start)
+    return matches
+
+class SkipCursor:
+    """
+    Cursor over the documentId stream of a term, moving from document to document (rather than from
+    zone to zone) in increasing internal documentId order. It jumps between blocks with a galloping
+    search over the last documentIds of the skip table, and only decodes the blocks it lands on.
+
+    Variables:
+        doc (int): Internal documentId of the document at the cursor, or END once the cursor is exhausted
+    """
+    def __init__(self, model, term):
+        """
+        Initializes SkipCursor object, and decodes the first block.
+        Args:
+            model (VectorSpaceModel): Model reading the posting list
+            term               (str): Term of the posting list, which must be in the dictionary
+        """
+        self.model = model
+        self.term = term
+        self.skip_table = model.get_skip_table(term)
+        self.last_keys = [last_doc_id for last_doc_id, _, _, _ in self.skip_table]
+        self.load(0)
+
+    def load(self, block):
+        """
+        Decodes a block and moves the cursor to its first document.
+        Args:
+            block (int): Index of the block
+        """
+        self.block = block
+        self.pos = 0
+        if block >= len(self.skip_table):
+            self.postings = []
+            self.doc = END
+            return
+        self.postings = self.model.get_posting_block(self.term, self.skip_table, block)
+        self.doc = doc_num_of(self.postings[0][0])
+
+    def advance_to(self, doc_num):
+        """
+        Moves the cursor to the first document at or after a document
+        Args:
+            doc_num (int): Internal documentId of the target document
+        Returns:
+            (int): Internal documentId of the document at the cursor, or END
+        """
+        if self.doc >= doc_num:
+            return self.doc
+
+        # The title zone is the first zone of a document
+        key = doc_key(doc_num, TITLE_ZONE)
+        block = gallop(self.last_keys, key, self.block)
+        if block != self.block:
+            self.load(block)
+        self.pos = gallop(self.postings, (key,), self.pos)
+        if self.pos == len(self.postings):
+            # The last document of a single-block posting list is not recorded, see get_skip_table
+            self.load(self.block + 1)
+        else:
+            self.doc = doc_num_of(self.postings[self.pos][0])
+        return self.doc
+
+    def take(self):
+        """
+        Returns the postings of the document at the cursor, without moving the cursor
+        Returns:
+            (list): documentId - term frequency pairs of the zones of the document
+        """
+        # Both zones of a document are always in the same block
+        end = gallop(self.postings, (doc_key(self.doc + 1, TITLE_ZONE),), self.pos)
+        return self.postings[self.pos:end]
+
+def phrase_units(model, phrase):
+    """
+    Splits a phrase into the posting lists that it is matched with: the biword of every pair of
+    adjacent terms of the phrase that is in the dictionary (see index.py -b), and the terms that are
+    in none of these pairs
+    Args:
+        model (VectorSpaceModel): Scoring engine over the index
+        phrase          (tuple): Terms of the phrase, in order
+    Returns:
+        (list): Offset in the phrase - term or biword pairs, where the offset of a biword is that of
+                its first term
+    """
+    units = []
+    covered = set()
+    for offset in range(len(phrase) - 1):
+        pair = biword(phrase[offset], phrase[offset + 1])
+        if pair in model.dictionary:
+            units.append((offset, pair))
+            covered.update((offset, offset + 1))
+    units += [(offset, term) for offset, term in enumerate(phrase) if offset not in covered]
+    return units
+
+def intersect(model, terms):
+    """
+    Finds the documents that contain every term, starting from the term with the fewest postings.
+    The cursors of the other terms gallop to each document of the shortest posting list, and the
+    shortest posting list gallops to any document further ahead that they land on.
+    Args:
+        model (VectorSpaceModel): Scoring engine over the index
+        terms         (iterable): Target terms
+    Returns:
+        (list): Internal documentIds of the documents, in increasing order
+    """
+    terms = set(terms)
+    if not terms or any(term not in model.dictionary for term in terms):
+        return []
+    cursors = sorted((SkipCursor(model, term) for term in terms), key=lambda cursor: model.get_doc_freq(cursor.term))
+
+    matches = []
+    doc_num = cursors[0].doc
+    while doc_num != END:
+        next_doc_num = doc_num
+        for cursor in cursors[1:]:
+            next_doc_num = cursor.advance_to(doc_num)
+            if next_doc_num != doc_num:
+                break
+        if next_doc_num == END:
+            break
+        if next_doc_num == doc_num:
+            matches.append(doc_num)
+            next_doc_num = doc_num + 1
+        doc_num = cursors[0].advance_to(next_doc_num)
+    return matches
+
+class PhraseEvaluator:
+    """
+    Evaluates queries of phrases and terms joined by AND over the positional postings of an index,
+    and ranks the documents that contain every one of them.
+
+    The documents that contain every term of the query are found first, by intersecting the
+    documentId streams of the terms with skip tables (see intersect). Phrases are then matched zone
+    by zone in these documents only, from the rarest phrase, and each phrase only in the documents
+    that matched the phrases before it. The positional posting list of each term of a phrase
+    gallops from one document to the next, and the start positions of the phrase in a zone are
+    narrowed down from the rarest term of the phrase. If the index has biwords, the pairs of
+    adjacent terms of a phrase are matched with them instead of their terms, so a phrase of two
+    terms is a single posting list. The decoded postings are shared with the
+    posting cache, so they are only read.
+
+    Each clause is weighted like a query term: its document frequency is the number of zones that
+    it matches, and its term frequency in a zone is the number of times the phrase occurs in the
+    zone. Zones are then combined and multiplied by court importance like VectorSpaceModel.
+
+    Variables:
+        model (VectorSpaceModel): Scoring engine over the index, or over its segments
+    """
+    def __init__(self, model):
+        """
+        Args:
+            model (VectorSpaceModel): Scoring engine over the index, or SegmentedVectorSpaceModel
+        """
+        self.model = model
+        if isinstance(model, SegmentedVectorSpaceModel):
+            # Documents of each segment are numbered by global documentId, without its tombstones
+            self.parts = list(zip(model.models, model.document_weights.doc_ids.bases,
+                [segment.deleted_set for segment in model.segments]))
+        else:
+            self.parts = [(model, 0, set())]
+
+    def phrase_postings(self, model, units, candidates):
+        """
+        Finds the zones that contain a phrase
+        Args:
+            model (VectorSpaceModel): Scoring engine of a part of the index
+            units            (list): Offset - term or biword pairs of the phrase, see phrase_units
+            candidates       (list): Internal documentIds of the documents to match, in increasing order,
+                                     each of which contains every term and biword of the phrase
+        Returns:
+            (list): documentId - phrase frequency pairs of the zones that contain the phrase
+        """
+        terms = sorted(((model.get_doc_freq(term), offset, model.get_positional_posting_list(term))
+            for offset, term in units), key=lambda term: term[:2])
+
+        matches = []
+        cursors = [0] * len(terms)
+        for doc_num in candidates:
+            for zone in (TITLE_ZONE, CONTENT_ZONE):
+                key = doc_key(doc_num, zone)
+                starts = None
+                for i, (_, offset, posting_list) in enumerate(terms):
+                    cursors[i] = gallop(posting_list, (key,), cursors[i])
+                    if cursors[i] == len(posting_list) or posting_list[cursors[i]][0] != key:
+                        starts = None
+                        break
+                    positions = posting_list[cursors[i]][1]
+                    if starts == None:
+                        starts = [position - offset for position in positions]
+                    else:
+                        starts = phrase_positions(positions, starts, offset)
+                    if not starts:
+                        break
+                if starts:
+                    matches.append((key, len(starts)))
+        return matches
+
+    def term_postings(self, model, term, candidates):
+        """
+        Finds the zones of the candidate documents that contain a term
+        Args:
+            model (VectorSpaceModel): Scoring engine of a part of the index
+            term              (str): Target term
+            candidates       (list): Internal documentIds of the documents, in increasing order
+        Returns:
+            (list): documentId - term frequency pairs of the zones of the documents that contain the term
+        """
+        cursor = SkipCursor(model, term)
+        postings = []
+        for doc_num in candidates:
+            if cursor.advance_to(doc_num) == doc_num:
+                postings += cursor.take()
+        return postings
+
+    def match(self, clauses):
+        """
+        Finds the zones of the documents that contain every clause, in each part of the index
+        Args:
+            clauses (list): Clauses of the query, each a tuple of the terms of a phrase or a single term
+        Returns:
+            (list): For each part of the index, a dictionary of each clause to its documentId -
+                    frequency pairs in the matching documents
+        """
+        phrases = [clause for clause in clauses if len(clause) > 1]
+
+        part_matches = []
+        for model, _, deleted in self.parts:
+            # Phrases are matched with the biwords of the part of the index, which are rarer than their terms
+            units = {phrase: phrase_units(model, phrase) for phrase in phrases}
+            terms = set(clause[0] for clause in clauses if len(clause) == 1)
+            terms.update(term for phrase in phrases for _, term in units[phrase])
+            candidates = [doc_num for doc_num in intersect(model, terms) if doc_num not in deleted]
+            matches = {}
+            for phrase in sorted(phrases, key=lambda phrase: min(model.get_doc_freq(term) for _, term in units[phrase])):
+                if not candidates:
+                    break
+                postings = self.phrase_postings(model, units[phrase], candidates)
+                matched = set(doc_num_of(key) for key, _ in postings)
+                candidates = [doc_num for doc_num in candidates if doc_num in matched]
+                matches[phrase] = postings
+
+            if not candidates:
+                part_matches.append({})
+                continue
+            # Postings of documents that did not match a later phrase are dropped
+            matched = set(candidates)
+            part_matches.append({clause: [(key, tf) for key, tf in matches[clause] if doc_num_of(key) in matched]
+                if clause in matches else self.term_postings(model, clause[0], candidates) for clause in clauses})
+        return part_matches
+
+    def combine_zones(self, model, base, scores, title_a):
+        """
+        Combines the scores of the zones of each document of a part of the index into a weighted
+        sum, multiplied by the court importance of the document, like VectorSpaceModel
+        Args:
+            model (VectorSpaceModel): Scoring engine of a part of the index
+            base              (int): Number of documents of the earlier parts of the index
+            scores           (dict): Dictionary of documentIds of zones to scores
+            title_a         (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (list): documentId-score pairs, numbered like the model
+        """
+        doc_scores = defaultdict(float)
+        priors = model.document_weights.priors
+        for key, score in scores.items():
+            zone_a = title_a if zone_of(key) == TITLE_ZONE else 1 - title_a
+            doc_scores[base + doc_num_of(key)] += zone_a * score * float(priors[key])
+        return list(doc_scores.items())
+
+    def clauses_of(self, query):
+        """
+        Returns the clauses of a query as tuples, so that repeated clauses can be counted
+        """
+        return [tuple(clause) if isinstance(clause, list) else (clause,) for clause in query.clauses if clause]
+
+    def score(self, query, title_a = TITLE_WEIGHT):
+        """
+        Ranks the documents that contain every clause of a query, by the clauses
+        Args:
+            query (QueryDetails): Refined query, with its clauses
+            title_a      (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (list): Descending list of documentId-score pairs by score, numbered like the model
+        """
+        clause_freq = Counter(self.clauses_of(query))
+        part_matches = self.match(list(clause_freq))
+
+        model = self.parts[0][0]
+        if model.statistics == None:
+            N = len(model.document_weights)
+        else:
+            N = model.statistics.size
+        doc_freqs = Counter()
+        for matches in part_matches:
+            for clause, postings in matches.items():
+                doc_freqs[clause] += len(postings)
+
+        results = []
+        for (part_model, base, _), matches in zip(self.parts, part_matches):
+            scores = defaultdict(float)
+            for clause, postings in matches.items():
+                wtq = part_model.query_tf_idf.weight(clause_freq[clause], N, doc_freqs[clause])
+                for key, tf in postings:
+                    scores[key] += wtq * part_model.doc_tf_idf.weight(tf)
+            results += self.combine_zones(part_model, base, scores, title_a)
+
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results
+
+    def strict_score(self, query, title_a = TITLE_WEIGHT):
+        """
+        Ranks the documents that contain every clause of a query by their free text scores, which
+        are computed for these documents only, with the skip tables
+        Args:
+            query (QueryDetails): Refined query, with its clauses
+            title_a      (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (list): Descending list of documentId-score pairs by score, numbered like the model
+        """
+        part_matches = self.match(list(dict.fromkeys(self.clauses_of(query))))
+
+        results = []
+        for (part_model, base, _), matches in zip(self.parts, part_matches):
+            doc_nums = sorted(set(doc_num_of(key) for postings in matches.values() for key, _ in postings))
+            if not doc_nums:
+                continue
+            scores = defaultdict(float)
+            for term, wtq in part_model.query_weights(query).items():
+                for key, tf in self.term_postings(part_model, term, doc_nums):
+                    scores[key] += wtq * part_model.doc_tf_idf.weight(tf)
+            results += self.combine_zones(part_model, base, scores, title_a)
+
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results
+
+def has_phrases(query):
+    """
+    Checks if a refined query has phrases to evaluate
+    Args:
+        query (QueryDetails): Refined query
+    Returns:
+        (bool): True if a clause of the query is a phrase of several terms
+    """
+    return query.clauses != None and any(not isinstance(clause, str) and len(clause) > 1 for clause in query.clauses)
+
+def rank(model, query, k = None):
+    """
+    Ranks the documents of a refined query in the query mode of the model, see QUERY_MODES
+    Args:
+        model (VectorSpaceModel): Scoring engine over the index
+        query     (QueryDetails): Refined query
+        k                  (int): Number of documents to return, or None for all matching documents
+    Returns:
+        (list): Descending list of documentId-score pairs by score
+    """
+    if model.query_mode == 'strict' and query.clauses != None:
+        return PhraseEvaluator(model).strict_score(query)[:k]
+    if model.query_mode == 'free-text' or not has_phrases(query):
+        return model.zone_score(query, k)
+
+    matches = PhraseEvaluator(model).score(query)[:k]
+    if k != None and len(matches) == k:
+        return matches
+
+    # The phrase matches are followed by the other documents of the free text ranking, which may
+    # hold every phrase match
+    matched = set(doc_num for doc_num, _ in matches)
+    free_text = model.zone_score(query, k + len(matched) if k != None else None)
+    return (matches + [(doc_num, score) for doc_num, score in free_text if doc_num not in matched])[:k]
@@ -0,0 +1,488 @@
+from bisect import bisect_left
+from heapq import heappush, heappop, nlargest
+from models import VectorSpaceModel, ImpactVectorSpaceModel, TITLE_WEIGHT, QUERY_LEVELS
+from compression import doc_num_of, zone_of, decode_impact_segments
+
+# Relative slack added to upper bounds, so that rounding differences between a bound and the score
+# it bounds never prune a document that should be in the top k
+BOUND_SLACK = 1e-9
+
+END = float('inf')
+
+class PostingCursor:
+    """
+    Cursor over the posting list of a query term, moving from document to document (rather than from
+    zone to zone) in increasing internal documentId order.
+
+    Variables:
+        order       (int)  : Position of the term in the query, scores are summed in this order
+        weight      (float): Query term weight
+        upper_bound (float): Maximum score that the term can contribute to a document
+        doc         (int)  : Internal documentId of the document at the cursor, or END once the
+                             cursor is exhausted
+    """
+    def __init__(self, order, weight, upper_bound, posting_list):
+        """
+        Initializes PostingCursor object.
+        Args:
+            order          (int): Position of the term in the query
+            weight       (float): Query term weight
+            upper_bound  (float): Maximum score that the term can contribute to a document
+            posting_list  (list): List of documentId - term frequency pairs
+        """
+        self.order = order
+        self.weight = weight
+        self.upper_bound = upper_bound
+        self.postings = posting_list
+        self.doc_nums = [doc_num_of(doc_id) for doc_id, _ in posting_list]
+        self.pos = 0
+        self.doc = self.doc_nums[0] if self.doc_nums else END
+
+    def advance_to(self, doc_num):
+        """
+        Moves the cursor to the first posting of a document, or of the document after it.
+        Args:
+            doc_num (int): Internal documentId of the target document
+        """
+        self.pos = bisect_left(self.doc_nums, doc_num, self.pos)
+        self.doc = self.doc_nums[self.pos] if self.pos < len(self.doc_nums) else END
+
+    def take(self):
+        """
+        Returns the postings of the document at the cursor, and moves to the next document.
+        Returns:
+            (list): documentId - term frequency pairs of the zones of the document
+        """
+        start = self.pos
+        self.advance_to(self.doc + 1)
+        return self.postings[start:self.pos]
+
+class MaxScoreVectorSpaceModel(VectorSpaceModel):
+    """
+    VectorSpaceModel that finds the top k documents with MaxScore dynamic pruning, evaluating
+    documents one at a time across all query terms.
+
+    Each term has an upper bound on the score it can contribute to a document, from the maximum
+    impacts (document term weight times court importance multiplier) stored in the lexicon. Once k
+    documents have been found, terms whose bounds add up to less than the k-th best score cannot
+    produce a new top k document on their own, so only documents containing one of the remaining
+    terms are scored, and their scoring stops as soon as their bound falls below the k-th best
+    score. It returns the same top k scores as VectorSpaceModel.
+    """
+    def term_upper_bound(self, term, weight, title_a):
+        """
+        Returns the maximum score that a query term can contribute to a document.
+        Args:
+            term      (str): Query term
+            weight  (float): Query term weight
+            title_a (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (float): Upper bound of the term's contribution
+        """
+        entry = self.dictionary[term]
+        return weight * (title_a * entry.max_title + (1 - title_a) * entry.max_content)
+
+    def zone_score(self, query, k = None, title_a = TITLE_WEIGHT):
+        """
+        Computes the top k (doc_num, score) pairs, see VectorSpaceModel.zone_score
+        Args:
+            query_detail (dict): Dictionary of query terms and frequency
+            k             (int): Top number of results to return
+            title_a     (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (list): Descending list of documentId-score pairs by score
+        """
+        if k == None:
+            # Nothing can be pruned when every document is returned
+            return super().zone_score(query, k, title_a)
+
+        zone_weights = (title_a, 1 - title_a)
+        priors = self.document_weights.priors
+        tf_weights = {}
+
+        cursors = []
+        for order, (term, weight) in enumerate(self.query_weights(query).items()):
+            upper_bound = self.term_upper_bound(term, weight, title_a) * (1 + BOUND_SLACK)
+            cursors.append(PostingCursor(order, weight, upper_bound, self.get_posting_list(term)))
+
+        # Cursors by increasing upper bound, along with the total upper bound of cursors[:i + 1]
+        cursors.sort(key=lambda cursor: cursor.upper_bound)
+        bounds = []
+        for cursor in cursors:
+            bounds.append(cursor.upper_bound + (bounds[-1] if bounds else 0))
+
+        def score_postings(cursor, zone_scores):
+            # Adds the scores of the postings at the cursor to the zone scores of the document, and
+            # returns their total once weighted by zone and court importance
+            total = 0
+            for doc_id, tf in cursor.take():
+                if tf not in tf_weights:
+                    tf_weights[tf] = self.doc_tf_idf.weight(tf)
+                score = cursor.weight * tf_weights[tf]
+                zone_scores.append((cursor.order, doc_id, score))
+                total += zone_weights[zone_of(doc_id)] * score * priors[doc_id]
+            return total * (1 + BOUND_SLACK)
+
+        top_k = []
+        threshold = -1
+        # cursors[:first_essential] are non-essential: their total bound is below the threshold
+        first_essential = 0
+
+        while True:
+            while first_essential < len(cursors) and bounds[first_essential] < threshold:
+                first_essential += 1
+            essential = cursors[first_essential:]
+            if not essential:
+                break
+            doc_num = min(cursor.doc for cursor in essential)
+            if doc_num == END:
+                break
+
+            zone_scores = []
+            estimate = 0
+            for cursor in essential:
+                if cursor.doc == doc_num:
+                    estimate += score_postings(cursor, zone_scores)
+
+            # Add non-essential terms by decreasing bound, while the document can still make it
+            pruned = False
+            for i in reversed(range(first_essential)):
+                if estimate + bounds[i] < threshold:
+                    pruned = True
+                    break
+                cursor = cursors[i]
+                cursor.advance_to(doc_num)
+                if cursor.doc == doc_num:
+                    estimate += score_postings(cursor, zone_scores)
+            if pruned:
+                continue
+
+            heappush(top_k, (self.document_score(zone_scores, zone_weights), doc_num))
+            if len(top_k) > k:
+                heappop(top_k)
+            if len(top_k) == k:
+                threshold = top_k[0][0]
+
+        return [(doc_num, score) for score, doc_num in sorted(top_k, reverse=True)]
+
+    def document_score(self, zone_scores, zone_weights):
+        """
+        Computes the final score of a document the same way as VectorSpaceModel.zone_score.
+        Args:
+            zone_scores   (list): Query term order - documentId - score of every posting of the document
+            zone_weights (tuple): Weight of the title zone and of the content zone
+        Returns:
+            (float): Score of the document
+        """
+        # Zone scores are summed in query term order, as cosine_score does
+        totals = {}
+        for _, doc_id, score in sorted(zone_scores, key=lambda x: x[0]):
+            totals[doc_id] = totals.get(doc_id, 0.0) + score
+
+        score = 0.0
+        for doc_id, total in totals.items():
+            score += zone_weights[zone_of(doc_id)] * (total * self.get_document_importance(doc_id, get_vals=True))
+        return score
+
+class BlockCursor:
+    """
+    Cursor over the posting list of a query term that only decodes the blocks it lands on, moving
+    from document to document in increasing internal documentId order. The skip table of the
+    posting list gives the last document and an upper bound on the score of every block.
+
+    Variables:
+        order       (int)  : Position of the term in the query, scores are summed in this order
+        weight      (float): Query term weight
+        upper_bound (float): Maximum score that the term can contribute to a document
+        doc         (int)  : Internal documentId of the document at the cursor, or END once the
+                             cursor is exhausted
+    """
+    def __init__(self, model, term, order, weight, upper_bound, zone_weights):
+        """
+        Initializes BlockCursor object, and decodes the first block.
+        Args:
+            model (VectorSpaceModel): Model reading the posting list
+            term               (str): Query term
+            order              (int): Position of the term in the query
+            weight           (float): Query term weight
+            upper_bound      (float): Maximum score that the term can contribute to a document
+            zone_weights     (tuple): Weight of the title zone and of the content zone
+        """
+        self.model = model
+        self.term = term
+        self.order = order
+        self.weight = weight
+        self.upper_bound = upper_bound
+
+        self.skip_table = model.get_skip_table(term)
+        self.last_docs = [doc_num_of(last_doc_id) for last_doc_id, _, _, _ in self.skip_table]
+        self.block_bounds = [weight * (zone_weights[0] * max_title + zone_weights[1] * max_content) * (1 + BOUND_SLACK)
+            for _, _, max_title, max_content in self.skip_table]
+        self.load(0)
+
+    def load(self, block):
+        """
+        Decodes a block and moves the cursor to its first document.
+        Args:
+            block (int): Index of the block
+        """
+        self.block = block
+        if block >= len(self.skip_table):
+            self.doc = END
+            return
+        self.postings = self.model.get_posting_block(self.term, self.skip_table, block)
+        self.doc_nums = [doc_num_of(doc_id) for doc_id, _ in self.postings]
+        self.pos = 0
+        self.doc = self.doc_nums[0]
+
+    def advance_to(self, doc_num):
+        """
+        Moves the cursor to the first posting of a document, or of the document after it, skipping
+        blocks that end before the document.
+        Args:
+            doc_num (int): Internal documentId of the target document
+        """
+        if self.doc >= doc_num:
+            return
+        if doc_num > self.last_docs[self.block]:
+            self.load(bisect_left(self.last_docs, doc_num, self.block + 1))
+            if self.doc == END:
+                return
+        self.pos = bisect_left(self.doc_nums, doc_num, self.pos)
+        if self.pos < len(self.doc_nums):
+            self.doc = self.doc_nums[self.pos]
+        else:
+            # The last document of a single-block posting list is not recorded, see get_skip_table
+            self.load(self.block + 1)
+
+    def block_bound(self, doc_num):
+        """
+        Returns the upper bound of the block that would hold a document, without decoding it.
+        Args:
+            doc_num (int): Internal documentId of the document
+        Returns:
+            bound    (float): Maximum score that the term can contribute to documents of the block
+            last_doc   (int): Last document of the block, or END if the document is after every block
+        """
+        block = bisect_left(self.last_docs, doc_num, self.block)
+        if block >= len(self.skip_table):
+            return (0, END)
+        return (self.block_bounds[block], self.last_docs[block])
+
+    def take(self):
+        """
+        Returns the postings of the document at the cursor, and moves to the next document.
+        Returns:
+            (list): documentId - term frequency pairs of the zones of the document
+        """
+        # Both zones of a document are always in the same block
+        start = self.pos
+        self.pos = bisect_left(self.doc_nums, self.doc + 1, self.pos)
+        postings = self.postings[start:self.pos]
+        if self.pos < len(self.doc_nums):
+            self.doc = self.doc_nums[self.pos]
+        else:
+            self.load(self.block + 1)
+        return postings
+
+class BlockMaxWandVectorSpaceModel(MaxScoreVectorSpaceModel):
+    """
+    VectorSpaceModel that finds the top k documents with Block-Max WAND, evaluating documents one
+    at a time across all query terms.
+
+    Cursors are kept sorted by their current document. The pivot is the first document at which the
+    upper bounds of the terms up to it reach the k-th best score, as no earlier document can make it
+    into the top k. The bounds of the blocks holding the pivot (from the skip tables) are then
+    checked as well: if they fall short, the cursors jump past the shortest of these blocks without
+    decoding anything. It returns the same top k scores as VectorSpaceModel.
+    """
+    # Blocks are only decoded when the cursors reach them
+    posting_getters = ('get_skip_table',)
+
+    def zone_score(self, query, k = None, title_a = TITLE_WEIGHT):
+        """
+        Computes the top k (doc_num, score) pairs, see VectorSpaceModel.zone_score
+        Args:
+            query_detail (dict): Dictionary of query terms and frequency
+            k             (int): Top number of results to return
+            title_a     (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (list): Descending list of documentId-score pairs by score
+        """
+        if k == None:
+            # Nothing can be pruned when every document is returned
+            return VectorSpaceModel.zone_score(self, query, k, title_a)
+
+        zone_weights = (title_a, 1 - title_a)
+        tf_weights = {}
+
+        cursors = []
+        for order, (term, weight) in enumerate(self.query_weights(query).items()):
+            upper_bound = self.term_upper_bound(term, weight, title_a) * (1 + BOUND_SLACK)
+            cursors.append(BlockCursor(self, term, order, weight, upper_bound, zone_weights))
+
+        top_k = []
+        threshold = -1
+
+        while True:
+            cursors.sort(key=lambda cursor: cursor.doc)
+
+            # Find the pivot, the first document whose terms may reach the threshold
+            pivot = None
+            bound = 0
+            for i, cursor in enumerate(cursors):
+                if cursor.doc == END:
+                    break
+                bound += cursor.upper_bound
+                if bound >= threshold:
+                    pivot = i
+                    break
+            if pivot == None:
+                break
+            pivot_doc = cursors[pivot].doc
+            # Every term at the pivot document counts
+            while pivot + 1 < len(cursors) and cursors[pivot + 1].doc == pivot_doc:
+                pivot += 1
+
+            # Check the bounds of the blocks holding the pivot document
+            block_bound = 0
+            next_doc = cursors[pivot + 1].doc if pivot + 1 < len(cursors) else END
+            for cursor in cursors[:pivot + 1]:
+                bound, last_doc = cursor.block_bound(pivot_doc)
+                block_bound += bound
+                next_doc = min(next_doc, last_doc + 1)
+
+            if block_bound < threshold:
+                # No document before next_doc can make it, as they all fall in the same blocks
+                for cursor in cursors[:pivot + 1]:
+                    cursor.advance_to(next_doc)
+                continue
+
+            if cursors[0].doc != pivot_doc:
+                # Move the terms before the pivot to the pivot document
+                for cursor in cursors[:pivot]:
+                    cursor.advance_to(pivot_doc)
+                continue
+
+            zone_scores = []
+            for cursor in cursors[:pivot + 1]:
+                for doc_id, tf in cursor.take():
+                    if tf not in tf_weights:
+                        tf_weights[tf] = self.doc_tf_idf.weight(tf)
+                    zone_scores.append((cursor.order, doc_id, cursor.weight * tf_weights[tf]))
+
+            heappush(top_k, (self.document_score(zone_scores, zone_weights), pivot_doc))
+            if len(top_k) > k:
+                heappop(top_k)
+            if len(top_k) == k:
+                threshold = top_k[0][0]
+
+        return [(doc_num, score) for score, doc_num in sorted(top_k, reverse=True)]
+
+class ScoreAtATimeVectorSpaceModel(ImpactVectorSpaceModel):
+    """
+    VectorSpaceModel that scores the impact-ordered postings of an index (index.py -s bits -o) one
+    segment at a time, taking the segment with the highest score across all query terms first.
+
+    Scores are integers, in units of the query's largest possible term score divided by
+    QUERY_LEVELS, with the zone weights folded into the score of each segment, so the scores of
+    documents are accumulated directly. Once the k-th best score is ahead of the (k + 1)-th best score
+    by more than the total score left in the remaining segments, the set of top k documents cannot
+    change anymore (although their order still can), and scoring stops. Scoring also stops once
+    postings_budget postings have been scored, which bounds the time taken by any query (at the cost
+    of an approximate top k).
+
+    Variables:
+        postings_budget (int): Maximum number of postings scored per query, or None for no limit
+    """
+    postings_budget = None
+    # Segments are decoded lazily, as most queries stop before the last of them
+    posting_getters = ()
+
+    def get_impact_segments(self, term):
+        """
+        Retrieves the impact-ordered postings of term from posting file, one segment at a time
+        Args:
+            term          (str): Target term
+        Returns:
+            segments (generator): Quantized impact - list of documentIds pairs, in descending order of impact
+        """
+        entry = self.dictionary[term]
+        if entry.ordered_size == 0:
+            raise Exception("Index has no impact-ordered postings, build it with index.py -s bits -o")
+
+        offset = entry.offset + entry.doc_size + entry.pos_size + entry.skip_size + entry.impact_size
+        return decode_impact_segments(self.posting_file.view(offset, entry.ordered_size))
+
+    def zone_score(self, query, k = None, title_a = TITLE_WEIGHT):
+        """
+        Computes the top k (doc_num, score) pairs, see VectorSpaceModel.zone_score
+        Args:
+            query_detail (dict): Dictionary of query terms and frequency
+            k             (int): Top number of results to return
+            title_a     (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (list): Descending list of documentId-score pairs by score
+        """
+        zone_weights = (title_a, 1 - title_a)
+        query_vectors = self.query_weights(query)
+        entries = {term: self.dictionary[term] for term in query_vectors}
+        unit = max([wtq * max(entries[term].max_title, entries[term].max_content)
+            for term, wtq in query_vectors.items()] + [0]) / QUERY_LEVELS
+        if unit == 0:
+            unit = 1
+
+        # Score of a quantized impact of each term in each zone
+        steps = [[zone_weight * wtq * entries[term].impact_scale / unit for zone_weight in zone_weights]
+            for term, wtq in query_vectors.items()]
+
+        def push_segment(i, term_segments):
+            # Adds the next segment of a term to the heap, and returns its score. A document can still
+            # get both its title and its content postings from the remaining segments of the term, so
+            # the score of a segment is the sum of its zone scores.
+            next_segment = next(term_segments, None)
+            if next_segment == None:
+                return 0
+            impact, doc_ids = next_segment
+            zone_scores = [round(step * impact) for step in steps[i]]
+            heappush(segments, (-sum(zone_scores), i, zone_scores, doc_ids, term_segments))
+            return sum(zone_scores)
+
+        # Heap of the next segment of each term, by decreasing score
+        segments = []
+        remaining = 0
+        for i, term in enumerate(query_vectors):
+            remaining += push_segment(i, self.get_impact_segments(term))
+
+        scores = {}
+        best = 0
+        scored = 0
+        next_check = 0
+        while segments:
+            neg_score, i, (title_score, content_score), doc_ids, term_segments = heappop(segments)
+            remaining += neg_score
+
+            if self.postings_budget != None:
+                doc_ids = doc_ids[:self.postings_budget - scored]
+            for doc_id in doc_ids:
+                doc_num = doc_num_of(doc_id)
+                score = scores.get(doc_num, 0) + (content_score if zone_of(doc_id) else title_score)
+                scores[doc_num] = score
+                if score > best:
+                    best = score
+            scored += len(doc_ids)
+            if self.postings_budget != None and scored >= self.postings_budget:
+                break
+
+            remaining += push_segment(i, term_segments)
+
+            # The top k can only be settled once the best score is ahead of what is left. Checking
+            # takes a pass over the scores, so it is only done once as many postings have been scored
+            if k != None and len(scores) > k and remaining < best and scored >= next_check:
+                top = nlargest(k + 1, scores.values())
+                if top[k] + remaining < top[k - 1]:
+                    break
+                next_check = scored + len(scores)
+
+        results = sorted(((score, doc_num) for doc_num, score in scores.items()), reverse=True)[:k]
+        return [(doc_num, score * unit) for score, doc_num in results]
@@ -1,7 +1,6 @@
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
 from nltk.corpus import wordnet as wn
 import nltk
+from analysis import get_analyzer, INDEX_CHAIN, QUERY_CHAIN
 
 class QueryDetails:
     """
@@ -18,13 +17,22 @@ class QueryDetails:
         terms           (list[str])   : All of the query terms, where phrasal queries will be in a nested list
         counts          (Counter[str]): The frequency of each terms
         raw_tokens      (list[str])   : List of the raw tokens before preprocessing
+        tagged_terms    (list[tuple]) : Term of the index (lemmatized as a verb like the documents) and WordNet part of
+                                        speech ('' if WordNet has none) of each raw token
+        expansions      (dict)        : Expansion terms of the query to their weights, see QueryRefiner.query_expansion
+        clauses         (list)        : The phrases (as lists) and terms of a boolean or phrasal query, analyzed like
+                                        the documents so that they can be matched against the positional index, or
+                                        None for a free-text query
     """
     def __init__(self, query, relevant_docs):
         self.type = "free-text"
         self.terms = []
+        self.clauses = None
+        self.expansions = {}
 
         # Word_tokenization
-        tokens = word_tokenize(query)
+        analyzer = get_analyzer(QUERY_CHAIN)
+        tokens = analyzer.tokenize(query)
         self.raw_tokens = tokens[:]
 
         # Check if it's a boolean query
@@ -43,14 +51,18 @@ class QueryDetails:
                 self.type = "invalid"
 
         # Lemmatization + Case-folding
-        lemmatizer = WordNetLemmatizer()
         expander = WordnetExpander()
         new_tokens = []
+        index_tokens = []
+        tags = []
         for term, tag in nltk.pos_tag(tokens):
             tag = expander.get_wordnet_pos(tag)
-            term = lemmatizer.lemmatize(term.lower(), pos=tag if tag else wn.VERB) # because lemmatizer cannot parse empty string as pos
-            new_tokens.append(term)
+            new_tokens.append(analyzer.lemmatize(term.lower(), pos=tag if tag else wn.VERB)) # because lemmatizer cannot parse empty string as pos
+            # Documents are lemmatized as verbs, whatever their part of speech
+            index_tokens.append(analyzer.lemmatize(term.lower()))
+            tags.append(tag)
         tokens = new_tokens
+        self.tagged_terms = list(zip(index_tokens, tags))
 
         # For internal testing purposes
         self.relevant_docs = relevant_docs 
@@ -58,6 +70,7 @@ class QueryDetails:
         # Check for quotations for phrasal queries
         phrasal_start_index = -1
         phrasal_end_index = -1
+        clauses = []
         for i in range(len(tokens)):
             if tokens[i] == "``": # start quotation
                 if self.type == "boolean":
@@ -68,14 +81,18 @@ class QueryDetails:
             elif tokens[i] == "''": # end quotation
                 phrasal_end_index = i
                 self.terms.append(tokens[phrasal_start_index + 1 : phrasal_end_index])
+                clauses.append(index_tokens[phrasal_start_index + 1 : phrasal_end_index])
                 # reset the start and end index to check for more phrasal queries
                 phrasal_start_index = -1
                 phrasal_end_index = -1
             elif phrasal_start_index == -1 and phrasal_end_index == -1 and i not in AND_indexes:
                 self.terms.append(tokens[i])
+                clauses.append(index_tokens[i])
 
         if self.type == "free-text":
             self.terms = tokens
+        elif self.type != "invalid":
+            self.clauses = clauses
     
     def to_free_text(self):
         """
@@ -96,6 +113,8 @@ class QueryDetails:
                 flattened_terms.extend(term)
 
         self.terms = flattened_terms
+        self.tagged_terms = [tagged_term for term, tagged_term in zip(self.raw_tokens, self.tagged_terms)
+            if not valid_raw_token(term)]
         self.raw_tokens = [term for term in self.raw_tokens if (not valid_raw_token(term))]
         self.type = "free-text"
         
@@ -117,22 +136,34 @@ class QueryRefiner:
         """
         pass
 
-    def query_expansion(self, new_synonyms_per_term=0):
+    def query_expansion(self, new_synonyms_per_term=0, synonyms=None):
         """
         Performs query expansion. The current implementation relies on a hybrid between NLTK.Wordnet 
-        and our custom set of synonyms.
+        and our custom set of synonyms, looked up in the synonym table of the index if it has one.
 
-        After obtaining the additional terms, we will create a new QueryDetails object.
+        The additional terms are analyzed on their own and added to the expansions of the query,
+        rather than to its terms, so the query is not tokenized, tagged and lemmatized again. Each
+        expansion term is weighted EXPANSION_WEIGHT for every term of the query that it expands,
+        and terms of the query are not expansions of it.
         Args:
-            new_synonyms_per_term (int): Number of synonyms to retrieve
+            new_synonyms_per_term (int): Number of synonyms to retrieve, if the index has no synonym table
+            synonyms (SynonymTable): Synonym table of the index (see synonyms.py), or None to expand
+                                     the query with WordNet
         """
-        expander = WordnetExpander()
-        terms = self.query_details.raw_tokens
-        additional_terms = expander.get_synonyms_of(terms, new_synonyms_per_term)
-        
-        new_terms = terms + additional_terms
-        new_query = " ".join(new_terms)
-        self.query_details = QueryDetails(new_query, self.query_details.relevant_docs)
+        query = self.query_details
+        if synonyms == None:
+            expander = WordnetExpander()
+            analyzer = get_analyzer(INDEX_CHAIN)
+            additional_terms = [[term for syn in expander.get_synonyms_of_token(token, pos, new_synonyms_per_term)
+                for term in analyzer.analyze(syn)] for token, (_, pos) in zip(query.raw_tokens, query.tagged_terms)]
+        else:
+            additional_terms = [synonyms.lookup(term, pos) for term, pos in query.tagged_terms]
+
+        terms = set(query.terms)
+        for token_terms in additional_terms:
+            for term in dict.fromkeys(token_terms):
+                if term not in terms:
+                    query.expansions[term] = query.expansions.get(term, 0) + EXPANSION_WEIGHT
     
     def get_current_refined(self):
         """
@@ -142,6 +173,12 @@ class QueryRefiner:
         """
         return self.query_details
 
+# Number of WordNet synonyms that each query term is expanded with
+SYNONYMS_PER_TERM = 6
+
+# Weight of an expansion term for each query term that it expands, relative to an occurrence of a query term
+EXPANSION_WEIGHT = 0.5
+
 """
 Our curated set of "synonyms". It is more accurate to think of these as a set of words typically encountered in the same context.
 """
@@ -182,14 +219,26 @@ class WordnetExpander:
         tagged_terms = nltk.pos_tag(terms)
         all_new_terms = []
         for term, tag in tagged_terms:
-            # try custom synonyms first
-            new_terms = self.get_custom_synonym(term, k)
-            if not new_terms: # turns out custom synonym doesn't give us anything
-                synsets = self.get_synsets(term, tag)
-                new_terms = self.get_k_from_synsets(synsets, term, k)
-            all_new_terms.extend(new_terms)
+            all_new_terms.extend(self.get_synonyms_of_token(term, self.get_wordnet_pos(tag), k))
 
         return all_new_terms
+
+    def get_synonyms_of_token(self, term, pos, k):
+        """
+        Get the synonyms of a term that has already been tagged.
+        Args:
+            term (str): The original term that appears in the queries
+            pos  (str): WordNet part of speech of the term, see get_wordnet_pos
+            k    (int): The number of synonyms to be taken
+        Returns:
+            new_terms (list(str)): List of new terms after expanding the term
+        """
+        # try custom synonyms first
+        new_terms = self.get_custom_synonym(term, k)
+        if not new_terms: # turns out custom synonym doesn't give us anything
+            synsets = self.get_ranked_synsets(term, pos)
+            new_terms = self.get_k_from_synsets(synsets, term, k)
+        return new_terms
     
     def get_custom_synonym(self, term, k):
         """
@@ -243,7 +292,16 @@ class WordnetExpander:
             term (str): Original term in the query
             tag  (str): Tag obtained from nltk.pos_tag()
         """
-        unsorted_synsets = wn.synsets(term, pos=self.get_wordnet_pos(tag))
+        return self.get_ranked_synsets(term, self.get_wordnet_pos(tag))
+
+    def get_ranked_synsets(self, term, pos):
+        """
+        Get synsets of a part of speech in decreasing order of relevance.
+        Args:
+            term (str): Original term in the query
+            pos  (str): WordNet part of speech, see get_wordnet_pos
+        """
+        unsorted_synsets = wn.synsets(term, pos=pos)
         if not unsorted_synsets:
             # empty
             return unsorted_synsets
@@ -1,10 +1,21 @@
 #!/usr/bin/python3
-import pickle
+import os
 import sys
 import getopt
-
-from query import QueryDetails, QueryRefiner
-from models import VectorSpaceModel
+from functools import partial
+
+from query import QueryDetails, QueryRefiner, SYNONYMS_PER_TERM
+from models import VectorSpaceModel, NumpyVectorSpaceModel, ImpactVectorSpaceModel
+from pruning import MaxScoreVectorSpaceModel, BlockMaxWandVectorSpaceModel, ScoreAtATimeVectorSpaceModel
+from tiers import TieredVectorSpaceModel
+from compression import decode_doc_stream, decode_pos_stream
+from storage import PostingsReader, DictionaryReader, parse_size
+from lexicon import Lexicon
+from documents import DocumentTable
+from synonyms import SynonymTable
+from cache import PostingCache, QueryCache, MISSING
+from segments import SegmentedVectorSpaceModel, manifest_file
+from phrases import rank, QUERY_MODES
 
 def get_posting_list(dictionary, postings, term):
     """
@@ -17,10 +28,11 @@ def get_posting_list(dictionary, postings, term):
     if term not in dictionary:
         return []
 
-    _, pos, size = dictionary[term]
+    entry = dictionary[term]
 
-    postings.seek(pos)
-    posting_list = pickle.loads(postings.read(size))
+    doc_ids = [doc_id for doc_id, _ in decode_doc_stream(postings.view(entry.offset, entry.doc_size))]
+    positions = decode_pos_stream(postings.view(entry.offset + entry.doc_size, entry.pos_size))
+    posting_list = list(zip(doc_ids, positions))
     return posting_list
 
 def intersect_posting_lists(posting_lists):
@@ -87,8 +99,6 @@ def boolean_phrasal_retrieval(dictionary, postings, terms):
         # Boolean query
         if isinstance(phrase, str):
             posting_list = get_posting_list(dictionary, postings, phrase)
-            if posting_list:
-                posting_list = posting_list[1]
 
         # Phrasal query
         else:
@@ -96,8 +106,6 @@ def boolean_phrasal_retrieval(dictionary, postings, terms):
             for word in phrase:
                 word_posting_list = get_posting_list(dictionary, postings, word)
                 if word_posting_list:
-                    word_posting_list = word_posting_list[1]
-
                     # If word is first in the phrase -> set it as the main posting list
                     # Warning: do not check for not posting_list -> will return True if posting_list is an empty list
                     if posting_list == None:
@@ -134,10 +142,139 @@ def boolean_phrasal_retrieval(dictionary, postings, terms):
     output = rank_docs(intersect_posting_lists(posting_lists))
     return output
 
+# Scoring engines that can be chosen with -e
+ENGINES = {'python': VectorSpaceModel, 'numpy': NumpyVectorSpaceModel, 'maxscore': MaxScoreVectorSpaceModel, 'bmw': BlockMaxWandVectorSpaceModel,
+    'impact': ImpactVectorSpaceModel, 'saat': ScoreAtATimeVectorSpaceModel, 'tiered': TieredVectorSpaceModel}
+
 def usage():
-    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-e engine] [-k top-k] [-a postings-budget] [-c cache-budget] [-r query-cache-file] [-m query-mode]")
+    print("       " + sys.argv[0] + " -d dictionary-file -p postings-file -l [host:]port|socket-path [-e engine] [-k top-k] [-a postings-budget] [-c cache-budget] [-r query-cache-file] [-m query-mode]")
+    print("       " + sys.argv[0] + " -d dictionary-file -p postings-file -b output-directory [-w workers] [-e engine] [-k top-k] [-a postings-budget] [-c cache-budget] [-r query-cache-file] [-m query-mode] query-file...")
+
+def open_index(dict_file, postings_file, engine='python', postings_budget=None, cache_budget=None, query_mode='phrase'):
+    """
+    Opens the dictionary file and postings file with a scoring engine
+    Args:
+        dict_file     (str): File path of input dictionary file
+        postings_file (str): File path of input posting file
+        engine        (str): Name of the scoring engine, see ENGINES
+        postings_budget (int): Maximum number of postings scored by the saat engine, or None for no limit
+        cache_budget  (int): Maximum decoded size in bytes of the posting cache, or None for no posting cache
+        query_mode    (str): How queries with phrases are ranked, see phrases.QUERY_MODES
+    Returns:
+        (VectorSpaceModel): Scoring engine over the index, or over every segment of the index if it
+                            has segments (see segments.py)
+    """
+    if os.path.exists(manifest_file(dict_file)):
+        free_text_model = SegmentedVectorSpaceModel.open(ENGINES[engine], dict_file, postings_file)
+    else:
+        # Terms are looked up directly in the mapped lexicon, and document weights are mapped arrays
+        dictionary_reader = DictionaryReader(dict_file)
+        dictionary = Lexicon.from_dictionary(dictionary_reader)
+        document_weights = DocumentTable.from_dictionary(dictionary_reader)
+
+        postings = PostingsReader(postings_file)
+
+        free_text_model = ENGINES[engine](dictionary, document_weights, postings)
+        free_text_model.synonyms = SynonymTable.from_dictionary(dictionary_reader)
+    if postings_budget != None:
+        free_text_model.postings_budget = postings_budget
+    free_text_model.query_mode = query_mode
+    if cache_budget != None:
+        free_text_model.posting_cache = PostingCache(cache_budget)
+    return free_text_model
+
+def index_files(dict_file, postings_file):
+    """
+    Lists the files that the ranked results of an index depend on, see QueryCache
+    Args:
+        dict_file     (str): File path of input dictionary file
+        postings_file (str): File path of input posting file
+    Returns:
+        (list): File paths of the dictionary file, postings file and segment manifest
+    """
+    # Segments are added, tombstoned and compacted through the manifest
+    return [dict_file, postings_file, manifest_file(dict_file)]
 
-def run_search(dict_file, postings_file, query_file, results_file):
+def read_query(lines):
+    """
+    Reads a query in the format of a query file: the query on the first line, followed by the
+    document_ids of relevant documents, one per line
+    Args:
+        lines (iterable): Lines of the query file
+    Returns:
+        query                 (str): Query
+        lst_of_relevant_docs (list): document_ids of the relevant documents
+    """
+    count = 0
+    query = ""
+    lst_of_relevant_docs = []
+
+    for line in lines:
+        if count == 0: # first line
+            query = line
+        elif line.strip():
+            lst_of_relevant_docs.append(int(line))
+        count += 1
+
+    return (query, lst_of_relevant_docs)
+
+def refine_query(query, lst_of_relevant_docs, synonyms=None):
+    """
+    Parses and refines a query into the free text query that is scored
+    Args:
+        query                 (str): Query
+        lst_of_relevant_docs (list): document_ids of the relevant documents
+        synonyms     (SynonymTable): Synonym table of the index, or None to expand the query with WordNet
+    Returns:
+        (QueryDetails): Refined free text query, or None if the query is invalid
+    """
+    query_details = QueryDetails(query, lst_of_relevant_docs)
+
+    if query_details.type == "invalid":
+        print("Invalid query! Result will be empty")
+        return None
+
+    if query_details.type != "free-text": # Boolean / boolean with phrasal
+        query_details.to_free_text()
+
+    # Query Expansion
+    refiner = QueryRefiner(query_details)
+    refiner.query_expansion(SYNONYMS_PER_TERM, synonyms)
+    return refiner.get_current_refined()
+
+def search_query(free_text_model, query, lst_of_relevant_docs, k=None, query_cache=None):
+    """
+    Refines and ranks a query
+    Args:
+        free_text_model (VectorSpaceModel): Scoring engine over the index
+        query                        (str): Query
+        lst_of_relevant_docs        (list): document_ids of the relevant documents
+        k                            (int): Number of documents to return, or None for all matching documents
+        query_cache           (QueryCache): Cache of refined queries and ranked results, or None
+    Returns:
+        (list): Descending list of internal documentId-score pairs by score
+    """
+    if query_cache == None:
+        refined_query = refine_query(query, lst_of_relevant_docs, free_text_model.synonyms)
+        return rank(free_text_model, refined_query, k) if refined_query != None else []
+
+    results = query_cache.get_results(free_text_model, query, lst_of_relevant_docs, k)
+    if results is not MISSING:
+        return results
+
+    refined_query = query_cache.get_refined(query, lst_of_relevant_docs)
+    if refined_query is MISSING:
+        refined_query = refine_query(query, lst_of_relevant_docs, free_text_model.synonyms)
+        query_cache.put_refined(query, lst_of_relevant_docs, refined_query)
+
+    # Vector space ranking for free text queries, scored based on zone, with phrase matches first
+    results = rank(free_text_model, refined_query, k) if refined_query != None else []
+    query_cache.put_results(free_text_model, query, lst_of_relevant_docs, k, results)
+    return results
+
+def run_search(dict_file, postings_file, query_file, results_file, engine='python', k=None, postings_budget=None,
+    cache_budget=None, query_cache_file=None, query_mode='phrase'):
     """
     Using the given dictionary file and postings file, perform searching on the given queries file
     and output the results to a file
@@ -146,102 +283,106 @@ def run_search(dict_file, postings_file, query_file, results_file):
         postings_file (str): File path of input posting file
         queries_file  (str): File path of input query file
         results_file  (str): File path of output result file
+        engine        (str): Name of the scoring engine, see ENGINES
+        k             (int): Number of documents to return, or None for all matching documents
+        postings_budget (int): Maximum number of postings scored by the saat engine, or None for no limit
+        cache_budget  (int): Maximum decoded size in bytes of the posting cache, or None for no posting cache
+        query_cache_file (str): File path of the query cache persisted between runs, or None for no query cache
+        query_mode    (str): How queries with phrases are ranked, see phrases.QUERY_MODES
     """
     print('running search on the queries...')
 
-    with open(dict_file, 'rb') as f:
-        dictionary, document_weights = pickle.load(f)
-
-    postings = open(postings_file, 'rb')
+    free_text_model = open_index(dict_file, postings_file, engine, postings_budget, cache_budget, query_mode)
+    doc_ids = free_text_model.document_weights.doc_ids
+    query_cache = QueryCache(index_files(dict_file, postings_file), query_cache_file) if query_cache_file != None else None
 
     with open(query_file, 'r') as f, open(results_file, 'w') as r_file:
-        count = 0
-        lst_of_relevant_docs = []
+        query, lst_of_relevant_docs = read_query(f)
+        results = search_query(free_text_model, query, lst_of_relevant_docs, k, query_cache)
 
-        for line in f:
-            if count == 0: # first line
-                query = line
-            else:
-                lst_of_relevant_docs.append(int(line))
-            count += 1
-
-        query_details = QueryDetails(query, lst_of_relevant_docs)
-
-        if query_details.type == "invalid":
-            print("Invalid query! Result will be empty")
-            write_result(r_file, [])
-            return
-
-        if query_details.type != "free-text": # Boolean / boolean with phrasal
-            query_details.to_free_text()
-
-        # Query Expansion
-        refiner = QueryRefiner(query_details)
-        refiner.query_expansion(6)
-        refined_query = refiner.get_current_refined()
-
-        # Vector space ranking for free text queries
-        free_text_model = VectorSpaceModel(dictionary, document_weights, postings)
-        score_id_pairs = free_text_model.cosine_score(refined_query)
-
-        results = [(id, score) for score, id in score_id_pairs]
-
-        # Score based on zone
-        title_a = 0.2
-        content_a = 1 - title_a
-        new_results = {}
-        for id, score in results:
-            zone = id[-1]
-            clean_id = id[:-2]
-            if clean_id not in new_results:
-                if zone == "c": # Content
-                    new_results[clean_id] = content_a * score
-                else: # Title
-                    new_results[clean_id] = title_a * score
-            else:
-                if zone == "c": # Content
-                    new_results[clean_id] += content_a * score
-                else: # Title
-                    new_results[clean_id] += title_a * score
+        write_result(r_file, results, doc_ids)
+
+    if query_cache != None:
+        query_cache.save()
+        print(query_cache)
 
-        results = list(new_results.items())
-        results.sort(key=lambda x: x[1], reverse=True)
-        
-        write_result(r_file, results)
+    if free_text_model.posting_cache != None:
+        print(free_text_model.posting_cache)
 
-def write_result(r_file, documentId_score_pairs):
+def write_result(r_file, documentId_score_pairs, doc_ids):
     """
     Writes results of documentId_score pairs into results file
     Args:
         r_file (str): File path of output result file
-        documentId_score_pairs: List of documentId_score pairs
+        documentId_score_pairs: List of internal documentId_score pairs
+        doc_ids (list): Side table of document_ids by internal documentId
     """
     for id, _ in documentId_score_pairs:
-        r_file.write(str(id) + " ")
-
-
-dictionary_file = postings_file = query_file = output_file_of_results = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-d':
-        dictionary_file  = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        query_file = a
-    elif o == '-o':
-        file_of_output = a
+        r_file.write(str(doc_ids[id]) + " ")
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = query_file = file_of_output = address = output_directory = None
+    engine = 'python'
+    workers = 1
+    k = None
+    postings_budget = None
+    query_mode = 'phrase'
+    cache_budget = None
+    query_cache_file = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:e:k:a:l:b:w:c:r:m:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file  = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            query_file = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-e':
+            engine = a
+        elif o == '-k':
+            k = int(a)
+        elif o == '-a':
+            postings_budget = int(a)
+        elif o == '-l': # serve queries on a port or a Unix socket
+            address = a
+        elif o == '-b': # search every query of the query files given as arguments
+            output_directory = a
+        elif o == '-w':
+            workers = int(a)
+        elif o == '-c': # budget of the posting cache, e.g. 256M
+            cache_budget = parse_size(a)
+        elif o == '-r': # file that the query cache is persisted to
+            query_cache_file = a
+        elif o == '-m': # how queries with phrases are ranked, e.g. free-text
+            query_mode = a
+        else:
+            assert False, "unhandled option"
+
+    query_files = ([query_file] if query_file != None else []) + args
+    if dictionary_file == None or postings_file == None or engine not in ENGINES or \
+        (address == None and output_directory == None and (query_file == None or file_of_output == None)) or \
+        (output_directory != None and not query_files) or \
+        (postings_budget != None and engine != 'saat') or query_mode not in QUERY_MODES:
+        usage()
+        sys.exit(2)
+
+    if output_directory != None:
+        from batch import run_batch
+        run_batch(dictionary_file, postings_file, query_files, output_directory, engine, k, postings_budget, workers,
+            cache_budget, query_cache_file, query_mode)
+    elif address != None:
+        from server import serve
+        files = index_files(dictionary_file, postings_file)
+        serve(address, partial(open_index, dictionary_file, postings_file, engine, postings_budget, cache_budget, query_mode),
+            files, k, QueryCache(files, query_cache_file))
     else:
-        assert False, "unhandled option"
-
-if dictionary_file == None or postings_file == None or query_file == None or file_of_output == None :
-    usage()
-    sys.exit(2)
-
-run_search(dictionary_file, postings_file, query_file, file_of_output)
+        run_search(dictionary_file, postings_file, query_file, file_of_output, engine, k, postings_budget, cache_budget,
+            query_cache_file, query_mode)
@@ -0,0 +1,380 @@
+import os
+import pickle
+import heapq
+from bisect import bisect_right
+import numpy as np
+
+from storage import DictionaryReader, PostingsReader
+from lexicon import Lexicon, is_biword
+from documents import DocumentTable
+from compression import decode_doc_stream, decode_doc_stream_arrays, decode_pos_stream, doc_key, doc_num_of, zone_of, \
+    TITLE_ZONE, CONTENT_ZONE
+from cache import PostingCache
+from synonyms import SynonymTable, SegmentedSynonymTable
+
+"""
+Segmented index: an index built with index.py (segment 0), followed by segments that each index a
+batch of new or updated documents (index.py -u), as standalone dictionary and postings files named
+after those of the index (dictionary.txt.1, postings.txt.1, ...). A manifest next to the dictionary
+file (dictionary.txt.segments) lists the segments in order, along with the tombstones of each
+segment: the internal documentIds of its documents that were updated by a later segment or deleted
+(index.py -x). Compaction (index.py -c) merges the live documents of every segment back into a
+single index, and removes the manifest.
+"""
+
+def manifest_file(dict_file):
+    """
+    Returns the file path of the segment manifest of an index
+    Args:
+        dict_file (str): File path of the dictionary file of the index
+    Returns:
+        (str): File path of the manifest
+    """
+    return dict_file + '.segments'
+
+def read_manifest(dict_file, postings_file):
+    """
+    Reads the segment manifest of an index. An index without a manifest is a single segment.
+    Args:
+        dict_file     (str): File path of the dictionary file of the index
+        postings_file (str): File path of the postings file of the index
+    Returns:
+        (dict): Segments, each a dictionary of the file paths of its dictionary file and postings
+                file and the sorted internal documentIds of its tombstones, and the number of the
+                next segment
+    """
+    path = manifest_file(dict_file)
+    if not os.path.exists(path):
+        return {'segments': [{'dict': dict_file, 'postings': postings_file, 'deleted': []}], 'next_segment': 1}
+
+    with open(path, 'rb') as f:
+        manifest = pickle.load(f)
+    # Segment files are named relative to the manifest, so that the index can be moved
+    base_dir = os.path.dirname(path)
+    for segment in manifest['segments']:
+        segment['dict'] = os.path.join(base_dir, segment['dict'])
+        segment['postings'] = os.path.join(base_dir, segment['postings'])
+    return manifest
+
+def write_manifest(dict_file, manifest):
+    """
+    Writes the segment manifest of an index, replacing the previous one at once
+    Args:
+        dict_file (str): File path of the dictionary file of the index
+        manifest (dict): Manifest, see read_manifest
+    """
+    path = manifest_file(dict_file)
+    base_dir = os.path.dirname(path)
+    saved = dict(manifest)
+    saved['segments'] = [dict(segment, dict=os.path.relpath(segment['dict'], base_dir or '.'),
+        postings=os.path.relpath(segment['postings'], base_dir or '.')) for segment in manifest['segments']]
+
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(saved, f)
+    os.replace(tmp_file, path)
+
+class Segment:
+    """
+    Opened segment of an index.
+
+    Variables:
+        dictionary            (Lexicon): Lexicon of the segment
+        document_weights (DocumentTable): Document table of the segment
+        postings       (PostingsReader): Postings file of the segment
+        deleted               (ndarray): Sorted internal documentIds of the tombstoned documents
+        deleted_set               (set): Internal documentIds of the tombstoned documents
+        synonyms         (SynonymTable): Synonym table of the segment, or None if it has none
+    """
+    def __init__(self, segment):
+        """
+        Args:
+            segment (dict): Segment of a manifest, see read_manifest
+        """
+        dictionary_reader = DictionaryReader(segment['dict'])
+        self.dictionary = Lexicon.from_dictionary(dictionary_reader)
+        self.document_weights = DocumentTable.from_dictionary(dictionary_reader)
+        self.postings = PostingsReader(segment['postings'])
+        self.deleted = np.array(segment['deleted'], dtype=np.int64)
+        self.deleted_set = set(segment['deleted'])
+        self.synonyms = SynonymTable.from_dictionary(dictionary_reader)
+
+    def live_doc_nums(self):
+        """
+        Returns the internal documentIds of the documents that are not tombstoned
+        Returns:
+            (list): Internal documentIds, in order
+        """
+        return [doc_num for doc_num in range(len(self.document_weights.doc_ids)) if doc_num not in self.deleted_set]
+
+    def deleted_postings(self, term):
+        """
+        Counts the postings of term that belong to tombstoned documents
+        Args:
+            term (str): Target term
+        Returns:
+            (int): Number of postings (zones) of tombstoned documents
+        """
+        entry = self.dictionary.get(term)
+        if entry == None or len(self.deleted) == 0:
+            return 0
+        keys, _ = decode_doc_stream_arrays(self.postings.view(entry.offset, entry.doc_size))
+        return int(np.isin(keys >> 1, self.deleted).sum())
+
+class CollectionStatistics:
+    """
+    Statistics of the live documents of every segment, which the query weights of the scoring
+    engine of each segment are computed from, so that scores are comparable across segments and the
+    same as if the live documents were in a single index.
+
+    Variables:
+        size (int): Number of live documents (zones)
+    """
+    def __init__(self, segments):
+        """
+        Args:
+            segments (list): Opened segments
+        """
+        self.segments = segments
+        self.size = sum(len(segment.document_weights) - 2 * len(segment.deleted) for segment in segments)
+        self.doc_freqs = {}
+
+    def doc_freq(self, term):
+        """
+        Returns the number of live documents (zones) that contain term, across all segments
+        Args:
+            term (str): Target term
+        Returns:
+            (int): Document frequency of the term
+        """
+        if term not in self.doc_freqs:
+            doc_freq = 0
+            for segment in self.segments:
+                entry = segment.dictionary.get(term)
+                if entry != None:
+                    doc_freq += entry.df - segment.deleted_postings(term)
+            self.doc_freqs[term] = doc_freq
+        return self.doc_freqs[term]
+
+class SegmentedDocumentIds:
+    """
+    Side table of document_ids of a segmented index, indexed by global documentId: the internal
+    documentId of the document in its segment, plus the number of documents of earlier segments.
+    """
+    def __init__(self, segments):
+        self.segments = segments
+        self.bases = [0]
+        for segment in segments:
+            self.bases.append(self.bases[-1] + len(segment.document_weights.doc_ids))
+
+    def __getitem__(self, doc_num):
+        segment = bisect_right(self.bases, doc_num) - 1
+        return self.segments[segment].document_weights.doc_ids[doc_num - self.bases[segment]]
+
+    def __len__(self):
+        return self.bases[-1]
+
+class SegmentedDocuments:
+    """
+    Stands in for the DocumentTable of a segmented index where only its document_ids are read
+    """
+    def __init__(self, doc_ids):
+        self.doc_ids = doc_ids
+
+class SegmentedVectorSpaceModel:
+    """
+    Scoring engine over a segmented index: one scoring engine for each segment, whose query weights
+    come from the statistics of the live documents of every segment. The top k of each segment,
+    without its tombstoned documents, are merged by score into the top k of the index, with the
+    documents numbered by global documentId (see SegmentedDocumentIds).
+
+    Engines that return an exact top k still do so, as each segment scores k more documents than
+    it has tombstones, so that its top k live documents are among them.
+    """
+    def __init__(self, engine, segments):
+        """
+        Args:
+            engine  (class): Scoring engine of each segment, e.g. VectorSpaceModel
+            segments (list): Opened segments, in order
+        """
+        self.segments = segments
+        self.statistics = CollectionStatistics(segments)
+        self.models = []
+        for segment in segments:
+            model = engine(segment.dictionary, segment.document_weights, segment.postings)
+            model.statistics = self.statistics
+            self.models.append(model)
+        self.document_weights = SegmentedDocuments(SegmentedDocumentIds(segments))
+        self.engine = engine
+        # How search.py ranks queries with phrases, see phrases.QUERY_MODES
+        self.query_mode = 'phrase'
+        tables = [segment.synonyms for segment in segments if segment.synonyms != None]
+        self.synonyms = SegmentedSynonymTable(tables) if tables else None
+
+    @classmethod
+    def open(cls, engine, dict_file, postings_file):
+        """
+        Opens every segment of an index
+        Args:
+            engine        (class): Scoring engine of each segment
+            dict_file       (str): File path of the dictionary file of the index
+            postings_file   (str): File path of the postings file of the index
+        Returns:
+            (SegmentedVectorSpaceModel): Scoring engine over the index
+        """
+        return cls(engine, [Segment(segment) for segment in read_manifest(dict_file, postings_file)['segments']])
+
+    @property
+    def posting_cache(self):
+        return self.models[0].posting_cache
+
+    @posting_cache.setter
+    def posting_cache(self, posting_cache):
+        # A single cache is shared by the segments, whose entries are told apart by postings file
+        for model in self.models:
+            model.posting_cache = posting_cache
+
+    @property
+    def postings_budget(self):
+        return getattr(self.models[0], 'postings_budget', None)
+
+    @postings_budget.setter
+    def postings_budget(self, postings_budget):
+        for model in self.models:
+            model.postings_budget = postings_budget
+
+    def prefetch(self, terms):
+        """
+        Fetches and decodes the posting data that scoring reads for each term of every segment into
+        the posting cache, see VectorSpaceModel.prefetch
+        Args:
+            terms (iterable): Target terms
+        """
+        if self.posting_cache == None:
+            self.posting_cache = PostingCache()
+        terms = list(terms)
+        for model in self.models:
+            model.prefetch(terms)
+
+    def zone_score(self, query, k = None):
+        """
+        Computes the top k (global documentId, score) pairs across segments
+        Args:
+            query_detail (dict): Dictionary of query terms and frequency
+            k             (int): Top number of results to return
+        Returns:
+            (list): Descending list of global documentId-score pairs by score
+        """
+        segment_results = []
+        for segment, model, base in zip(self.segments, self.models, self.document_weights.doc_ids.bases):
+            results = model.zone_score(query, k + len(segment.deleted) if k != None else None)
+            segment_results.append([(base + doc_num, score) for doc_num, score in results
+                if doc_num not in segment.deleted_set][:k])
+
+        # Ties are kept in segment order
+        return list(heapq.merge(*segment_results, key=lambda result: -result[1]))[:k]
+
+def segment_postings(segments, doc_nums):
+    """
+    Merges the posting lists of every term across segments, keeping the postings of live documents
+    Args:
+        segments (list): Opened segments, in order
+        doc_nums (list): Dictionary of the internal documentIds of the live documents of each
+                         segment to their new internal documentIds
+    Returns:
+        (generator): Term - (freq, posting) pairs in sorted order of terms, like merge_runs, without
+                     the biwords
+    """
+    def segment_terms(i):
+        for term, entry in segments[i].dictionary.items():
+            # Biwords of the merged index are found again from its own document frequencies
+            if not is_biword(term):
+                yield (term, i, entry)
+
+    merged = heapq.merge(*[segment_terms(i) for i in range(len(segments))])
+    term, posting_list = None, []
+    for next_term, i, entry in merged:
+        if next_term != term:
+            if posting_list:
+                yield (term, (len(posting_list), posting_list))
+            term, posting_list = next_term, []
+
+        postings = segments[i].postings
+        keys = [key for key, _ in decode_doc_stream(postings.view(entry.offset, entry.doc_size))]
+        positions = decode_pos_stream(postings.view(entry.offset + entry.doc_size, entry.pos_size))
+        for key, key_positions in zip(keys, positions):
+            doc_num = doc_nums[i].get(doc_num_of(key))
+            if doc_num != None:
+                posting_list.append((doc_key(doc_num, zone_of(key)), key_positions))
+
+    if posting_list:
+        yield (term, (len(posting_list), posting_list))
+
+def live_documents(segments):
+    """
+    Numbers the live documents of every segment in order, from 0
+    Args:
+        segments (list): Opened segments, in order
+    Returns:
+        doc_nums   (list): Dictionary of the internal documentIds of the live documents of each
+                           segment to their new internal documentIds
+        doc_weight (list): (document length, court importance) of the live documents, indexed by
+                           new internal documentId (zone)
+        doc_ids    (list): document_ids of the live documents, by new internal documentId
+    """
+    doc_nums = []
+    doc_weight = []
+    doc_ids = []
+    for segment in segments:
+        table = segment.document_weights
+        segment_doc_nums = {}
+        for doc_num in segment.live_doc_nums():
+            segment_doc_nums[doc_num] = len(doc_ids)
+            doc_ids.append(table.doc_ids[doc_num])
+            for zone in (TITLE_ZONE, CONTENT_ZONE):
+                key = doc_key(doc_num, zone)
+                doc_weight.append((float(table.lengths[key]), chr(table.importance[key])))
+        doc_nums.append(segment_doc_nums)
+    return (doc_nums, doc_weight, doc_ids)
+
+def segment_terms(segment):
+    """
+    Reads the terms (without the biwords) of the lexicon of a segment
+    Args:
+        segment (dict): Segment of a manifest, see read_manifest
+    Returns:
+        (set): Terms of the segment
+    """
+    with DictionaryReader(segment['dict']) as dictionary:
+        lexicon = Lexicon.from_dictionary(dictionary)
+        terms = set(term for term, _ in lexicon.items() if not is_biword(term))
+        # The lexicon views the mapping, so it is released before the file is unmapped
+        lexicon.buf.release()
+    return terms
+
+def tombstone(manifest, document_ids, segments=None):
+    """
+    Tombstones the documents with the given document_ids in the segments of a manifest
+    Args:
+        manifest     (dict): Manifest, see read_manifest
+        document_ids  (set): document_ids of the documents to tombstone
+        segments     (list): Indexes of the segments to tombstone documents in, or None for all
+    Returns:
+        (int): Number of documents tombstoned
+    """
+    count = 0
+    for i, segment in enumerate(manifest['segments']):
+        if segments != None and i not in segments:
+            continue
+        with DictionaryReader(segment['dict']) as dictionary:
+            doc_ids = DocumentTable.from_dictionary(dictionary).doc_ids
+            matched = [doc_num for doc_num in range(len(doc_ids)) if doc_ids[doc_num] in document_ids]
+            # The document table views the mapping, so it is released before the file is unmapped
+            del doc_ids
+        deleted = set(segment['deleted'])
+        for doc_num in matched:
+            if doc_num not in deleted:
+                deleted.add(doc_num)
+                count += 1
+        segment['deleted'] = sorted(deleted)
+    return count
@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+import signal
+import threading
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from search import read_query, search_query
+from cache import index_signature
+
+# Query used to load the tagger and WordNet before the first request
+WARM_UP_QUERY = "warm up query"
+
+# Number of times the index is opened before giving up when its files keep changing, and the
+# seconds waited in between
+REOPEN_ATTEMPTS = 10
+REOPEN_DELAY = 0.1
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers queries with the document_ids of the results, space separated in the same format as the
+    output file of search.py.
+
+    GET /search?q=<query>[&k=<k>] takes the query in the URL, and POST takes a query file in the
+    body, with the document_ids of relevant documents on the following lines. The time taken to
+    answer is sent in the X-Latency-Ms header. GET /stats returns the counters of the posting cache
+    and the query cache, and the number of times the index was reopened.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self.send_stats()
+            return
+        if url.path != "/search":
+            self.send_error(404)
+            return
+        params = parse_qs(url.query)
+        if "q" not in params:
+            self.send_error(400, "missing query parameter q")
+            return
+        self.answer(params["q"][0], [], params.get("k"))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/search":
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        try:
+            query, lst_of_relevant_docs = read_query(body.splitlines(True))
+        except ValueError:
+            self.send_error(400, "relevant documents must be document_ids")
+            return
+        self.answer(query, lst_of_relevant_docs, parse_qs(url.query).get("k"))
+
+    def answer(self, query, lst_of_relevant_docs, k):
+        """
+        Searches a query and sends its results
+        Args:
+            query                 (str): Query
+            lst_of_relevant_docs (list): document_ids of the relevant documents
+            k                    (list): Values of the k parameter, or None to use the k of the server
+        """
+        try:
+            k = self.server.k if k == None else int(k[0])
+        except ValueError:
+            self.send_error(400, "k must be an integer")
+            return
+
+        start = time.perf_counter()
+        model = self.server.current_model()
+        results = search_query(model, query, lst_of_relevant_docs, k, self.server.query_cache)
+        doc_ids = model.document_weights.doc_ids
+        body = "".join(str(doc_ids[id]) + " " for id, _ in results).encode("utf-8")
+        latency = (time.perf_counter() - start) * 1000
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Latency-Ms", f"{latency:.3f}")
+        self.end_headers()
+        self.wfile.write(body)
+        print(f"{query.strip()!r}: {len(results)} results in {latency:.3f} ms", flush=True)
+        if model.posting_cache != None:
+            print(model.posting_cache, flush=True)
+        if self.server.query_cache != None:
+            print(self.server.query_cache, flush=True)
+
+    def send_stats(self):
+        """
+        Sends the counters of the posting cache and the query cache, one "name value" pair per line
+        """
+        cache = self.server.model.posting_cache
+        stats = cache.stats() if cache != None else {}
+        query_cache = self.server.query_cache
+        if query_cache != None:
+            for level in query_cache.levels:
+                stats[f"query_{level}_hits"] = query_cache.hits[level]
+                stats[f"query_{level}_misses"] = query_cache.misses[level]
+                stats[f"query_{level}_entries"] = len(query_cache.levels[level])
+            stats["query_invalidations"] = query_cache.invalidations
+        stats["index_reopens"] = self.server.reopens
+        body = "".join(f"{name} {value}\n" for name, value in stats.items()).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        # Successful requests are logged with their latency by answer
+        pass
+
+    def log_error(self, format, *args):
+        print("error: " + format % args, flush=True)
+
+class QueryServer(HTTPServer):
+    """
+    HTTP server over a scoring engine, which keeps the index open and NLTK loaded between queries.
+    The index is reopened before a query whenever the size or modification time of its files have
+    changed since it was opened, like the entries of the query cache are dropped (see QueryCache).
+    The segment manifest is one of these files, so segments added (index.py -u), documents deleted
+    (index.py -x) and compactions (index.py -c) are searched without restarting the server.
+
+    Variables:
+        model (VectorSpaceModel): Scoring engine over the index
+        signature        (tuple): Version of the index files that model was opened on, see index_signature
+        reopens            (int): Number of times the index was reopened for changed index files
+    """
+    def __init__(self, address, open_model, index_files, k=None, query_cache=None):
+        """
+        Args:
+            address        (tuple): Host and port to listen on
+            open_model  (function): Opens a scoring engine over the index, see search.open_index
+            index_files     (list): File paths of the dictionary file, postings file and segment manifest
+            k                (int): Default number of documents to return, or None for all matching documents
+            query_cache (QueryCache): Cache of refined queries and ranked results, or None
+        """
+        self.open_model = open_model
+        self.index_files = index_files
+        self.signature = index_signature(index_files)
+        self.model = open_model()
+        self.reopens = 0
+        # Requests that find the index changed reopen it once
+        self.lock = threading.Lock()
+        self.k = k
+        self.query_cache = query_cache
+        super().__init__(address, QueryHandler)
+
+    def current_model(self):
+        """
+        Returns the scoring engine over the current version of the index, reopening the index if its
+        files have changed. Queries that are being answered keep the engine they started with.
+        Returns:
+            (VectorSpaceModel): Scoring engine over the index
+        """
+        with self.lock:
+            for attempt in range(REOPEN_ATTEMPTS):
+                signature = index_signature(self.index_files)
+                if signature == self.signature:
+                    return self.model
+                try:
+                    model = self.open_model()
+                except OSError:
+                    # The files of the segments of an index are removed as it is compacted
+                    if attempt == REOPEN_ATTEMPTS - 1:
+                        raise
+                    time.sleep(REOPEN_DELAY)
+                    continue
+
+                # The files of an index are replaced one at a time, e.g. by compaction, so the index is
+                # only taken if none of them changed while it was being opened
+                if index_signature(self.index_files) == signature:
+                    self.model = model
+                    self.signature = signature
+                    self.reopens += 1
+                    return self.model
+                time.sleep(REOPEN_DELAY)
+            return self.model
+
+class UnixQueryServer(QueryServer):
+    """
+    QueryServer on a Unix socket, eg for curl --unix-socket <path> http://localhost/search?q=...
+    """
+    address_family = socketserver.UnixStreamServer.address_family
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+def serve(address, open_model, index_files, k=None, query_cache=None):
+    """
+    Answers queries until interrupted, then saves the query cache
+    Args:
+        address          (str): [host:]port to listen on with HTTP, or path of a Unix socket
+        open_model  (function): Opens a scoring engine over the index, see search.open_index
+        index_files     (list): File paths of the dictionary file, postings file and segment manifest
+        k                (int): Default number of documents to return, or None for all matching documents
+        query_cache (QueryCache): Cache of refined queries and ranked results, or None
+    """
+    if "/" in address:
+        server = UnixQueryServer(address, open_model, index_files, k, query_cache)
+    else:
+        host, _, port = address.rpartition(":")
+        server = QueryServer((host or "localhost", int(port)), open_model, index_files, k, query_cache)
+
+    print("loading query processing...", flush=True)
+    start = time.perf_counter()
+    search_query(server.model, WARM_UP_QUERY, [], k)
+    print(f"loaded in {(time.perf_counter() - start) * 1000:.3f} ms", flush=True)
+
+    # Stopping the server with kill also saves the query cache and removes the socket
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    print(f"serving queries on {address}...", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if query_cache != None:
+            query_cache.save()
+        if "/" in address:
+            os.unlink(address)
@@ -0,0 +1,147 @@
+import mmap
+import pickle
+import struct
+
+# Dictionary file layout: magic, header length, pickled header, then the raw sections
+DICTIONARY_MAGIC = b'LGLD'
+HEADER_LENGTH = struct.Struct('<I')
+
+# Sections start on multiples of this, so that arrays can be mapped with their natural alignment
+SECTION_ALIGNMENT = 8
+
+def align(pos):
+    """
+    Rounds an offset up to the section alignment.
+    Args:
+        pos (int): Offset
+    Returns:
+        (int): Aligned offset
+    """
+    return -(-pos // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+class MappedFile:
+    """
+    Read-only view of a file backed by mmap. Parts of the file are handed out as memoryview slices
+    of the mapping, so reading one costs no syscall and no copy, and the pages are shared through
+    the OS page cache by every process reading the same file.
+    """
+    def __init__(self, file_path):
+        """
+        Maps the file into memory.
+        Args:
+            file_path (str): File path of input file
+        """
+        with open(file_path, 'rb') as f:
+            # mmap cannot map an empty file
+            if f.seek(0, 2) == 0:
+                self.mapping = None
+                self.buffer = memoryview(b'')
+            else:
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.buffer = memoryview(self.mapping)
+
+    def view(self, pos, size):
+        """
+        Returns bytes of the file without copying them.
+        Args:
+            pos  (int): Offset of the bytes in the file
+            size (int): Number of bytes
+        Returns:
+            (memoryview): Bytes of the file
+        """
+        return self.buffer[pos:pos + size]
+
+    def close(self):
+        """
+        Unmaps the file. Views handed out must no longer be in use.
+        """
+        self.buffer.release()
+        if self.mapping != None:
+            self.mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PostingsReader(MappedFile):
+    """
+    Memory-mapped postings file. Posting lists are decoded straight from views of the mapping.
+    """
+    pass
+
+class DictionaryReader(MappedFile):
+    """
+    Memory-mapped dictionary file, made up of a small pickled header followed by named binary
+    sections (e.g., the lexicon). Only the header is unpickled when the file is opened.
+
+    Variables:
+        header (dict): Metadata of the index, including the offset and size of every section
+    """
+    def __init__(self, file_path):
+        """
+        Maps the dictionary file into memory and reads its header.
+        Args:
+            file_path (str): File path of input dictionary file
+        """
+        super().__init__(file_path)
+        if bytes(self.view(0, len(DICTIONARY_MAGIC))) != DICTIONARY_MAGIC:
+            raise Exception(f"Not a dictionary file: {file_path}")
+
+        pos = len(DICTIONARY_MAGIC)
+        header_length, = HEADER_LENGTH.unpack(self.view(pos, HEADER_LENGTH.size))
+        pos += HEADER_LENGTH.size
+        self.header = pickle.loads(self.view(pos, header_length))
+        self.sections_start = align(pos + header_length)
+
+    def section(self, name):
+        """
+        Returns a section of the dictionary file without copying it.
+        Args:
+            name (str): Name of the section
+        Returns:
+            (memoryview): Bytes of the section
+        """
+        pos, size = self.header['sections'][name]
+        return self.view(self.sections_start + pos, size)
+
+def write_dictionary(out_dict, header, sections):
+    """
+    Writes a dictionary file made up of a header and named binary sections.
+    Args:
+        out_dict  (str): File path of output dictionary
+        header   (dict): Metadata of the index, must be small as it is unpickled on every search
+        sections (dict): Names to bytes of each section
+    """
+    header = dict(header)
+    header['sections'] = {}
+
+    # Section offsets are relative to the (aligned) end of the header
+    pos = 0
+    for name, data in sections.items():
+        header['sections'][name] = (pos, len(data))
+        pos = align(pos + len(data))
+    header_bytes = pickle.dumps(header, pickle.HIGHEST_PROTOCOL)
+
+    with open(out_dict, 'wb') as f:
+        f.write(DICTIONARY_MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for data in sections.values():
+            f.write(bytes(align(f.tell()) - f.tell()))
+            f.write(data)
+
+def parse_size(size):
+    """
+    Parses a size such as 512M or 2G into bytes.
+    Args:
+        size (str): Number of bytes, optionally suffixed with K, M or G
+    Returns:
+        (int): Number of bytes
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    size = size.strip().upper()
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
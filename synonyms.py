@@ -0,0 +1,203 @@
+from collections import defaultdict
+from analysis import get_analyzer, INDEX_CHAIN
+from lexicon import encode_lexicon, Lexicon, BLOCK_SIZE
+from query import WordnetExpander, CUSTOM_SYNONYMS, SYNONYMS_PER_TERM
+
+"""
+Synonym table of an index: the query expansions of every term of the index, precomputed at
+indexing time (index.py -y) the way WordnetExpander expands a query term, but restricted to the
+terms of the index, since the others score nothing. It is stored in the dictionary file, so query
+expansion is a single lookup, and WordNet synsets are never searched or ranked at search time.
+
+The expansions of each term are encoded separately, as a line of space-separated expansion terms
+per part of speech (or a single line when they are the same for every part of speech), in the
+synonyms section. A front-coded lexicon of the expanded terms (see lexicon.py) maps each of them to
+the offset and size of its expansions, so only the expansions of the terms of a query are decoded.
+"""
+
+# WordNet parts of speech that a query term can be expanded as (see WordnetExpander.get_wordnet_pos),
+# where '' stands for any other part of speech, which WordNet has no synsets for
+WORDNET_POS = ('n', 'v', 'a', 'r')
+EXPANSION_POS = WORDNET_POS + ('',)
+
+# Lexicon entry of an expanded term: offset and size of its expansions in the synonyms section
+SYNONYM_ENTRY_FIELDS = ('offset', 'size')
+SYNONYM_ENTRY_FORMAT = '<QI'
+
+def build_synonym_table(vocabulary, k=SYNONYMS_PER_TERM):
+    """
+    Precomputes the expansions of every term of a vocabulary. Like WordnetExpander.get_synonyms_of_token,
+    the terms of the custom synonym sets that a term belongs to are its expansions, whatever its part
+    of speech, and otherwise up to k synonyms from its WordNet synsets of each part of speech, in
+    decreasing order of relevance. Expansions are analyzed like the documents, and those that are not
+    in the vocabulary are left out. The single-token words of the custom synonym sets are expanded even
+    if they are not in the vocabulary themselves.
+    Args:
+        vocabulary (set): Terms of the index
+        k          (int): Number of WordNet synonyms per term and part of speech
+    Returns:
+        (dict): Dictionary of terms to dictionaries of parts of speech (see EXPANSION_POS) to
+                expansion terms, leaving out terms and parts of speech without expansions
+    """
+    expander = WordnetExpander()
+    analyzer = get_analyzer(INDEX_CHAIN)
+
+    def index_terms(word):
+        return [term for term in analyzer.analyze(word) if term in vocabulary]
+
+    # The expansions of a custom synonym set are shared by every term of the set. A query token can
+    # only match a single-token word of a set, so the words of multi-word members such as 'in vitro'
+    # are expansions of the set, but are not expanded themselves
+    custom = defaultdict(list)
+    for syns in CUSTOM_SYNONYMS:
+        set_terms = list(dict.fromkeys(term for word in sorted(syns) for term in index_terms(word)))
+        for word in sorted(syns):
+            word_terms = analyzer.analyze(word)
+            if len(word_terms) != 1:
+                continue
+            term = word_terms[0]
+            custom[term] += [set_term for set_term in set_terms if set_term not in custom[term]]
+
+    table = {term: dict.fromkeys(EXPANSION_POS, expansions) for term, expansions in custom.items() if expansions}
+    for term in sorted(vocabulary):
+        if term in custom:
+            continue
+
+        expansions = {}
+        for pos in WORDNET_POS:
+            synonyms = []
+            for synset in expander.get_ranked_synsets(term, pos):
+                for name in synset.lemma_names():
+                    # Same as WordnetExpander.get_k_from_synsets
+                    if not name.isalnum() or name == "AND":
+                        continue
+                    synonyms += [syn for syn in index_terms(name) if syn != term and syn not in synonyms]
+                if len(synonyms) >= k:
+                    break
+            if synonyms:
+                expansions[pos] = synonyms[:k]
+        if expansions:
+            table[term] = expansions
+    return table
+
+def encode_expansions(expansions):
+    """
+    Encodes the expansions of a term.
+    Args:
+        expansions (dict): Dictionary of parts of speech to expansion terms, see build_synonym_table
+    Returns:
+        (bytes): Encoded expansions
+    """
+    lines = [' '.join(expansions.get(pos, [])) for pos in EXPANSION_POS]
+    if len(set(lines)) == 1:
+        lines = lines[:1]
+    return '\n'.join(lines).encode('utf8')
+
+def decode_expansions(buf):
+    """
+    Decodes the expansions of a term.
+    Args:
+        buf (memoryview): Encoded expansions, see encode_expansions
+    Returns:
+        (dict): Dictionary of parts of speech to expansion terms
+    """
+    lines = bytes(buf).decode('utf8').split('\n')
+    if len(lines) == 1:
+        lines = lines * len(EXPANSION_POS)
+    return {pos: line.split() for pos, line in zip(EXPANSION_POS, lines)}
+
+def encode_synonyms(table):
+    """
+    Encodes the synonym table sections of a dictionary file.
+    Args:
+        table (dict): Synonym table, see build_synonym_table
+    Returns:
+        (dict): Names to bytes of each section
+    """
+    expansions = bytearray()
+    entries = []
+    for term in sorted(table):
+        encoded = encode_expansions(table[term])
+        entries.append((term, (len(expansions), len(encoded))))
+        expansions += encoded
+    return {
+        'synonym_lexicon': encode_lexicon(entries, SYNONYM_ENTRY_FORMAT, BLOCK_SIZE),
+        'synonyms': bytes(expansions),
+    }
+
+class SynonymTable:
+    """
+    Synonym table of an index, backed by its sections of the dictionary file. The expansions of a
+    term are only decoded when it is looked up.
+
+    Variables:
+        lexicon (Lexicon): Lexicon of the expanded terms
+        buf  (memoryview): Synonyms section of the dictionary file
+    """
+    def __init__(self, lexicon, buf):
+        """
+        Args:
+            lexicon (Lexicon): Lexicon of the expanded terms
+            buf  (memoryview): Synonyms section of the dictionary file
+        """
+        self.lexicon = lexicon
+        self.buf = buf
+
+    @classmethod
+    def from_dictionary(cls, dictionary):
+        """
+        Maps the synonym table sections of a dictionary file.
+        Args:
+            dictionary (DictionaryReader): Input dictionary file
+        Returns:
+            (SynonymTable): Synonym table of the dictionary file, or None if it has none
+        """
+        header = dictionary.header
+        if 'synonyms' not in header['sections']:
+            return None
+        lexicon = Lexicon(dictionary.section('synonym_lexicon'), header['synonym_terms'], SYNONYM_ENTRY_FORMAT,
+            SYNONYM_ENTRY_FIELDS, header['block_size'])
+        return cls(lexicon, dictionary.section('synonyms'))
+
+    def __contains__(self, term):
+        return term in self.lexicon
+
+    def lookup(self, term, pos):
+        """
+        Returns the expansions of a term
+        Args:
+            term (str): Term of the index
+            pos  (str): WordNet part of speech of the term, or '' for any other part of speech
+        Returns:
+            (list): Expansion terms, in decreasing order of relevance
+        """
+        entry = self.lexicon.get(term)
+        if entry == None:
+            return []
+        return decode_expansions(self.buf[entry.offset:entry.offset + entry.size])[pos]
+
+class SegmentedSynonymTable:
+    """
+    Synonym tables of the segments of an index (see segments.py). Each segment expands into the
+    terms of every segment before it as well as its own (see index.add_segment), so a term is
+    expanded by the table of the last segment that has it, which is restricted to the same terms as
+    the table of a single index of all the segments.
+
+    Variables:
+        tables (list): Synonym table of each segment that has one, in order
+    """
+    def __init__(self, tables):
+        """
+        Args:
+            tables (list): Synonym table of each segment that has one, in order
+        """
+        self.tables = tables
+
+    def lookup(self, term, pos):
+        """
+        Returns the expansions of a term, see SynonymTable.lookup
+        """
+        for table in reversed(self.tables):
+            if term in table:
+                return table.lookup(term, pos)
+        return []
@@ -0,0 +1,18 @@
+import os
+from batch import output_files, common_directory
+
+def test_query_files_of_the_same_name_get_different_output_files(tmp_path):
+    query_files = [str(tmp_path / 'a' / 'q1.txt'), str(tmp_path / 'b' / 'q1.txt')]
+    base_dir = common_directory(query_files)
+
+    assert base_dir == str(tmp_path)
+    assert output_files(query_files[0], 1, 'out', base_dir) == [os.path.join('out', 'a', 'q1.txt')]
+    assert output_files(query_files[1], 2, 'out', base_dir) == [os.path.join('out', 'b', 'q1_1.txt'),
+        os.path.join('out', 'b', 'q1_2.txt')]
+
+def test_query_files_of_one_directory_keep_their_names(tmp_path):
+    query_files = [str(tmp_path / 'q1.txt'), str(tmp_path / 'q2.txt')]
+    base_dir = common_directory(query_files)
+
+    assert [output_files(query_file, 1, 'out', base_dir) for query_file in query_files] == \
+        [[os.path.join('out', 'q1.txt')], [os.path.join('out', 'q2.txt')]]
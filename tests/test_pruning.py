@@ -0,0 +1,46 @@
+import csv
+import pytest
+from index import build_index
+from search import open_index
+from query import QueryDetails
+
+# Documents 2 and 5 get their title and content postings of the query terms from segments after the
+# first ones, so the top document is only settled once both zones of each segment are accounted for
+DOCUMENTS = [
+    ('0', 'gamma', 'gamma alpha gamma delta delta'),
+    ('1', 'alpha', 'delta'),
+    ('2', 'beta gamma alpha', 'gamma delta beta delta'),
+    ('3', 'beta', 'delta beta delta gamma'),
+    ('4', 'beta delta', 'beta gamma gamma delta'),
+    ('5', 'alpha gamma', 'gamma beta'),
+    ('6', 'gamma alpha delta', 'delta delta'),
+]
+
+@pytest.fixture(scope='module')
+def index_files(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('index')
+    dataset = directory / 'dataset.csv'
+    with open(dataset, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['document_id', 'title', 'content', 'date_posted', 'court'])
+        for document_id, title, content in DOCUMENTS:
+            writer.writerow([document_id, title, content, '2000-01-01', 'SG High Court'])
+
+    out_dict, out_postings = str(directory / 'dictionary.txt'), str(directory / 'postings.txt')
+    build_index(str(dataset), out_dict, out_postings, impact_bits=8, impact_ordered=True)
+    return out_dict, out_postings
+
+@pytest.mark.parametrize('query', ['alpha beta', 'alpha', 'beta gamma', 'alpha delta gamma'])
+@pytest.mark.parametrize('k', [1, 2, 3])
+def test_saat_top_k_matches_exhaustive(index_files, query, k):
+    exhaustive = open_index(*index_files, engine='impact').zone_score(QueryDetails(query, []))
+    score_at_a_time = open_index(*index_files, engine='saat').zone_score(QueryDetails(query, []), k)
+
+    assert {doc_num for doc_num, _ in score_at_a_time} == {doc_num for doc_num, _ in exhaustive[:k]}
+
+def test_saat_top_document_with_later_title_and_content(index_files):
+    exhaustive = open_index(*index_files, engine='impact').zone_score(QueryDetails('alpha beta', []))
+    score_at_a_time = open_index(*index_files, engine='saat').zone_score(QueryDetails('alpha beta', []), 1)
+
+    assert exhaustive[0][0] == 2
+    assert [doc_num for doc_num, _ in score_at_a_time] == [2]
@@ -0,0 +1,75 @@
+import csv
+import threading
+from functools import partial
+from urllib.request import urlopen
+import pytest
+from index import build_index, add_segment, delete_documents, compact_index
+from search import open_index, index_files
+from cache import QueryCache
+from server import QueryServer
+
+DOCUMENTS = [
+    ('246391', 'court appeal', 'the court of appeal dismissed the appeal'),
+    ('246403', 'court', 'court court court'),
+    ('246417', 'contract', 'breach of contract before the court'),
+]
+
+def write_dataset(dataset, documents):
+    with open(dataset, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['document_id', 'title', 'content', 'date_posted', 'court'])
+        for document_id, title, content in documents:
+            writer.writerow([document_id, title, content, '2000-01-01', 'SG High Court'])
+
+@pytest.fixture
+def server(tmp_path):
+    dataset = str(tmp_path / 'dataset.csv')
+    write_dataset(dataset, DOCUMENTS)
+    out_dict, out_postings = str(tmp_path / 'dictionary.txt'), str(tmp_path / 'postings.txt')
+    build_index(dataset, out_dict, out_postings)
+
+    files = index_files(out_dict, out_postings)
+    server = QueryServer(('localhost', 0), partial(open_index, out_dict, out_postings), files,
+        query_cache=QueryCache(files))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server, dataset, out_dict, out_postings
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+def search(server, query):
+    with urlopen(f"http://localhost:{server.server_port}/search?q={query}") as response:
+        return response.read().decode('utf-8').split()
+
+def test_server_reopens_rebuilt_index(server):
+    server, dataset, out_dict, out_postings = server
+    assert search(server, 'court')[0] == '246403'
+
+    write_dataset(dataset, [document for document in DOCUMENTS if document[0] != '246403'])
+    build_index(dataset, out_dict, out_postings)
+
+    results = search(server, 'court')
+    assert '246403' not in results
+    assert sorted(results) == ['246391', '246417']
+    assert server.reopens == 1
+    assert server.query_cache.invalidations == 1
+
+def test_server_searches_segments_tombstones_and_compaction(server, tmp_path):
+    server, dataset, out_dict, out_postings = server
+    assert '246425' not in search(server, 'court')
+
+    new_dataset = str(tmp_path / 'new.csv')
+    write_dataset(new_dataset, [('246425', 'court', 'court court of appeal')])
+    add_segment(new_dataset, out_dict, out_postings)
+    assert '246425' in search(server, 'court')
+
+    ids_file = tmp_path / 'deleted.txt'
+    ids_file.write_text('246403\n')
+    delete_documents(str(ids_file), out_dict, out_postings)
+    segmented = search(server, 'court')
+    assert '246403' not in segmented
+
+    compact_index(out_dict, out_postings)
+    assert search(server, 'court') == segmented
+    assert server.reopens == 3
@@ -0,0 +1,63 @@
+import csv
+from index import build_index, add_segment
+from lexicon import BLOCK_SIZE
+from query import WordnetExpander
+from storage import write_dictionary, DictionaryReader
+from synonyms import build_synonym_table, encode_synonyms, SynonymTable, EXPANSION_POS
+from search import open_index, refine_query
+
+VOCABULARY = {'in', 'vitro', 'fertility', 'embryo', 'pregnancy', 'phone', 'mobile'}
+
+def write_dataset(dataset, documents):
+    with open(dataset, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['document_id', 'title', 'content', 'date_posted', 'court'])
+        for document_id, title, content in documents:
+            writer.writerow([document_id, title, content, '2000-01-01', 'SG High Court'])
+    return str(dataset)
+
+def test_custom_synonym_set_expands_its_words():
+    table = build_synonym_table(VOCABULARY)
+
+    assert set(table['fertility']['n']) >= {'in', 'vitro', 'embryo', 'pregnancy'}
+    assert set(table['phone']['']) == {'phone', 'mobile'}
+
+def test_words_of_multi_word_synonyms_are_not_expanded():
+    table = build_synonym_table(VOCABULARY)
+
+    assert WordnetExpander().get_custom_synonym('in', 6) == []
+    assert 'in' not in table
+    assert 'vitro' not in table
+
+def test_encoded_table_matches_built_table(tmp_path):
+    table = build_synonym_table(VOCABULARY)
+    dictionary_file = str(tmp_path / 'dictionary.txt')
+    header = {'block_size': BLOCK_SIZE, 'synonym_terms': len(table)}
+    write_dictionary(dictionary_file, header, encode_synonyms(table))
+
+    synonyms = SynonymTable.from_dictionary(DictionaryReader(dictionary_file))
+    for term, expansions in table.items():
+        assert term in synonyms
+        for pos in EXPANSION_POS:
+            assert synonyms.lookup(term, pos) == expansions.get(pos, [])
+    assert 'in' not in synonyms
+    assert synonyms.lookup('in', 'n') == []
+
+def test_segmented_index_expands_like_rebuilt_index(tmp_path):
+    first = [('1', 'phone', 'a phone call'), ('2', 'payment', 'payment by cheque')]
+    second = [('3', 'mobile', 'a mobile number'), ('4', 'wallet', 'money in a wallet')]
+    segmented_dict, segmented_postings = str(tmp_path / 'segmented.txt'), str(tmp_path / 'segmented_postings.txt')
+    rebuilt_dict, rebuilt_postings = str(tmp_path / 'rebuilt.txt'), str(tmp_path / 'rebuilt_postings.txt')
+    build_index(write_dataset(tmp_path / 'first.csv', first), segmented_dict, segmented_postings, synonym_table=True)
+    add_segment(write_dataset(tmp_path / 'second.csv', second), segmented_dict, segmented_postings, synonym_table=True)
+    build_index(write_dataset(tmp_path / 'all.csv', first + second), rebuilt_dict, rebuilt_postings, synonym_table=True)
+
+    segmented = open_index(segmented_dict, segmented_postings)
+    rebuilt = open_index(rebuilt_dict, rebuilt_postings)
+    for query in ['phone', 'payment', 'mobile number', 'wallet']:
+        segmented_query = refine_query(query, [], segmented.synonyms)
+        rebuilt_query = refine_query(query, [], rebuilt.synonyms)
+        assert segmented_query.expansions == rebuilt_query.expansions
+        assert [segmented.document_weights.doc_ids[doc_num] for doc_num, _ in segmented.zone_score(segmented_query)] == \
+            [rebuilt.document_weights.doc_ids[doc_num] for doc_num, _ in rebuilt.zone_score(rebuilt_query)]
+    assert 'mobile' in segmented.synonyms.lookup('phone', 'n')
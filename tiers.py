@@ -0,0 +1,124 @@
+from collections import defaultdict
+from models import VectorSpaceModel, TITLE_WEIGHT, cached_postings
+from pruning import BOUND_SLACK
+from compression import decode_doc_stream, decode_stream_group, vb_decode_number
+from documents import TIERS, COURT_IMPORTANCE
+
+# Streams of each tier in the tiers of a posting list: champion list, postings, largest term frequency
+STREAMS_PER_TIER = 3
+
+class TieredVectorSpaceModel(VectorSpaceModel):
+    """
+    VectorSpaceModel for tiered indexes (index.py -t champions), whose posting lists are also split
+    into tiers of documents by court importance (H, M, then L), each with a champion list of its
+    postings with the highest term frequencies.
+
+    Since the court importance multipliers push the documents of higher tiers to the top, the top k
+    documents are looked for one tier at a time, from the highest tier. The search stops once k
+    documents have been found whose scores are at least the upper bound of the scores of the lower
+    tiers (from the largest term frequency of each term in each tier), so lower tiers are only read
+    when the higher tiers cannot fill the top k, and the top k scores are the same as with
+    VectorSpaceModel.
+
+    If the index has champion lists, the champion lists of each tier are scored before the whole
+    tier, and the search also stops if they can fill the top k. This is faster but approximate, as
+    documents are then only scored from the champion lists.
+    """
+    posting_getters = ('get_tier_streams',)
+
+    @cached_postings
+    def get_tier_streams(self, term):
+        """
+        Retrieves the streams of each tier of the posting list of term from posting file
+        Args:
+            term          (str): Target term
+        Returns:
+            (list): Encoded champion list, encoded postings and encoded largest term frequency of each
+                    tier, from the highest tier
+        """
+        entry = self.dictionary[term]
+        if entry.tier_size == 0:
+            raise Exception("Index has no tiers, build it with index.py -t champions")
+
+        offset = entry.offset + entry.doc_size + entry.pos_size + entry.skip_size + entry.impact_size + entry.ordered_size
+        streams = decode_stream_group(self.posting_file.view(offset, entry.tier_size))
+        return [streams[i:i + STREAMS_PER_TIER] for i in range(0, len(streams), STREAMS_PER_TIER)]
+
+    def tier_upper_bound(self, query_vectors, tier_streams, tier):
+        """
+        Returns the maximum score of a document of a tier
+        Args:
+            query_vectors (dict): Dictionary of query terms to weights
+            tier_streams  (dict): Dictionary of query terms to the streams of each of their tiers
+            tier           (int): Index of the tier in TIERS
+        Returns:
+            (float): Upper bound of the scores of the documents of the tier
+        """
+        bound = 0
+        for query_term, wtq in query_vectors.items():
+            max_tf, _ = vb_decode_number(tier_streams[query_term][tier][2], 0)
+            if max_tf > 0:
+                bound += wtq * self.doc_tf_idf.weight(max_tf)
+        # Both zones of a document get at most the bound, and their weights add up to 1
+        return bound * COURT_IMPORTANCE[TIERS[tier]] * (1 + BOUND_SLACK)
+
+    def add_scores(self, scores, query_vectors, posting_lists):
+        """
+        Adds the scores of postings to the scores of documents, in the same order as cosine_score
+        Args:
+            scores         (dict): Dictionary of documentIds to scores
+            query_vectors  (dict): Dictionary of query terms to weights
+            posting_lists  (dict): Dictionary of query terms to their list of documentId - term
+                                   frequency pairs
+        """
+        for query_term, wtq in query_vectors.items():
+            for doc_id, tf in posting_lists[query_term]:
+                scores[doc_id] += wtq * self.doc_tf_idf.weight(tf)
+
+    def zone_score(self, query, k = None, title_a = TITLE_WEIGHT):
+        """
+        Computes the top k (doc_num, score) pairs from the highest tiers that can fill them, see
+        VectorSpaceModel.zone_score
+        Args:
+            query_detail (dict): Dictionary of query terms and frequency
+            k             (int): Top number of results to return
+            title_a     (float): Weight of the title zone, the content zone gets the rest
+        Returns:
+            (list): Descending list of documentId-score pairs by score
+        """
+        if k == None:
+            # Every tier is needed when every document is returned
+            return super().zone_score(query, k, title_a)
+
+        def results(scores):
+            return self.combine_zones(reversed(sorted(self.apply_priors(scores))), title_a)[:k]
+
+        def filled(results, bound):
+            return len(results) >= k and results[-1][1] >= bound
+
+        query_vectors = self.query_weights(query)
+        tier_streams = {query_term: self.get_tier_streams(query_term) for query_term in query_vectors}
+        bounds = [self.tier_upper_bound(query_vectors, tier_streams, tier) for tier in range(len(TIERS))]
+
+        scores = defaultdict(float)
+        for tier in range(len(TIERS)):
+            lower_bound = max(bounds[tier + 1:], default=0)
+            streams = {query_term: tier_streams[query_term][tier] for query_term in query_vectors}
+
+            if any(len(term_streams[0]) > 0 for term_streams in streams.values()):
+                # Documents of different tiers are disjoint, so the champions of this tier can be
+                # added to the scores of the higher tiers
+                champion_scores = defaultdict(float, scores)
+                self.add_scores(champion_scores, query_vectors,
+                    {query_term: decode_doc_stream(term_streams[0]) for query_term, term_streams in streams.items()})
+                champion_results = results(champion_scores)
+                if filled(champion_results, lower_bound):
+                    return champion_results
+
+            self.add_scores(scores, query_vectors,
+                {query_term: decode_doc_stream(term_streams[1]) for query_term, term_streams in streams.items()})
+            tier_results = results(scores)
+            if filled(tier_results, lower_bound):
+                return tier_results
+
+        return tier_results